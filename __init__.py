@@ -6,6 +6,9 @@ ComfyUI-AnimaTool：随 ComfyUI 启动的 Anima Tool Use API
   GET  /anima/schema     - 返回 Tool Schema
   GET  /anima/knowledge  - 返回专家知识
   GET  /anima/health     - 健康检查
+  GET  /anima/jobs       - 排队 / 执行中的任务及 ETA
+  GET  /anima/metrics    - Prometheus 文本格式的各阶段耗时与任务计数
+  GET  /anima/images/{history_id}/{index} - 以二进制返回已保存的图片
 """
 from __future__ import annotations
 
@@ -15,7 +18,21 @@ from pathlib import Path
 
 from aiohttp import web
 
-from .executor import AnimaExecutor, AnimaToolConfig
+from .executor import (
+    AnimaExecutor,
+    AnimaToolConfig,
+    BackendUnavailableError,
+    IdempotencyConflictError,
+    InProcessBackend,
+    JobCancelledError,
+    PromptValidationError,
+    ThrottledError,
+    attach_image_urls,
+    client_identity,
+    normalize_priority,
+    request_scope,
+    run_cancellable,
+)
 
 
 # ComfyUI 的 PromptServer（延迟导入，避免 import 顺序问题）
@@ -27,6 +44,15 @@ def _get_prompt_server():
         return None
 
 
+def _get_comfyui_output_dir():
+    """作为 custom node 运行时，直接取 ComfyUI 的 output 目录（同机模式）。"""
+    try:
+        import folder_paths
+        return Path(folder_paths.get_output_directory())
+    except Exception:
+        return None
+
+
 def _read_text(path: Path) -> str:
     if not path.exists():
         return ""
@@ -46,7 +72,11 @@ def _setup_routes():
 
     # 配置 & 执行器
     config = AnimaToolConfig()
-    executor = AnimaExecutor(config=config)
+    if config.comfyui_output_dir is None:
+        # 与 ComfyUI 同进程：直接从其 output 目录取图，不再经 /view 回环下载
+        config.comfyui_output_dir = _get_comfyui_output_dir()
+    # 同进程：直接向 PromptServer.prompt_queue 提交，不可用时自动退回 HTTP
+    executor = AnimaExecutor(config=config, inprocess=InProcessBackend.from_comfyui())
 
     knowledge_dir = _TOOL_ROOT / "knowledge"
     schema_path = _TOOL_ROOT / "schemas" / "tool_schema_universal.json"
@@ -59,9 +89,28 @@ def _setup_routes():
         return web.json_response({
             "status": "ok",
             "comfyui_url": config.comfyui_url,
+            "execution_mode": "inprocess" if executor.inprocess is not None else "http",
+            "backend": executor.health_status(),
+            "scheduler": executor.scheduler.stats(),
+            "admission": executor.admission.stats(),
             "tool_root": str(_TOOL_ROOT),
         })
 
+    # -------------------------
+    # GET /anima/jobs
+    # -------------------------
+    @routes.get("/anima/jobs")
+    async def anima_jobs(request):
+        items = executor.jobs()
+        return web.json_response({"count": len(items), "jobs": items})
+
+    # -------------------------
+    # GET /anima/metrics
+    # -------------------------
+    @routes.get("/anima/metrics")
+    async def anima_metrics(request):
+        return web.Response(text=executor.metrics_text(), content_type="text/plain")
+
     # -------------------------
     # GET /anima/schema
     # -------------------------
@@ -92,22 +141,97 @@ def _setup_routes():
             body = await request.json()
         except Exception as e:
             return web.json_response({"error": f"JSON parse error: {e}"}, status=400)
+        if not isinstance(body, dict):
+            return web.json_response({"error": "Request body must be a JSON object"}, status=400)
 
-        # 兼容两种格式：直接传 JSON，或 {"payload": {...}}
+        # 兼容两种格式：直接传 JSON，或 {"payload": {...}, "include_base64": bool, "idempotency_key": str, "priority": str}
+        include_base64 = None
+        idempotency_key = request.headers.get("Idempotency-Key")
         if "payload" in body and isinstance(body["payload"], dict):
             payload = body["payload"]
+            if body.get("include_base64") is not None:
+                include_base64 = bool(body["include_base64"])
+            idempotency_key = body.get("idempotency_key") or idempotency_key
+            priority = body.get("priority")
         else:
-            payload = body
+            payload = dict(body)
+            idempotency_key = payload.pop("idempotency_key", None) or idempotency_key
+            priority = payload.pop("priority", None)
+        try:
+            priority = normalize_priority(priority)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
 
+        # 按客户端（X-API-Key / Authorization: Bearer，否则 IP）限制并发与速率
+        client = client_identity(request.headers, request.remote)
         try:
-            # 在线程池中执行同步阻塞操作，避免阻塞 aiohttp 事件循环
-            result = await asyncio.to_thread(executor.generate, payload)
+            executor.admission.acquire(client)
+        except ThrottledError as e:
+            return web.json_response(
+                {"error": str(e), "throttle": e.info},
+                status=429,
+                headers={"Retry-After": str(max(1, round(e.retry_after_s)))},
+            )
+
+        async def is_disconnected() -> bool:
+            transport = request.transport
+            return transport is None or transport.is_closing()
+
+        try:
+            # 在线程池中执行同步阻塞操作，避免阻塞 aiohttp 事件循环；
+            # 客户端断开时撤销 ComfyUI 中的任务（带幂等键的请求除外，重试会挂回同一任务）
+            # X-Request-ID 随 to_thread 带到工作线程，剖析钩子 / trace 据此关联 prompt_id
+            with request_scope(request.headers.get("X-Request-ID")):
+                result = await run_cancellable(
+                    lambda token: executor.generate(
+                        payload,
+                        include_base64=include_base64,
+                        idempotency_key=idempotency_key,
+                        cancel_token=token,
+                        priority=priority,
+                        client=client,
+                    ),
+                    is_disconnected=None if idempotency_key else is_disconnected,
+                )
+        except IdempotencyConflictError as e:
+            return web.json_response({"error": str(e)}, status=409)
+        except JobCancelledError as e:
+            return web.json_response({"error": str(e)}, status=499)
+        except BackendUnavailableError as e:
+            return web.json_response(
+                {"error": str(e)}, status=503, headers={"Retry-After": str(max(1, round(e.retry_after_s)))}
+            )
+        except PromptValidationError as e:
+            return web.json_response({"error": str(e), "errors": e.errors}, status=400)
         except Exception as e:
             return web.json_response({"error": str(e)}, status=500)
+        finally:
+            executor.admission.release(client)
+
+        return web.json_response(attach_image_urls(result, "/anima/images"))
 
-        return web.json_response(result)
+    # -------------------------
+    # GET /anima/images/{history_id}/{index}
+    # -------------------------
+    @routes.get("/anima/images/{history_id}/{index}")
+    async def anima_image(request):
+        try:
+            history_id = int(request.match_info["history_id"])
+            index = int(request.match_info["index"])
+        except ValueError:
+            return web.json_response({"error": "history_id / index 必须是整数"}, status=400)
+
+        path = await asyncio.to_thread(executor.get_history_image_path, history_id, index)
+        if path is None:
+            return web.json_response({"error": f"图片不存在：#{history_id}/{index}"}, status=404)
+        # FileResponse 自带 ETag / Last-Modified / Range，并在可用时使用 sendfile；
+        # 同一 URL 的图片可能被覆盖（例如同名输出），每次按 ETag 重新校验
+        return web.FileResponse(path, headers={
+            "Content-Type": executor._get_mime_type(path.name),
+            "Cache-Control": "no-cache",
+        })
 
-    print("[ComfyUI-AnimaTool] Routes registered: /anima/health, /anima/schema, /anima/knowledge, /anima/generate")
+    print("[ComfyUI-AnimaTool] Routes registered: /anima/health, /anima/jobs, /anima/metrics, /anima/schema, /anima/knowledge, /anima/generate, /anima/images")
 
 
 # ComfyUI 加载 custom_nodes 时会 import 这个模块
@@ -0,0 +1,5 @@
+"""
+性能基准：本地 ComfyUI 替身（stub_comfyui）与端到端压测（e2e）。
+
+不属于测试；结果写成 JSON，便于在版本之间比较。
+"""
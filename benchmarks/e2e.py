@@ -0,0 +1,505 @@
+"""
+端到端基准：启动 ComfyUI 替身（stub_comfyui，子进程），按不同并发与 repeat 驱动各前端，
+统计吞吐、p50 / p95 / p99 延迟与峰值内存，结果保存为 JSON 以便在版本之间比较。
+
+被测对象（--targets）：
+  executor - 直接调用 AnimaExecutor.generate()（工作线程中，repeat 在客户端循环）
+  fastapi  - servers.http_server 的 POST /generate（httpx ASGITransport，进程内，不经网络）
+  aiohttp  - ComfyUI 扩展的 POST /anima/generate（挂在独立 aiohttp 应用上，经本机 TCP；
+             该接口不支持 repeat，按 repeat 次数依次请求）
+  mcp      - servers.mcp_server 的 generate_anima_image 工具处理函数（不经 stdio）
+
+示例（在 ComfyUI-AnimaTool 目录下）：
+    python -m benchmarks.e2e --latency 0.2 --concurrency 1,4,16 --repeat 1,4 --requests 32
+    python -m benchmarks.e2e --targets fastapi --compare benchmarks/results/e2e-20261001-120000.json
+
+历史记录与图片写到临时目录，不影响 outputs/ 下的真实历史。
+ANIMATOOL_* 环境变量照常生效（未设置时本脚本把 ANIMATOOL_POLL_INTERVAL 设为 0.1、
+ANIMATOOL_CLIENT_MAX_CONCURRENT 设为 0），实际取值记录在结果的 meta.env 中。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+TARGETS = ("executor", "fastapi", "aiohttp", "mcp")
+
+PAYLOAD: Dict[str, Any] = {
+    "aspect_ratio": "1:1",
+    "quality_meta_year_safe": "masterpiece, best quality, newest, year 2024, safe",
+    "count": "1girl",
+    "artist": "@fkey",
+    "tags": "upper body, smile, white dress",
+    "environment": "outdoors, garden",
+    "neg": "worst quality, low quality, blurry, bad hands, nsfw",
+    "steps": 20,
+}
+
+# 一次请求：(工作协程编号, repeat) -> 产出的图片数
+Call = Callable[[int, int], Awaitable[int]]
+
+
+# -------------------------
+# 环境
+# -------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def stub_server(args: argparse.Namespace) -> Iterator[str]:
+    """以子进程启动 ComfyUI 替身（不与被测进程争用 GIL / 内存统计），返回其地址。"""
+    if args.comfyui_url:
+        yield args.comfyui_url.rstrip("/")
+        return
+    port = args.stub_port or _free_port()
+    cmd = [
+        sys.executable, "-m", "benchmarks.stub_comfyui",
+        "--port", str(port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--entropy", str(args.entropy),
+    ]
+    if args.image_size:
+        cmd += ["--image-size", args.image_size]
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                with urllib.request.urlopen(url + "/system_stats", timeout=1):
+                    break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    err = proc.stderr.read().decode("utf-8", "replace") if proc.stderr else ""
+                    raise RuntimeError(f"ComfyUI 替身启动失败：{err}")
+                time.sleep(0.1)
+        yield url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _configure_env(comfyui_url: str, workdir: Path) -> Dict[str, str]:
+    os.environ["COMFYUI_URL"] = comfyui_url
+    os.environ["ANIMATOOL_OUTPUT_DIR"] = str(workdir / "outputs")
+    os.environ.setdefault("ANIMATOOL_POLL_INTERVAL", "0.1")
+    os.environ.setdefault("ANIMATOOL_CLIENT_MAX_CONCURRENT", "0")
+    return {k: v for k, v in sorted(os.environ.items()) if k.startswith("ANIMATOOL_") or k == "COMFYUI_URL"}
+
+
+def isolate_history(workdir: Path) -> None:
+    """让各前端新建的执行器把历史写到临时目录下各自的子目录（按配置的后端，忽略 ANIMATOOL_HISTORY_DIR）。"""
+    from executor import anima_executor
+    from executor.history import create_history_manager
+
+    counter = iter(range(1_000_000))
+
+    def create(backend: str = "jsonl", maxlen: int = 50, history_dir: Any = None, **options: Any) -> Any:
+        history_dir = workdir / f"history-{next(counter)}"
+        history_dir.mkdir(parents=True, exist_ok=True)
+        return create_history_manager(backend, maxlen, history_dir=history_dir, **options)
+
+    anima_executor.create_history_manager = create
+
+
+# -------------------------
+# 被测对象
+# -------------------------
+def _count_images(result: Dict[str, Any]) -> int:
+    if "results" in result:
+        return sum(len(r.get("images") or []) for r in result["results"])
+    return len(result.get("images") or [])
+
+
+async def make_executor_call() -> Tuple[Call, Callable[[], Awaitable[None]]]:
+    from executor import AnimaExecutor
+
+    executor = AnimaExecutor()
+
+    def run(worker: int, repeat: int) -> int:
+        images = 0
+        for _ in range(repeat):
+            result = executor.generate(dict(PAYLOAD), client=f"bench:{worker}")
+            images += _count_images(result)
+        return images
+
+    async def call(worker: int, repeat: int) -> int:
+        return await asyncio.to_thread(run, worker, repeat)
+
+    async def close() -> None:
+        executor.history.close()
+
+    return call, close
+
+
+async def make_fastapi_call() -> Tuple[Call, Callable[[], Awaitable[None]]]:
+    import httpx
+
+    from servers.http_server import create_app
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()), base_url="http://bench", timeout=None)
+
+    async def call(worker: int, repeat: int) -> int:
+        resp = await client.post(
+            "/generate",
+            json={"payload": dict(PAYLOAD, repeat=repeat)},
+            headers={"X-API-Key": f"bench-{worker}"},
+        )
+        resp.raise_for_status()
+        return _count_images(resp.json())
+
+    async def close() -> None:
+        await client.aclose()
+
+    return call, close
+
+
+def _load_extension(routes: Any) -> None:
+    """以 ComfyUI 加载 custom node 的方式导入扩展，路由注册到给定的 RouteTableDef 上。"""
+    import executor as executor_pkg
+
+    server_module = types.ModuleType("server")
+    server_module.PromptServer = types.SimpleNamespace(instance=types.SimpleNamespace(routes=routes))
+    name = "animatool_bench_ext"
+    # 复用已导入的 executor 包（历史隔离等设置对扩展同样生效）
+    sys.modules[f"{name}.executor"] = executor_pkg
+    sys.modules["server"] = server_module
+    try:
+        spec = importlib.util.spec_from_file_location(
+            name, ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.modules.pop("server", None)
+
+
+async def make_aiohttp_call() -> Tuple[Call, Callable[[], Awaitable[None]]]:
+    import aiohttp
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    routes = web.RouteTableDef()
+    _load_extension(routes)
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.add_routes(routes)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+    url = str(server.make_url("/anima/generate"))
+
+    async def call(worker: int, repeat: int) -> int:
+        images = 0
+        for _ in range(repeat):
+            async with session.post(url, json={"payload": dict(PAYLOAD)}, headers={"X-API-Key": f"bench-{worker}"}) as resp:
+                body = await resp.json()
+                if resp.status != 200:
+                    raise RuntimeError(f"HTTP {resp.status}: {body}")
+                images += _count_images(body)
+        return images
+
+    async def close() -> None:
+        await session.close()
+        await server.close()
+
+    return call, close
+
+
+async def make_mcp_call() -> Tuple[Call, Callable[[], Awaitable[None]]]:
+    from mcp.types import ImageContent, TextContent
+
+    from servers import mcp_server
+
+    async def call(worker: int, repeat: int) -> int:
+        contents = await mcp_server.call_tool("generate_anima_image", dict(PAYLOAD, repeat=repeat))
+        for item in contents:
+            if isinstance(item, TextContent) and item.text.startswith(("错误", "参数错误")):
+                raise RuntimeError(item.text)
+        return sum(1 for item in contents if isinstance(item, ImageContent))
+
+    async def close() -> None:
+        if mcp_server._executor is not None:
+            mcp_server._executor.history.close()
+
+    return call, close
+
+
+FACTORIES: Dict[str, Callable[[], Awaitable[Tuple[Call, Callable[[], Awaitable[None]]]]]] = {
+    "executor": make_executor_call,
+    "fastapi": make_fastapi_call,
+    "aiohttp": make_aiohttp_call,
+    "mcp": make_mcp_call,
+}
+
+
+# -------------------------
+# 测量
+# -------------------------
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # 非 Linux：只能取进程生命周期内的峰值（macOS 为字节，其余为 KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _MemorySampler:
+    """后台线程定期采样 RSS，取场景内的峰值。"""
+
+    def __init__(self, interval_s: float = 0.02):
+        self.interval_s = interval_s
+        self.start = self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-rss", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __enter__(self) -> "_MemorySampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值分位数（q 取 0~100）。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+async def run_scenario(call: Call, concurrency: int, repeat: int, requests: int, trace_memory: bool) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    images = 0
+    pending = iter(range(requests))
+
+    async def worker(index: int) -> None:
+        nonlocal images
+        for _ in pending:
+            started = time.perf_counter()
+            try:
+                # 先 await 再累加：`images += await ...` 会在挂起前读取 images，并发时丢失计数
+                produced = await call(index, repeat)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}"[:300])
+                continue
+            latencies.append(time.perf_counter() - started)
+            images += produced
+
+    if trace_memory:
+        tracemalloc.start()
+    with _MemorySampler() as memory:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        wall = time.perf_counter() - started
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    ms = [x * 1000.0 for x in latencies]
+    return {
+        "concurrency": concurrency,
+        "repeat": repeat,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "images": images,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall > 0 else 0.0,
+        "images_per_s": round(images / wall, 3) if wall > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 2) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 2),
+            "p95": round(percentile(ms, 95), 2),
+            "p99": round(percentile(ms, 99), 2),
+            "max": round(max(ms), 2) if ms else 0.0,
+        },
+        "peak_rss_mb": round(memory.peak / 2**20, 1),
+        "rss_growth_mb": round((memory.peak - memory.start) / 2**20, 1),
+        "peak_traced_mb": round(traced_peak / 2**20, 1) if traced_peak is not None else None,
+    }
+
+
+# -------------------------
+# 输出
+# -------------------------
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), capture_output=True, text=True, timeout=5
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _project_version() -> Optional[str]:
+    try:
+        for line in (ROOT / "pyproject.toml").read_text(encoding="utf-8").splitlines():
+            if line.startswith("version"):
+                return line.split("=", 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return None
+
+
+def _row(result: Dict[str, Any]) -> str:
+    lat = result["latency_ms"]
+    return (
+        f"{result['target']:<9} c={result['concurrency']:<3} r={result['repeat']:<3} "
+        f"ok={result['succeeded']:<4} err={result['errors']:<3} "
+        f"{result['throughput_rps']:>8.2f} req/s {result['images_per_s']:>8.2f} img/s  "
+        f"p50={lat['p50']:>9.1f} p95={lat['p95']:>9.1f} p99={lat['p99']:>9.1f} ms  "
+        f"rss={result['peak_rss_mb']:>7.1f} MB"
+    )
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """按 (target, concurrency, repeat) 对比两份结果的吞吐与 p95。"""
+    def key(r: Dict[str, Any]) -> Tuple[str, int, int]:
+        return r["target"], r["concurrency"], r["repeat"]
+
+    before = {key(r): r for r in old.get("results") or []}
+    lines = [f"对比 {old.get('meta', {}).get('git') or '?'} → {new.get('meta', {}).get('git') or '?'}"]
+    for r in new.get("results") or []:
+        o = before.get(key(r))
+        if o is None:
+            continue
+
+        def delta(a: float, b: float) -> str:
+            return f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+
+        lines.append(
+            f"{r['target']:<9} c={r['concurrency']:<3} r={r['repeat']:<3} "
+            f"throughput {o['throughput_rps']:.2f} → {r['throughput_rps']:.2f} ({delta(o['throughput_rps'], r['throughput_rps'])})  "
+            f"p95 {o['latency_ms']['p95']:.1f} → {r['latency_ms']['p95']:.1f} ms ({delta(o['latency_ms']['p95'], r['latency_ms']['p95'])})"
+        )
+    return lines
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+async def run(args: argparse.Namespace, comfyui_url: str, workdir: Path) -> Dict[str, Any]:
+    env = _configure_env(comfyui_url, workdir)
+    isolate_history(workdir)
+
+    results: List[Dict[str, Any]] = []
+    for target in args.targets:
+        call, close = await FACTORIES[target]()
+        try:
+            # 预热：首个请求包含 /object_info 拉取、耗时模型初始化等一次性开销
+            for _ in range(args.warmup):
+                await call(0, 1)
+            for concurrency in args.concurrency:
+                for repeat in args.repeat:
+                    result = {"target": target}
+                    result.update(await run_scenario(call, concurrency, repeat, args.requests, args.tracemalloc))
+                    results.append(result)
+                    print(_row(result), flush=True)
+        finally:
+            await close()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": _project_version(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "comfyui": comfyui_url if args.comfyui_url else {
+                "stub": True, "latency_s": args.latency, "jitter": args.jitter,
+                "image_size": args.image_size or None, "entropy": args.entropy,
+            },
+            "requests_per_scenario": args.requests,
+            "warmup": args.warmup,
+            "env": env,
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="AnimaTool 端到端基准（ComfyUI 替身）")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"逗号分隔：{', '.join(TARGETS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="并发数列表，如 1,4,16")
+    parser.add_argument("--repeat", default="1,4", help="每个请求的 repeat 列表，如 1,4")
+    parser.add_argument("--requests", type=int, default=16, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=1, help="每个被测对象的预热请求数")
+    parser.add_argument("--latency", type=float, default=0.2, help="替身的单任务执行耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="替身执行耗时的随机浮动比例")
+    parser.add_argument("--image-size", default="", help="替身的固定输出尺寸，如 1024x1024（默认按 workflow）")
+    parser.add_argument("--entropy", type=float, default=0.5, help="替身 PNG 的随机程度（决定文件大小）")
+    parser.add_argument("--stub-port", type=int, default=0, help="替身端口（默认随机空闲端口）")
+    parser.add_argument("--comfyui-url", default="", help="改为压测已有的 ComfyUI（不启动替身）")
+    parser.add_argument("--tracemalloc", action="store_true", help="同时统计 Python 分配峰值（明显变慢）")
+    parser.add_argument("--output", default="", help="结果 JSON 路径（默认 benchmarks/results/e2e-<时间>.json）")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    args.targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in args.targets if t not in FACTORIES]
+    if unknown:
+        parser.error(f"未知的 target：{', '.join(unknown)}（可用：{', '.join(TARGETS)}）")
+    args.concurrency = _int_list(args.concurrency)
+    args.repeat = _int_list(args.repeat)
+
+    with tempfile.TemporaryDirectory(prefix="animatool-bench-") as tmp, stub_server(args) as url:
+        report = asyncio.run(run(args, url, Path(tmp)))
+
+    output = Path(args.output) if args.output else ROOT / "benchmarks" / "results" / f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存：{output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(previous, report)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+合成生成历史：写出与 HistoryManager 相同格式的 history.jsonl（每行一条 GenerationRecord.to_dict()）。
+
+参数、提示词与 timings 的形状与真实记录一致（画师 / tag / 比例 / LoRA 随机组合），
+id 从 1 递增、时间戳从 --start 起按 --interval 递增，便于测试按 id / 日期的查找与检索。
+
+    python -m benchmarks.gen_history outputs-bench/history.jsonl --records 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from executor.anima_executor import build_anima_positive_text, estimate_size_from_ratio  # noqa: E402
+from executor.history import GenerationRecord  # noqa: E402
+
+ARTISTS = ["@fkey", "@jima", "@wlop", "@ask (askzy)", "@kantoku", "@mika pikazo", "@ningen mame", "@void_0"]
+CHARACTERS = ["", "", "hatsune miku", "kafka (honkai: star rail)", "frieren", "rem (re:zero)"]
+TAGS = [
+    "smile", "looking at viewer", "upper body", "full body", "white dress", "long hair", "short hair",
+    "blue eyes", "red eyes", "school uniform", "hoodie", "holding umbrella", "sitting", "standing",
+    "from side", "dutch angle", "wind", "floating hair", "hand up", "closed eyes", "open mouth",
+]
+ENVIRONMENTS = ["outdoors, garden", "indoors, classroom", "night, city lights", "rain, street", "beach, sunset", "simple background"]
+RATIOS = ["1:1", "16:9", "9:16", "3:4", "4:3", "2:3"]
+LORAS = ["style/watercolor.safetensors", "style/flat_color.safetensors", "chara/bench_a.safetensors"]
+
+
+def make_record(record_id: int, timestamp: datetime, rng: random.Random) -> GenerationRecord:
+    params: Dict[str, Any] = {
+        "quality_meta_year_safe": "masterpiece, best quality, newest, year 2024, safe",
+        "count": rng.choice(["1girl", "1girl", "1boy", "2girls"]),
+        "character": rng.choice(CHARACTERS),
+        "artist": rng.choice(ARTISTS),
+        "tags": ", ".join(rng.sample(TAGS, rng.randint(3, 8))),
+        "environment": rng.choice(ENVIRONMENTS),
+        "neg": "worst quality, low quality, blurry, bad hands, nsfw",
+        "aspect_ratio": rng.choice(RATIOS),
+    }
+    if rng.random() < 0.2:
+        params["loras"] = [{"name": name, "weight": round(rng.uniform(0.4, 1.0), 2)} for name in rng.sample(LORAS, rng.randint(1, 2))]
+    width, height = estimate_size_from_ratio(aspect_ratio=params["aspect_ratio"])
+    seed = rng.getrandbits(32)
+    execute_s = round(rng.uniform(4.0, 12.0), 3)
+    prefix = f"AnimaTool_{record_id:05d}"
+    return GenerationRecord(
+        id=record_id,
+        timestamp=timestamp.isoformat(),
+        params=params,
+        positive_text=build_anima_positive_text(params),
+        negative_text=params["neg"],
+        prompt_id=f"{rng.getrandbits(128):032x}",
+        seed=seed,
+        width=width,
+        height=height,
+        images=[f"/data/outputs/{prefix}_.png"],
+        timings={
+            "queue_wait_s": 0.0, "submit_s": 0.012, "comfy_s": round(execute_s + 0.05, 3), "execute_s": execute_s,
+            "download_s": 0.021, "disk_write_s": 0.003, "encode_s": 0.001, "total_s": round(execute_s + 0.2, 3),
+            "predicted_s": round(execute_s * rng.uniform(0.8, 1.2), 2),
+            "job": {"backend": "http", "width": width, "height": height, "steps": 25, "batch": 1,
+                    "loras": len(params.get("loras") or []), "img2img": False},
+        },
+    )
+
+
+def iter_records(records: int, seed: int = 0, start: Optional[datetime] = None, interval_s: float = 30.0) -> Iterator[GenerationRecord]:
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1)
+    for i in range(records):
+        yield make_record(i + 1, start + timedelta(seconds=i * interval_s), rng)
+
+
+def generate_history(path: Path, records: int, seed: int = 0, start: Optional[datetime] = None, interval_s: float = 30.0) -> Path:
+    """写出 records 条记录（覆盖已有文件；同目录下的偏移索引 / seq 等 sidecar 一并删除）。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for sidecar in (".idx", ".seq", ".lock"):
+        path.with_name(path.name + sidecar).unlink(missing_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        batch = []
+        for record in iter_records(records, seed, start, interval_s):
+            batch.append(json.dumps(record.to_dict(), ensure_ascii=False))
+            if len(batch) >= 10000:
+                f.write("\n".join(batch) + "\n")
+                batch.clear()
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    return path
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="生成合成的 history.jsonl")
+    parser.add_argument("path", help="输出文件路径")
+    parser.add_argument("--records", type=int, default=10000, help="记录条数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--start", default="2025-01-01T00:00:00", help="首条记录的时间戳（ISO）")
+    parser.add_argument("--interval", type=float, default=30.0, help="相邻记录的时间间隔（秒）")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    path = generate_history(Path(args.path), args.records, args.seed, datetime.fromisoformat(args.start), args.interval)
+    size_mb = path.stat().st_size / 2**20
+    print(f"已生成 {args.records} 条记录：{path}（{size_mb:.1f} MB，{time.perf_counter() - started:.1f}s）")
+
+
+if __name__ == "__main__":
+    main()
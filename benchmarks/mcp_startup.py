@@ -0,0 +1,220 @@
+"""
+MCP stdio 服务冷启动基准：像 MCP 客户端一样启动 servers/mcp_server.py，经 stdio 依次发送
+initialize、tools/list 与一次 tools/call（list_anima_history，不需要 ComfyUI），
+记录从启动进程到各响应的耗时；另在独立进程中测量 `import servers.mcp_server` 本身的耗时。
+
+    python -m benchmarks.mcp_startup --runs 10
+    python -m benchmarks.mcp_startup --budget-ms 1500      # tools/list 中位耗时超出预算时退出码为 1
+    python -m benchmarks.mcp_startup --importtime          # 额外列出累计导入耗时最高的模块
+
+服务从临时目录中的 executor/ 与 servers/ 副本启动，tools/call 读取的是 outputs/ 下真实历史的副本：
+HistoryManager 会在历史旁创建 .lock / .seq 等文件，不应碰到真实的 outputs/。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.e2e import _git_revision, _project_version, percentile  # noqa: E402
+
+PROTOCOL_VERSION = "2025-06-18"
+STAGES = ("initialize", "tools_list", "first_call")
+
+
+def _send(proc: subprocess.Popen, message: Dict[str, Any]) -> None:
+    proc.stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+    proc.stdin.flush()
+
+
+def _read_response(proc: subprocess.Popen, request_id: int) -> Dict[str, Any]:
+    """读到指定 id 的响应为止（跳过服务端通知）；stdout 上出现非 JSON-RPC 内容即视为失败"""
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"MCP 服务提前退出（exit={proc.poll()}）")
+        try:
+            message = json.loads(line)
+        except ValueError:
+            raise RuntimeError(f"MCP 服务向 stdout 输出了非 JSON 内容：{line[:200]!r}") from None
+        if not isinstance(message, dict):
+            raise RuntimeError(f"MCP 服务向 stdout 输出了非 JSON-RPC 消息：{line[:200]!r}")
+        if message.get("id") == request_id:
+            if "error" in message:
+                raise RuntimeError(f"请求 {request_id} 出错：{message['error']}")
+            return message
+
+
+def prepare_workdir(workdir: Path) -> Path:
+    """把 executor/、servers/ 与 outputs/ 下的历史复制到 workdir，返回其中的 mcp_server.py。"""
+    for name in ("executor", "servers"):
+        shutil.copytree(ROOT / name, workdir / name)
+    outputs = workdir / "outputs"
+    outputs.mkdir()
+    source = ROOT / "outputs"
+    if source.is_dir():
+        for p in source.glob("history*"):
+            if p.is_file() and p.suffix != ".lock":
+                shutil.copy2(p, outputs / p.name)
+    return workdir / "servers" / "mcp_server.py"
+
+
+def measure_session(server: Path, timeout_s: float) -> Dict[str, float]:
+    """启动一次服务并完成握手 + 首次调用，返回各阶段距进程启动的毫秒数。"""
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(server)],
+        cwd=str(server.parent.parent),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    # 超时保护：readline 会一直阻塞
+    killer = threading.Timer(timeout_s, proc.kill)
+    killer.start()
+    marks: Dict[str, float] = {}
+    try:
+        _send(proc, {
+            "jsonrpc": "2.0", "id": 1, "method": "initialize",
+            "params": {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": "animatool-bench", "version": "0"},
+            },
+        })
+        _read_response(proc, 1)
+        marks["initialize"] = time.perf_counter()
+        _send(proc, {"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+        _send(proc, {"jsonrpc": "2.0", "id": 2, "method": "tools/list", "params": {}})
+        tools = _read_response(proc, 2)["result"]["tools"]
+        marks["tools_list"] = time.perf_counter()
+        if not tools:
+            raise RuntimeError("tools/list 返回空列表")
+
+        _send(proc, {
+            "jsonrpc": "2.0", "id": 3, "method": "tools/call",
+            "params": {"name": "list_anima_history", "arguments": {"limit": 1}},
+        })
+        _read_response(proc, 3)
+        marks["first_call"] = time.perf_counter()
+    finally:
+        killer.cancel()
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return {name: (t - started) * 1000.0 for name, t in marks.items()}
+
+
+def measure_import() -> float:
+    """在新进程中测 `import servers.mcp_server` 的耗时（毫秒，不含解释器自身启动）"""
+    code = "import time; t = time.perf_counter(); import servers.mcp_server; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=str(ROOT), capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int = 15) -> List[Dict[str, Any]]:
+    """-X importtime：累计耗时最高的模块"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import servers.mcp_server"],
+        cwd=str(ROOT), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        rows.append({"module": name, "self_ms": int(self_us) / 1000.0, "cumulative_ms": int(cumulative_us) / 1000.0})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "median": round(statistics.median(values), 1),
+        "p95": round(percentile(values, 95), 1),
+        "min": round(min(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="MCP stdio 服务冷启动基准")
+    parser.add_argument("--runs", type=int, default=5, help="启动次数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单次会话超时（秒）")
+    parser.add_argument("--budget-ms", type=float, default=0.0, help="tools/list 中位耗时预算（毫秒，0 为不检查）")
+    parser.add_argument("--importtime", action="store_true", help="列出累计导入耗时最高的模块")
+    parser.add_argument("--output", default="", help="结果 JSON 路径（默认 benchmarks/results/mcp-startup-<时间>.json）")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import() for _ in range(args.runs)]
+    with tempfile.TemporaryDirectory(prefix="animatool-mcp-startup-") as tmp:
+        server = prepare_workdir(Path(tmp))
+        # 预热一次（磁盘缓存、.pyc），不计入
+        measure_session(server, args.timeout)
+        sessions = [measure_session(server, args.timeout) for _ in range(args.runs)]
+    summary = {"import": _summary(imports)}
+    for stage in STAGES:
+        summary[stage] = _summary([s[stage] for s in sessions])
+
+    for name, stats in summary.items():
+        print(f"{name:<12} median={stats['median']:>8.1f} p95={stats['p95']:>8.1f} min={stats['min']:>8.1f} max={stats['max']:>8.1f} ms")
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": _project_version(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "runs": args.runs,
+        },
+        "summary": summary,
+        "sessions": [{k: round(v, 1) for k, v in s.items()} for s in sessions],
+    }
+    if args.importtime:
+        report["top_imports"] = top_imports()
+        for row in report["top_imports"]:
+            print(f"  {row['cumulative_ms']:>8.1f} ms  {row['module']}")
+
+    output = Path(args.output) if args.output else ROOT / "benchmarks" / "results" / f"mcp-startup-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存：{output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8")).get("summary") or {}
+        for name, stats in summary.items():
+            old = (previous.get(name) or {}).get("median")
+            if old:
+                print(f"{name:<12} {old:>8.1f} → {stats['median']:>8.1f} ms ({(stats['median'] - old) / old * 100:+.1f}%)")
+
+    if args.budget_ms and summary["tools_list"]["median"] > args.budget_ms:
+        print(f"tools/list 中位耗时 {summary['tools_list']['median']:.1f} ms 超出预算 {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
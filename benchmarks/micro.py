@@ -0,0 +1,302 @@
+"""
+微基准：GPU 不是瓶颈时占 CPU 的纯 Python 路径，离线运行（不访问 ComfyUI）。
+
+覆盖：
+  estimate_size_from_ratio / build_anima_positive_text
+  AnimaExecutor._inject（0~20 个 LoRA）
+  AnimaExecutor._extract_images（1~16 张图）
+  AnimaExecutor._build_image_entries（结果中的图片信息，含 / 不含 base64）
+  HistoryManager 的 load（构造）/ get（窗口内、窗口外）/ list_recent / add，
+  历史规模由 --history-sizes 指定（合成数据，见 gen_history）
+
+每项报告单次耗时（中位数 / p95 / 均值，微秒）、每秒次数，以及 tracemalloc 统计的
+单次分配峰值与残留（KB）。结果保存为 JSON，--compare 按名称对比中位耗时。
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter inject,history --history-sizes 1000,1000000 --history-dir /tmp/anima-hist
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.e2e import _git_revision, _project_version, isolate_history, percentile  # noqa: E402
+from benchmarks.gen_history import generate_history  # noqa: E402
+from benchmarks.stub_comfyui import make_png  # noqa: E402
+
+PAYLOAD: Dict[str, Any] = {
+    "aspect_ratio": "3:4",
+    "quality_meta_year_safe": "masterpiece, best quality, newest, year 2024, safe",
+    "count": "1girl",
+    "character": "hatsune miku",
+    "series": "vocaloid",
+    "artist": "@fkey, @jima",
+    "style": "watercolor",
+    "appearance": "long hair, twintails, aqua eyes",
+    "tags": "upper body, smile, white dress, looking at viewer, wind, floating hair",
+    "environment": "outdoors, garden, flowers, sunlight",
+    "nltags": "A girl standing in a garden on a sunny afternoon.",
+    "neg": "worst quality, low quality, blurry, bad hands, nsfw",
+    "steps": 25,
+}
+
+
+class Bench:
+    """收集各项结果；min_time 控制计时阶段的最短时长，alloc_runs 为统计分配的调用次数。"""
+
+    def __init__(self, min_time: float, alloc_runs: int, name_filter: List[str]):
+        self.min_time = min_time
+        self.alloc_runs = alloc_runs
+        self.name_filter = name_filter
+        self.results: List[Dict[str, Any]] = []
+
+    def wanted(self, name: str) -> bool:
+        return not self.name_filter or any(f in name for f in self.name_filter)
+
+    def run(self, name: str, fn: Callable[[], Any], max_calls: int = 1_000_000, **extra: Any) -> None:
+        if not self.wanted(name):
+            return
+        fn()  # 预热（首次调用的缓存 / 索引构建不计入）
+
+        # 计时：逐次 perf_counter_ns，至少 min_time 秒且至少 5 次
+        samples: List[float] = []
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            deadline = time.perf_counter() + self.min_time
+            while len(samples) < max_calls and (len(samples) < 5 or time.perf_counter() < deadline):
+                t0 = time.perf_counter_ns()
+                fn()
+                samples.append((time.perf_counter_ns() - t0) / 1000.0)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        # 分配：单次调用期间的峰值与调用结束后的残留
+        peaks: List[int] = []
+        retained: List[int] = []
+        tracemalloc.start()
+        try:
+            for _ in range(min(self.alloc_runs, max_calls)):
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                out = fn()
+                current, peak = tracemalloc.get_traced_memory()
+                del out
+                peaks.append(peak - before)
+                retained.append(current - before)
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "name": name,
+            "calls": len(samples),
+            "median_us": round(statistics.median(samples), 2),
+            "p95_us": round(percentile(samples, 95), 2),
+            "mean_us": round(statistics.fmean(samples), 2),
+            "ops_per_s": round(1e6 / statistics.fmean(samples), 1),
+            "alloc_peak_kb": round(statistics.median(peaks) / 1024, 2),
+            "alloc_retained_kb": round(statistics.median(retained) / 1024, 2),
+        }
+        result.update(extra)
+        self.results.append(result)
+        print(
+            f"{name:<44} {result['median_us']:>12.2f} {result['p95_us']:>12.2f} {result['ops_per_s']:>12.1f} "
+            f"{result['alloc_peak_kb']:>12.2f} {result['alloc_retained_kb']:>12.2f}",
+            flush=True,
+        )
+
+
+# -------------------------
+# 纯函数 / 执行器
+# -------------------------
+def bench_prompt(bench: Bench) -> None:
+    from executor.anima_executor import build_anima_positive_text, estimate_size_from_ratio
+
+    ratios = iter(["1:1", "16:9", "9:16", "3:4", "4:3", "21:9"] * 1_000_000)
+    bench.run("estimate_size_from_ratio", lambda: estimate_size_from_ratio(aspect_ratio=next(ratios)))
+    bench.run("build_anima_positive_text", lambda: build_anima_positive_text(PAYLOAD))
+
+
+def _lora_list(count: int) -> List[Dict[str, Any]]:
+    return [{"name": f"bench/style_{i:02d}.safetensors", "weight": 0.8} for i in range(count)]
+
+
+def bench_executor(bench: Bench, image_sizes: List[str], entropy: float) -> None:
+    from executor import AnimaExecutor
+    from executor.anima_executor import GeneratedImage
+
+    executor = AnimaExecutor()
+    # 离线：LoRA 名称规范化需要的远端分隔符直接给定（否则会请求 /models/loras）
+    executor._remote_model_path_sep_cache["loras"] = "/"
+    try:
+        for count in (0, 1, 5, 10, 20):
+            prompt = dict(PAYLOAD, loras=_lora_list(count))
+            bench.run(f"_inject loras={count}", lambda prompt=prompt: executor._inject(prompt))
+
+        for count in (1, 4, 16):
+            history_item = {
+                "outputs": {
+                    "9": {"images": [
+                        {"filename": f"AnimaTool_{i:05d}_.png", "subfolder": "bench", "type": "output"} for i in range(count)
+                    ]},
+                    "19": {"latent": [{}]},
+                },
+            }
+            bench.run(f"_extract_images images={count}", lambda item=history_item: executor._extract_images("p", item))
+
+        for size in image_sizes:
+            width, height = (int(x) for x in size.lower().split("x"))
+            content = make_png(width, height, entropy=entropy)
+            for count in (1, 4):
+                images = [
+                    GeneratedImage(
+                        filename=f"AnimaTool_{i:05d}_.png", subfolder="", folder_type="output",
+                        view_url=f"http://127.0.0.1:8188/view?filename=AnimaTool_{i:05d}_.png",
+                        saved_path=f"/data/outputs/AnimaTool_{i:05d}_.png", content=content,
+                    )
+                    for i in range(count)
+                ]
+                bench.run(
+                    f"_build_image_entries base64 {size} x{count}",
+                    lambda images=images: executor._build_image_entries(images, True),
+                    image_kb=len(content) // 1024,
+                )
+        # 不内嵌 base64 时只剩 dict 构建（与图片大小无关）
+        images = [
+            GeneratedImage(filename=f"AnimaTool_{i:05d}_.png", subfolder="", folder_type="output",
+                           view_url=f"http://127.0.0.1:8188/view?filename=AnimaTool_{i:05d}_.png")
+            for i in range(4)
+        ]
+        bench.run("_build_image_entries no-base64 x4", lambda: executor._build_image_entries(images, False))
+    finally:
+        executor.history.close()
+
+
+# -------------------------
+# 历史
+# -------------------------
+def bench_history(bench: Bench, sizes: List[int], history_dir: Path, maxlen: int) -> None:
+    from executor.history import HistoryManager
+
+    for size in sizes:
+        ops = ("load", "get last", "get in-window", "get by id (file)", "list_recent 10", "add")
+        if not any(bench.wanted(f"history n={size} {op}") for op in ops):
+            continue
+        path = history_dir / str(size) / "history.jsonl"
+        marker = path.with_name("records")
+        if not (path.exists() and marker.exists() and marker.read_text().strip() == str(size)):
+            started = time.perf_counter()
+            generate_history(path, size)
+            marker.write_text(str(size))
+            print(f"  (生成 {size} 条历史：{path.stat().st_size / 2**20:.1f} MB，{time.perf_counter() - started:.1f}s)")
+
+        def load() -> None:
+            HistoryManager(history_file=path, maxlen=maxlen).close()
+
+        bench.run(f"history n={size} load", load, max_calls=200, records=size)
+
+        manager = HistoryManager(history_file=path, maxlen=maxlen)
+        rng = random.Random(0)
+        try:
+            bench.run(f"history n={size} get last", lambda: manager.get("last"), records=size)
+            window = [str(r.id) for r in manager.list_recent(maxlen)]
+            bench.run(f"history n={size} get in-window", lambda: manager.get(rng.choice(window)), records=size)
+            # 窗口外：经偏移索引回退到文件（首次调用构建 / 校验索引，计入预热）
+            old_ids = [str(rng.randint(1, max(1, size - maxlen))) for _ in range(1000)]
+            bench.run(f"history n={size} get by id (file)", lambda: manager.get(rng.choice(old_ids)), records=size)
+            bench.run(f"history n={size} list_recent 10", lambda: manager.list_recent(10), records=size)
+            params = dict(PAYLOAD)
+            bench.run(
+                f"history n={size} add",
+                lambda: manager.add(params=params, positive_text="bench", negative_text="", seed=1, width=1024, height=1024),
+                max_calls=20000,
+                records=size,
+            )
+        finally:
+            manager.close()
+        # add 追加的记录让文件不再是 size 条：下次运行重新生成
+        marker.unlink(missing_ok=True)
+
+
+# -------------------------
+# 入口
+# -------------------------
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    before = {r["name"]: r for r in old.get("results") or []}
+    lines = [f"对比 {old.get('meta', {}).get('git') or '?'} → {new.get('meta', {}).get('git') or '?'}（中位耗时）"]
+    for r in new.get("results") or []:
+        o = before.get(r["name"])
+        if o is None or not o["median_us"]:
+            continue
+        change = (r["median_us"] - o["median_us"]) / o["median_us"] * 100
+        lines.append(f"{r['name']:<44} {o['median_us']:>12.2f} → {r['median_us']:>12.2f} us ({change:+.1f}%)")
+    return lines
+
+
+def _csv(text: str) -> List[str]:
+    return [x.strip() for x in text.split(",") if x.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="AnimaTool 微基准（离线）")
+    parser.add_argument("--filter", default="", help="逗号分隔的名称片段，只运行匹配的项，如 inject,history")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项计时的最短时长（秒）")
+    parser.add_argument("--alloc-runs", type=int, default=20, help="每项统计分配的调用次数")
+    parser.add_argument("--history-sizes", default="1000,10000,100000", help="历史规模列表（最多支持到 1000000）")
+    parser.add_argument("--history-dir", default="", help="合成历史的存放目录（指定时跨次复用；默认临时目录）")
+    parser.add_argument("--history-maxlen", type=int, default=50, help="HistoryManager 的内存窗口")
+    parser.add_argument("--image-sizes", default="1024x1024", help="base64 构建用的图片尺寸列表，如 1024x1024,1536x1536")
+    parser.add_argument("--entropy", type=float, default=0.5, help="测试图片的随机程度（决定 PNG 大小）")
+    parser.add_argument("--output", default="", help="结果 JSON 路径（默认 benchmarks/results/micro-<时间>.json）")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.min_time, args.alloc_runs, _csv(args.filter))
+    print(f"{'name':<44} {'median us':>12} {'p95 us':>12} {'ops/s':>12} {'peak KB':>12} {'retained KB':>12}")
+    with tempfile.TemporaryDirectory(prefix="animatool-micro-") as tmp:
+        # 执行器的历史写到临时目录，不读写 outputs/ 下的真实历史
+        isolate_history(Path(tmp))
+        bench_prompt(bench)
+        bench_executor(bench, _csv(args.image_sizes), args.entropy)
+        history_dir = Path(args.history_dir) if args.history_dir else Path(tmp) / "histories"
+        bench_history(bench, [int(x) for x in _csv(args.history_sizes)], history_dir, args.history_maxlen)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": _project_version(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "min_time_s": args.min_time,
+            "alloc_runs": args.alloc_runs,
+        },
+        "results": bench.results,
+    }
+    output = Path(args.output) if args.output else ROOT / "benchmarks" / "results" / f"micro-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已保存：{output}")
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(previous, report)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+ComfyUI 替身：实现本工具用到的接口，按可配置的执行耗时 / 图片大小返回结果，不需要 GPU。
+
+实现的接口：
+  POST /prompt                 - 入队（支持 front），返回 prompt_id
+  GET  /history[/{prompt_id}]  - 已完成任务（status.messages 带 execution_start / execution_success 时间戳）
+  GET  /queue, POST /queue     - 查看队列 / 删除排队项（delete）/ 清空（clear）
+  POST /interrupt              - 中断正在执行的任务
+  GET  /view                   - 返回生成的 PNG
+  GET  /models, /models/{type} - 模型列表
+  GET  /object_info/{class}    - 节点定义（不限制取值，只让提交前校验通过）
+  POST /upload/image           - 接收上传（变体模式）
+  GET  /system_stats           - 健康探测
+  GET  /ws                     - WebSocket：status / executing / executed / execution_success 事件
+
+与 ComfyUI 一样串行执行：同一时刻只有一个任务在"执行"（sleep latency 秒）。
+
+启动：
+    python -m benchmarks.stub_comfyui --port 8189 --latency 0.5 --image-size 1024x1024
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import WSMsgType, web
+
+DEFAULT_MODELS: Dict[str, List[str]] = {
+    "diffusion_models": ["anima-preview.safetensors"],
+    "text_encoders": ["qwen_3_06b_base.safetensors"],
+    "vae": ["qwen_image_vae.safetensors"],
+    "loras": ["bench/style_a.safetensors", "bench/style_b.safetensors"],
+    "checkpoints": [],
+}
+
+
+def make_png(width: int, height: int, entropy: float = 0.5, seed: int = 0) -> bytes:
+    """生成 width × height 的 RGB PNG；entropy 为随机行的比例（越大文件越大，0.5 约为插画的体积）。"""
+    rng = random.Random(seed)
+    row_len = width * 3
+    flat = bytes([200, 180, 220]) * width
+    rows = []
+    for _ in range(height):
+        # 每行开头是 filter 字节 0；随机行不可压缩，纯色行几乎不占空间
+        rows.append(b"\x00" + (rng.randbytes(row_len) if rng.random() < entropy else flat))
+    raw = b"".join(rows)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+def _job_shape(prompt: Dict[str, Any]) -> Tuple[int, int, int]:
+    """从 workflow 中取 (宽, 高, 张数)。"""
+    width = height = 1024
+    batch = 1
+    for node in prompt.values():
+        if not isinstance(node, dict):
+            continue
+        inputs = node.get("inputs") or {}
+        if node.get("class_type") == "EmptyLatentImage":
+            width = int(inputs.get("width") or width)
+            height = int(inputs.get("height") or height)
+            batch = int(inputs.get("batch_size") or batch)
+        elif node.get("class_type") == "RepeatLatentBatch":
+            batch = int(inputs.get("amount") or batch)
+    return width, height, max(1, batch)
+
+
+class StubComfyUI:
+    """可配置的 ComfyUI 替身。
+
+    latency_s：每个任务的执行耗时；jitter：耗时随机浮动比例（0.1 = ±10%）；
+    image_size：固定输出尺寸 (宽, 高)，None 时按 workflow 的尺寸；entropy：PNG 的随机程度。
+    """
+
+    def __init__(
+        self,
+        latency_s: float = 1.0,
+        jitter: float = 0.0,
+        image_size: Optional[Tuple[int, int]] = None,
+        entropy: float = 0.5,
+        models: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.latency_s = max(0.0, float(latency_s))
+        self.jitter = max(0.0, float(jitter))
+        self.image_size = image_size
+        self.entropy = entropy
+        self.models = models or DEFAULT_MODELS
+        self._queue: Deque[Dict[str, Any]] = collections.deque()
+        self._running: Optional[Dict[str, Any]] = None
+        self._history: Dict[str, Dict[str, Any]] = {}
+        self._images: Dict[str, Tuple[int, int]] = {}  # filename -> (宽, 高)
+        self._png_cache: Dict[Tuple[int, int], bytes] = {}
+        self._sockets: Dict[str, web.WebSocketResponse] = {}
+        self._number = 0
+        self._counter = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._interrupt: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.started_at = time.time()
+
+    # -------------------------
+    # 应用
+    # -------------------------
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post("/prompt", self.post_prompt),
+            web.get("/history", self.get_history),
+            web.get("/history/{prompt_id}", self.get_history),
+            web.get("/queue", self.get_queue),
+            web.post("/queue", self.post_queue),
+            web.post("/interrupt", self.post_interrupt),
+            web.get("/view", self.get_view),
+            web.get("/models", self.get_models),
+            web.get("/models/{folder}", self.get_models),
+            web.get("/object_info/{class_type}", self.get_object_info),
+            web.post("/upload/image", self.post_upload),
+            web.get("/system_stats", self.get_system_stats),
+            web.get("/ws", self.websocket),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._wakeup = asyncio.Event()
+        self._interrupt = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+
+    # -------------------------
+    # 执行
+    # -------------------------
+    async def _send(self, client_id: Optional[str], event: str, data: Dict[str, Any]) -> None:
+        targets = [self._sockets.get(client_id)] if client_id else list(self._sockets.values())
+        for ws in targets:
+            if ws is not None and not ws.closed:
+                try:
+                    await ws.send_str(json.dumps({"type": event, "data": data}))
+                except ConnectionError:
+                    pass
+
+    async def _broadcast_status(self) -> None:
+        remaining = len(self._queue) + (1 if self._running else 0)
+        await self._send(None, "status", {"status": {"exec_info": {"queue_remaining": remaining}}})
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job = self._queue.popleft()
+            self._running = job
+            self._interrupt.clear()
+            prompt_id, client_id = job["prompt_id"], job["client_id"]
+            start_ms = int(time.time() * 1000)
+            messages: List[Any] = [["execution_start", {"prompt_id": prompt_id, "timestamp": start_ms}]]
+            await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+            await self._send(client_id, "executing", {"node": "19", "prompt_id": prompt_id})
+
+            latency = self.latency_s * (1.0 + random.uniform(-self.jitter, self.jitter))
+            try:
+                await asyncio.wait_for(self._interrupt.wait(), timeout=max(0.0, latency))
+                interrupted = True
+            except asyncio.TimeoutError:
+                interrupted = False
+
+            end_ms = int(time.time() * 1000)
+            outputs: Dict[str, Any] = {}
+            if interrupted:
+                messages.append(["execution_interrupted", {"prompt_id": prompt_id, "timestamp": end_ms}])
+                status = {"status_str": "error", "completed": False, "messages": messages}
+            else:
+                width, height, batch = _job_shape(job["prompt"])
+                if self.image_size:
+                    width, height = self.image_size
+                images = []
+                for _ in range(batch):
+                    self._counter += 1
+                    filename = f"AnimaTool__{self._counter:05d}_.png"
+                    self._images[filename] = (width, height)
+                    images.append({"filename": filename, "subfolder": "", "type": "output"})
+                outputs = {"9": {"images": images}}
+                messages.append(["execution_success", {"prompt_id": prompt_id, "timestamp": end_ms}])
+                status = {"status_str": "success", "completed": True, "messages": messages}
+                await self._send(client_id, "executed", {"node": "9", "output": outputs["9"], "prompt_id": prompt_id})
+            self._history[prompt_id] = {
+                "prompt": [job["number"], prompt_id, job["prompt"], {"client_id": client_id}, ["9"]],
+                "outputs": outputs,
+                "status": status,
+                "meta": {},
+            }
+            self._running = None
+            await self._send(client_id, "execution_success" if not interrupted else "execution_interrupted",
+                             {"prompt_id": prompt_id, "timestamp": end_ms})
+            await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+            await self._broadcast_status()
+
+    # -------------------------
+    # 路由
+    # -------------------------
+    async def post_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({"error": {"type": "invalid_prompt", "message": "empty prompt"}, "node_errors": {}}, status=400)
+        prompt_id = str(body.get("prompt_id") or uuid.uuid4())
+        self._number += 1
+        job = {"prompt_id": prompt_id, "prompt": prompt, "client_id": body.get("client_id"), "number": self._number}
+        if body.get("front"):
+            self._queue.appendleft(job)
+        else:
+            self._queue.append(job)
+        self._wakeup.set()
+        await self._broadcast_status()
+        return web.json_response({"prompt_id": prompt_id, "number": self._number, "node_errors": {}})
+
+    async def get_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id:
+            item = self._history.get(prompt_id)
+            return web.json_response({prompt_id: item} if item else {})
+        max_items = int(request.query.get("max_items") or 0)
+        items = list(self._history.items())
+        if max_items:
+            items = items[-max_items:]
+        return web.json_response(dict(items))
+
+    def _queue_entry(self, job: Dict[str, Any]) -> List[Any]:
+        return [job["number"], job["prompt_id"], job["prompt"], {"client_id": job["client_id"]}, ["9"]]
+
+    async def get_queue(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "queue_running": [self._queue_entry(self._running)] if self._running else [],
+            "queue_pending": [self._queue_entry(job) for job in self._queue],
+        })
+
+    async def post_queue(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("clear"):
+            self._queue.clear()
+        delete = set(body.get("delete") or [])
+        if delete:
+            self._queue = collections.deque(job for job in self._queue if job["prompt_id"] not in delete)
+        return web.Response(status=200)
+
+    async def post_interrupt(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except Exception:
+            body = {}
+        target = body.get("prompt_id") if isinstance(body, dict) else None
+        if self._running and (target is None or target == self._running["prompt_id"]):
+            self._interrupt.set()
+        return web.Response(status=200)
+
+    async def get_view(self, request: web.Request) -> web.Response:
+        filename = request.query.get("filename", "")
+        size = self._images.get(filename)
+        if size is None:
+            return web.Response(status=404)
+        png = self._png_cache.get(size)
+        if png is None:
+            # 同尺寸的图片只生成一次（生成本身不计入被测路径）
+            png = await asyncio.to_thread(make_png, size[0], size[1], self.entropy)
+            self._png_cache[size] = png
+        return web.Response(body=png, content_type="image/png")
+
+    async def get_models(self, request: web.Request) -> web.Response:
+        folder = request.match_info.get("folder")
+        if folder is None:
+            return web.json_response(sorted(self.models))
+        if folder not in self.models:
+            return web.json_response({"error": f"unknown folder {folder}"}, status=404)
+        return web.json_response(self.models[folder])
+
+    async def get_object_info(self, request: web.Request) -> web.Response:
+        class_type = request.match_info["class_type"]
+        return web.json_response({
+            class_type: {
+                "input": {"required": {}, "optional": {}},
+                "output": [],
+                "name": class_type,
+                "display_name": class_type,
+                "category": "stub",
+            }
+        })
+
+    async def post_upload(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        name = "upload.png"
+        async for part in reader:
+            if part.name == "image":
+                name = part.filename or name
+                await part.read()
+            else:
+                await part.text()
+        return web.json_response({"name": name, "subfolder": "", "type": "input"})
+
+    async def get_system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "system": {"os": "stub", "python_version": "stub", "comfyui_version": "stub"},
+            "devices": [{"name": "stub", "type": "cpu", "vram_total": 0, "vram_free": 0}],
+            "queue": {"pending": len(self._queue), "running": 1 if self._running else 0},
+            "uptime_s": round(time.time() - self.started_at, 1),
+        })
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self._sockets[client_id] = ws
+        try:
+            remaining = len(self._queue) + (1 if self._running else 0)
+            await ws.send_str(json.dumps({
+                "type": "status", "data": {"status": {"exec_info": {"queue_remaining": remaining}}, "sid": client_id},
+            }))
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._sockets.pop(client_id, None)
+        return ws
+
+
+def _parse_size(text: str) -> Optional[Tuple[int, int]]:
+    if not text:
+        return None
+    w, _, h = text.lower().partition("x")
+    return int(w), int(h)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="ComfyUI 替身（基准测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8189)
+    parser.add_argument("--latency", type=float, default=1.0, help="每个任务的执行耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="执行耗时的随机浮动比例，如 0.1")
+    parser.add_argument("--image-size", default="", help="固定输出尺寸，如 1024x1024（默认按 workflow）")
+    parser.add_argument("--entropy", type=float, default=0.5, help="PNG 随机程度 0~1（决定文件大小）")
+    args = parser.parse_args(argv)
+
+    stub = StubComfyUI(
+        latency_s=args.latency, jitter=args.jitter, image_size=_parse_size(args.image_size), entropy=args.entropy
+    )
+    web.run_app(stub.make_app(), host=args.host, port=args.port, print=lambda *_: print(
+        f"[stub-comfyui] listening on http://{args.host}:{args.port} (latency={args.latency}s)", flush=True
+    ))
+
+
+if __name__ == "__main__":
+    main()
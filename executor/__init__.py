@@ -1,17 +1,66 @@
-from .anima_executor import AnimaExecutor, build_anima_positive_text, estimate_size_from_ratio, align_dimension
+from .admission import AdmissionController, ThrottledError, client_identity
+from .anima_executor import (
+    AnimaExecutor,
+    attach_image_urls,
+    build_anima_positive_text,
+    estimate_size_from_ratio,
+    align_dimension,
+)
 from .config import (
     AnimaToolConfig,
     DEFAULT_UNET_NAME,
     DEFAULT_CLIP_NAME,
     DEFAULT_VAE_NAME,
 )
-from .history import HistoryManager, GenerationRecord
+from .cost_model import CostModel, job_features
+from .cancellation import CancelToken, JobCancelledError, run_cancellable
+from .health import BackendUnavailableError, CircuitBreaker, HealthMonitor
+from .history import HistoryManager, GenerationRecord, create_history_manager, iter_history_records
+from .history_search import HistoryIndex
+from .history_sqlite import SQLiteHistoryManager, migrate_jsonl_to_sqlite
+from .idempotency import IdempotencyConflictError, IdempotencyStore, request_fingerprint
+from .inprocess import InProcessBackend, InProcessUnavailableError
+from .metrics import Metrics
+from .object_info import ObjectInfoCache, PromptValidationError
+from .profiling import ChromeTracer, Hooks, current_request_id, request_scope
+from .scheduler import JobScheduler, normalize_priority
 
 __all__ = [
     "AnimaExecutor",
     "AnimaToolConfig",
+    "AdmissionController",
+    "CostModel",
+    "job_features",
+    "ThrottledError",
+    "client_identity",
+    "BackendUnavailableError",
+    "CircuitBreaker",
+    "HealthMonitor",
+    "CancelToken",
+    "JobCancelledError",
+    "run_cancellable",
     "HistoryManager",
     "GenerationRecord",
+    "HistoryIndex",
+    "SQLiteHistoryManager",
+    "create_history_manager",
+    "iter_history_records",
+    "migrate_jsonl_to_sqlite",
+    "IdempotencyConflictError",
+    "IdempotencyStore",
+    "request_fingerprint",
+    "InProcessBackend",
+    "InProcessUnavailableError",
+    "Metrics",
+    "ObjectInfoCache",
+    "PromptValidationError",
+    "ChromeTracer",
+    "Hooks",
+    "current_request_id",
+    "request_scope",
+    "JobScheduler",
+    "normalize_priority",
+    "attach_image_urls",
     "build_anima_positive_text",
     "estimate_size_from_ratio",
     "align_dimension",
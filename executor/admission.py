@@ -0,0 +1,184 @@
+"""
+按客户端的准入控制（API key / MCP 会话 / IP）。
+
+- 并发上限：同一客户端同时在执行的请求数
+- 速率上限：令牌桶，按任务数计（repeat=16 消耗 16 个令牌），允许一定突发
+- 超限的请求立即被拒绝（ThrottledError → HTTP 429 + Retry-After），不会进入队列
+- 权重（ANIMATOOL_CLIENT_WEIGHTS）同时用于 JobScheduler 的加权公平排队
+
+客户端标识不保存原始 API key，只保存其 sha256 前缀。
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+
+class ThrottledError(RuntimeError):
+    """客户端超出并发 / 速率限制；info 为返回给客户端的限流说明。"""
+
+    def __init__(self, message: str, *, client: str, reason: str, limit: float, retry_after_s: float):
+        super().__init__(message)
+        self.client = client
+        self.reason = reason
+        self.limit = limit
+        self.retry_after_s = max(0.0, float(retry_after_s))
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {
+            "client": self.client,
+            "reason": self.reason,
+            "limit": self.limit,
+            "retry_after_s": round(self.retry_after_s, 1),
+        }
+
+
+def hash_api_key(api_key: str) -> str:
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def client_identity(headers: Optional[Mapping[str, str]] = None, ip: Optional[str] = None) -> str:
+    """请求方标识：X-API-Key / Authorization: Bearer 中的 API key（哈希后），否则 IP。
+
+    headers 需按名称大小写不敏感地查找（aiohttp / Starlette 的请求头均如此）。
+    """
+    api_key = ""
+    if headers is not None:
+        api_key = (headers.get("X-API-Key") or "").strip()
+        auth = headers.get("Authorization") or ""
+        if not api_key and auth.lower().startswith("bearer "):
+            api_key = auth[7:].strip()
+    if api_key:
+        return hash_api_key(api_key)
+    return f"ip:{ip or 'unknown'}"
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """解析 "key1=4,ip:10.0.0.5=2" 形式的权重表；不带 ip: / key: / mcp: 前缀的条目视为 API key。"""
+    weights: Dict[str, float] = {}
+    for item in (spec or "").split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if not sep or not name:
+            continue
+        try:
+            weight = float(value)
+        except ValueError:
+            continue
+        if weight <= 0:
+            continue
+        if not name.startswith(("ip:", "key:", "mcp:")):
+            name = hash_api_key(name)
+        weights[name] = weight
+    return weights
+
+
+class _ClientState:
+    __slots__ = ("active", "tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.active = 0
+        self.tokens = tokens
+        self.updated = now
+
+
+class AdmissionController:
+    """线程安全的按客户端准入控制。
+
+    max_concurrent <= 0 不限并发；rate_per_min <= 0 不限速率；burst 默认等于 rate_per_min。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 0,
+        rate_per_min: float = 0.0,
+        burst: Optional[float] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.max_concurrent = int(max_concurrent)
+        self.rate_per_min = float(rate_per_min)
+        self.burst = float(burst) if burst and burst > 0 else max(1.0, self.rate_per_min)
+        self.weights = dict(weights or {})
+        self._lock = threading.Lock()
+        self._clients: Dict[str, _ClientState] = {}
+
+    def weight(self, client: Optional[str]) -> float:
+        return self.weights.get(client or "", 1.0)
+
+    def _state_locked(self, client: str, now: float) -> _ClientState:
+        state = self._clients.get(client)
+        if state is None:
+            state = self._clients[client] = _ClientState(self.burst, now)
+        elif self.rate_per_min > 0:
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate_per_min / 60.0)
+            state.updated = now
+        return state
+
+    def _prune_locked(self) -> None:
+        # 空闲且令牌已满的客户端不需要保留状态
+        if len(self._clients) > 1024:
+            for name in [n for n, s in self._clients.items() if s.active == 0 and s.tokens >= self.burst]:
+                del self._clients[name]
+
+    def acquire(self, client: str, cost: float = 1.0) -> None:
+        """登记一个请求（cost 为任务数）；超限时抛出 ThrottledError。成功后必须调用 release()。"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state_locked(client, now)
+            if self.max_concurrent > 0 and state.active >= self.max_concurrent:
+                raise ThrottledError(
+                    f"客户端 {client} 同时进行的请求已达上限 {self.max_concurrent}，请等待已有请求完成",
+                    client=client,
+                    reason="concurrency",
+                    limit=self.max_concurrent,
+                    retry_after_s=1.0,
+                )
+            if self.rate_per_min > 0:
+                cost = float(cost)
+                if cost > self.burst:
+                    raise ThrottledError(
+                        f"单个请求的任务数 {cost:g} 超过突发上限 {self.burst:g}，请减少 repeat / 拆分请求",
+                        client=client,
+                        reason="burst",
+                        limit=self.burst,
+                        retry_after_s=0.0,
+                    )
+                if state.tokens < cost:
+                    retry = (cost - state.tokens) * 60.0 / self.rate_per_min
+                    raise ThrottledError(
+                        f"客户端 {client} 超出速率限制（每分钟 {self.rate_per_min:g} 个任务），约 {retry:.0f} 秒后重试",
+                        client=client,
+                        reason="rate",
+                        limit=self.rate_per_min,
+                        retry_after_s=retry,
+                    )
+                state.tokens -= cost
+            state.active += 1
+            self._prune_locked()
+
+    def release(self, client: str) -> None:
+        with self._lock:
+            state = self._clients.get(client)
+            if state is not None and state.active > 0:
+                state.active -= 1
+
+    @contextmanager
+    def admit(self, client: str, cost: float = 1.0) -> Iterator[None]:
+        self.acquire(client, cost)
+        try:
+            yield
+        finally:
+            self.release(client)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = {name: s.active for name, s in self._clients.items() if s.active}
+        return {
+            "max_concurrent": self.max_concurrent,
+            "rate_per_min": self.rate_per_min,
+            "burst": self.burst,
+            "active": active,
+        }
@@ -1,18 +1,55 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import json
 import math
+import os
+import re
+import shutil
+import sys
+import threading
 import time
 import uuid
+from contextlib import ExitStack, contextmanager
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode, urljoin
 
+from . import imaging
+from .admission import AdmissionController, parse_weights
+from .cancellation import CancelToken, JobCancelledError
 from .config import AnimaToolConfig
-from .history import HistoryManager
+from .cost_model import CostModel, execution_seconds, execution_window, job_features
+from .health import BackendUnavailableError, CircuitBreaker, HealthMonitor
+from .history import create_history_manager
+from .idempotency import IdempotencyStore, request_fingerprint
+from .inprocess import InProcessBackend, InProcessUnavailableError
+from .metrics import Metrics
+from .object_info import ObjectInfoCache
+from .profiling import (
+    HISTORY_WRITE,
+    HTTP_CALL,
+    JOB_END,
+    JOB_START,
+    STAGE_END,
+    STAGE_START,
+    ChromeTracer,
+    Hooks,
+    current_request_id,
+    new_request_id,
+)
+from .scheduler import JobScheduler, normalize_priority
+
+
+# 按任务设置超时时的下限（秒）：覆盖模型加载等冷启动开销
+_MIN_JOB_TIMEOUT_S = 120.0
+# 按任务超时尚未开始计时时，每隔几次 /history 轮询才查一次 /queue（不让每个等待中的任务请求量翻倍）
+_QUEUE_CHECK_EVERY = 5
+# /interrupt 支持按 prompt_id 定向中断的最低 ComfyUI 版本；更早的版本忽略请求体、中断当前正在执行的任务
+_TARGETED_INTERRUPT_MIN_VERSION = (0, 3, 44)
 
 
 def _round_up(x: int, base: int) -> int:
@@ -66,6 +103,13 @@ def align_dimension(value: int, round_to: int = 16) -> int:
     return _round_up(max(64, int(value)), round_to)
 
 
+def _safe_int(value: Any) -> Optional[int]:
+    try:
+        return int(str(value).strip().lstrip("#"))
+    except (TypeError, ValueError):
+        return None
+
+
 def _join_csv(*parts: str) -> str:
     cleaned: List[str] = []
     for p in parts:
@@ -99,6 +143,22 @@ def build_anima_positive_text(prompt_json: Dict[str, Any]) -> str:
     )
 
 
+def attach_image_urls(result: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    """为生成结果中的每张图片补充二进制下载地址：{base_url}/{history_id}/{index}。
+
+    base_url 由各前端决定（如 FastAPI 的 /images、ComfyUI 扩展的 /anima/images）。
+    仅对已保存到本地的图片生效。
+    """
+    history_id = result.get("history_id")
+    if history_id is None:
+        return result
+    base = base_url.rstrip("/")
+    for i, img in enumerate(result.get("images") or []):
+        if img.get("file_path"):
+            img["image_url"] = f"{base}/{history_id}/{i}"
+    return result
+
+
 @dataclass(frozen=True)
 class GeneratedImage:
     filename: str
@@ -107,6 +167,8 @@ class GeneratedImage:
     view_url: str
     saved_path: Optional[str] = None
     content: Optional[bytes] = None  # 原始图片数据
+    transcoded: Optional[Dict[str, Any]] = None  # 转码后的版本（file_path / mime_type / content ...）
+    thumbnail: Optional[Dict[str, Any]] = None   # 缩略图
 
 
 class AnimaExecutor:
@@ -115,19 +177,86 @@ class AnimaExecutor:
     将结构化 JSON 注入 ComfyUI prompt 并执行，获取输出图片。
     """
 
-    def __init__(self, config: Optional[AnimaToolConfig] = None):
+    def __init__(self, config: Optional[AnimaToolConfig] = None, inprocess: Optional[InProcessBackend] = None):
         self.config = config or AnimaToolConfig()
         self._client_id = str(uuid.uuid4())
 
+        # 进程内后端（ComfyUI extension 模式）；为 None 或不可用时走 HTTP
+        self.inprocess = inprocess
+
         # 远端 ComfyUI 返回的模型名称分隔符（Windows 常为 "\\"，Linux 常为 "/"）
         self._remote_model_path_sep_cache: Dict[str, str] = {}
 
+        # 变体模式上传过的图片：内容 sha256 -> ComfyUI input 中的文件名
+        self._uploaded_images: Dict[str, str] = {}
+        self._upload_lock = threading.Lock()
+
+        # 已提交、尚未取回结果的 ComfyUI 任务（取消时据此撤销）
+        self._active_prompts: Dict[str, float] = {}
+        self._active_lock = threading.Lock()
+        # 后端是否支持定向中断（首次取消正在执行的任务时探测 /system_stats 并缓存）
+        self._targeted_interrupt: Optional[bool] = None
+
+        # 带 idempotency_key 的请求：重试时挂到执行中的任务或复用已保存的结果
+        self.idempotency = IdempotencyStore(ttl_s=self.config.idempotency_ttl_s)
+
+        # 按优先级（interactive > normal > batch）控制进入 ComfyUI 队列的任务
+        self.scheduler = JobScheduler(
+            max_outstanding=self.config.max_outstanding,
+            policy=self.config.scheduler_policy,
+            max_wait_s=self.config.sjf_max_wait_s,
+        )
+        # 执行耗时模型（首次估计时从历史记录的 timings 预热），用于 ETA、sjf 排队与按任务超时
+        self.cost_model = CostModel()
+        self._cost_model_loaded = False
+        self._cost_model_lock = threading.Lock()
+
+        # 按客户端的并发 / 速率限制（由各前端在请求入口调用），权重同时用于公平排队
+        self.admission = AdmissionController(
+            max_concurrent=self.config.client_max_concurrent,
+            rate_per_min=self.config.client_rate_per_min,
+            burst=self.config.client_burst,
+            weights=parse_weights(self.config.client_weights),
+        )
+
+        # ComfyUI 后端健康监控与熔断（仅 HTTP 模式；后台线程在首次生成 / 查询状态时启动）
+        self.breaker = CircuitBreaker(
+            probe=lambda: self.health.probe(),
+            failure_threshold=self.config.breaker_failures,
+            reset_timeout_s=self.config.breaker_reset_s,
+        )
+        self.health = HealthMonitor(self._probe_backend, self.breaker, interval_s=self.config.health_interval_s)
+
+        # 各阶段耗时直方图 / 任务计数（/metrics 以 Prometheus 文本格式导出）
+        self.metrics = Metrics()
+        self._register_metrics()
+
+        # 剖析钩子（见 profiling）：订阅者可观察各阶段、HTTP 请求与历史写入；当前线程正在执行的任务上下文
+        self.hooks = Hooks()
+        self._job_local = threading.local()
+        # 配置了 trace 目录时，按采样率把请求写成 Chrome trace-event JSON
+        self.tracer: Optional[ChromeTracer] = None
+        if self.config.trace_dir:
+            self.tracer = ChromeTracer(self.config.trace_dir, self.config.trace_sample_rate).attach(self.hooks)
+
+        # 提交前校验用的 /object_info 缓存
+        self.object_info = ObjectInfoCache(self._fetch_object_info, ttl_s=self.config.object_info_ttl_s)
+
         template_path = Path(__file__).resolve().parent / "workflow_template.json"
         with template_path.open("r", encoding="utf-8") as f:
             self._workflow_template: Dict[str, Any] = json.load(f)
 
         # 生成历史管理器
-        self.history = HistoryManager()
+        self.history = create_history_manager(
+            self.config.history_backend,
+            history_dir=self.config.history_dir,
+            flush_interval_s=self.config.history_flush_interval_s,
+            max_batch=self.config.history_batch_size,
+            fsync=self.config.history_fsync,
+            segment_max_bytes=int(self.config.history_segment_mb * 1024 * 1024),
+            segment_period=self.config.history_segment_period,
+            compact_on_rotate=self.config.history_compact,
+        )
 
     # -------------------------
     # Model listing / metadata
@@ -296,44 +425,208 @@ class AnimaExecutor:
 
         wf["19"]["inputs"]["model"] = prev_model
 
+    def _inject_init_image(self, wf: Dict[str, Any], image_name: str) -> None:
+        """把 EmptyLatentImage(28) 替换为 LoadImage → ImageScale → VAEEncode（img2img）。
+
+        节点 28 保留为 latent 来源（VAEEncode），尺寸仍由 ImageScale 按目标宽高决定；
+        batch_size > 1 时再接 RepeatLatentBatch。
+        """
+        empty = wf["28"]["inputs"]
+        width, height, batch_size = int(empty["width"]), int(empty["height"]), int(empty["batch_size"])
+
+        numeric_ids = [int(k) for k in wf.keys() if str(k).isdigit()]
+        next_id = (max(numeric_ids) + 1) if numeric_ids else 1
+        load_id, scale_id = str(next_id), str(next_id + 1)
+
+        wf[load_id] = {"class_type": "LoadImage", "inputs": {"image": image_name}}
+        wf[scale_id] = {
+            "class_type": "ImageScale",
+            "inputs": {
+                "image": [load_id, 0],
+                "upscale_method": "lanczos",
+                "width": width,
+                "height": height,
+                "crop": "center",
+            },
+        }
+        wf["28"] = {
+            "class_type": "VAEEncode",
+            "inputs": {"pixels": [scale_id, 0], "vae": ["15", 0]},
+        }
+        if batch_size > 1:
+            repeat_id = str(next_id + 2)
+            wf[repeat_id] = {
+                "class_type": "RepeatLatentBatch",
+                "inputs": {"samples": ["28", 0], "amount": batch_size},
+            }
+            wf["19"]["inputs"]["latent_image"] = [repeat_id, 0]
+
+    @staticmethod
+    def _latent_size(prompt: Dict[str, Any]) -> Tuple[int, int]:
+        """读取注入后 workflow 的输出尺寸（空 latent 或变体模式的 ImageScale）"""
+        node = prompt["28"]
+        if node.get("class_type") == "VAEEncode":
+            node = prompt[node["inputs"]["pixels"][0]]
+        return int(node["inputs"]["width"]), int(node["inputs"]["height"])
+
+    # -------------------------
+    # Variation (img2img)
+    # -------------------------
+    def _http_post_multipart(
+        self, url: str, fields: Dict[str, str], files: Dict[str, Tuple[str, bytes, str]]
+    ) -> Dict[str, Any]:
+        """multipart/form-data POST；files: {字段名: (文件名, 内容, MIME)}"""
+        try:
+            import requests  # type: ignore
+        except Exception:
+            requests = None  # type: ignore
+
+        with self._http_call("POST", url):
+            if requests is not None:
+                r = requests.post(url, data=fields, files=files, timeout=self.config.timeout_s)
+                r.raise_for_status()
+                return r.json()
+
+            import urllib.request
+
+            boundary = uuid.uuid4().hex
+            parts: List[bytes] = []
+            for name, value in fields.items():
+                parts.append(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+                )
+            for name, (filename, content, mime) in files.items():
+                parts.append(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    f"Content-Type: {mime}\r\n\r\n".encode("utf-8") + content + b"\r\n"
+                )
+            parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+            req = urllib.request.Request(
+                url, data=b"".join(parts), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+            )
+            with urllib.request.urlopen(req, timeout=self.config.timeout_s) as resp:
+                raw = resp.read().decode("utf-8", errors="replace")
+                return json.loads(raw)
+
+    def upload_image(self, content: bytes, filename: str = "image.png") -> str:
+        """经 /upload/image 上传到 ComfyUI 的 input 目录，返回 LoadImage 可用的文件名。
+
+        文件名取内容 sha256，同一张图片只上传一次（重复上传也只会覆盖为相同内容）。
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        with self._upload_lock:
+            cached = self._uploaded_images.get(digest)
+        if cached:
+            return cached
+
+        name = f"anima_{digest[:16]}{Path(filename).suffix.lower() or '.png'}"
+        url = urljoin(self.config.comfyui_url.rstrip("/") + "/", "upload/image")
+        resp = self._http_post_multipart(
+            url,
+            {"type": "input", "overwrite": "true"},
+            {"image": (name, content, self._get_mime_type(name))},
+        )
+        uploaded = str(resp.get("name") or name)
+        subfolder = str(resp.get("subfolder") or "")
+        image_name = f"{subfolder}/{uploaded}" if subfolder else uploaded
+
+        with self._upload_lock:
+            self._uploaded_images[digest] = image_name
+        return image_name
+
+    def _init_image_for(self, path: Path) -> str:
+        """为本地图片取得 LoadImage 的输入名：位于 ComfyUI output 目录时直接引用（"name [output]"），否则上传。"""
+        if self.config.comfyui_output_dir:
+            try:
+                root = Path(self.config.comfyui_output_dir).resolve()
+                rel = path.resolve().relative_to(root)
+                return f"{rel.as_posix()} [output]"
+            except (OSError, ValueError):
+                pass
+        return self.upload_image(path.read_bytes(), path.name)
+
+    def prepare_variation(
+        self,
+        params: Dict[str, Any],
+        record: Any,
+        *,
+        strength: Optional[float] = None,
+        image_index: int = 0,
+    ) -> Dict[str, Any]:
+        """把 reroll 参数改为变体模式：以历史记录的第 image_index 张图为起点低 denoise 重采样。
+
+        - strength：denoise（0~1，越小越接近原图），默认 config.variation_denoise
+        - 未显式指定 steps 时，步数按 denoise 比例缩减（KSampler 实际只执行这部分步数）
+        - 宽高沿用原图，除非 params 中显式覆盖
+        """
+        images = list(getattr(record, "images", None) or [])
+        if not 0 <= image_index < len(images) or not images[image_index]:
+            raise ValueError(f"历史记录 #{record.id} 没有第 {image_index} 张本地图片，无法使用变体模式")
+        path = Path(images[image_index])
+        if not path.is_file():
+            raise ValueError(f"历史图片已不存在：{path}")
+
+        denoise = float(strength if strength is not None else self.config.variation_denoise)
+        if not 0.0 < denoise <= 1.0:
+            raise ValueError(f"variation_strength 必须在 (0, 1] 之间，收到：{denoise}")
+
+        merged = dict(params)
+        merged["init_image"] = self._init_image_for(path)
+        merged["denoise"] = denoise
+        prior = getattr(record, "params", None) or {}
+        # 显式覆盖了 steps，或源记录本身就是变体（steps 已缩减过）时不再缩减
+        if not prior.get("init_image") and params.get("steps") == prior.get("steps"):
+            base_steps = int(params.get("steps") or self._workflow_template["19"]["inputs"]["steps"])
+            merged["steps"] = max(1, int(math.ceil(base_steps * denoise)))
+        if record.width and record.height:
+            merged.setdefault("width", record.width)
+            merged.setdefault("height", record.height)
+        return merged
+
     # -------------------------
     # HTTP helpers (requests 优先, 无则 urllib)
     # -------------------------
-    def _http_post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def _http_post_json(
+        self, url: str, payload: Dict[str, Any], timeout: Optional[float] = None, expect_json: bool = True
+    ) -> Dict[str, Any]:
         try:
             import requests  # type: ignore
         except Exception:
             requests = None  # type: ignore
 
-        data = json.dumps(payload).encode("utf-8")
-        if requests is not None:
-            r = requests.post(url, json=payload, timeout=self.config.timeout_s)
-            r.raise_for_status()
-            return r.json()
+        with self._http_call("POST", url):
+            timeout = self.config.timeout_s if timeout is None else timeout
+            data = json.dumps(payload).encode("utf-8")
+            if requests is not None:
+                r = requests.post(url, json=payload, timeout=timeout)
+                r.raise_for_status()
+                return r.json() if expect_json else {}
 
-        import urllib.request
+            import urllib.request
 
-        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-        with urllib.request.urlopen(req, timeout=self.config.timeout_s) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-            return json.loads(raw)
+            req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                raw = resp.read().decode("utf-8", errors="replace")
+                return json.loads(raw) if expect_json else {}
 
-    def _http_get_json(self, url: str) -> Any:
+    def _http_get_json(self, url: str, timeout: Optional[float] = None) -> Any:
         try:
             import requests  # type: ignore
         except Exception:
             requests = None  # type: ignore
 
-        if requests is not None:
-            r = requests.get(url, timeout=self.config.timeout_s)
-            r.raise_for_status()
-            return r.json()
+        with self._http_call("GET", url):
+            timeout = self.config.timeout_s if timeout is None else timeout
+            if requests is not None:
+                r = requests.get(url, timeout=timeout)
+                r.raise_for_status()
+                return r.json()
 
-        import urllib.request
+            import urllib.request
 
-        with urllib.request.urlopen(url, timeout=self.config.timeout_s) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-            return json.loads(raw)
+            with urllib.request.urlopen(url, timeout=timeout) as resp:
+                raw = resp.read().decode("utf-8", errors="replace")
+                return json.loads(raw)
 
     def _http_get_bytes(self, url: str) -> bytes:
         try:
@@ -341,15 +634,16 @@ class AnimaExecutor:
         except Exception:
             requests = None  # type: ignore
 
-        if requests is not None:
-            r = requests.get(url, timeout=self.config.timeout_s)
-            r.raise_for_status()
-            return r.content
+        with self._http_call("GET", url):
+            if requests is not None:
+                r = requests.get(url, timeout=self.config.timeout_s)
+                r.raise_for_status()
+                return r.content
 
-        import urllib.request
+            import urllib.request
 
-        with urllib.request.urlopen(url, timeout=self.config.timeout_s) as resp:
-            return resp.read()
+            with urllib.request.urlopen(url, timeout=self.config.timeout_s) as resp:
+                return resp.read()
 
     # -------------------------
     # Core workflow injection
@@ -406,6 +700,11 @@ class AnimaExecutor:
         wf["28"]["inputs"]["height"] = int(height)
         wf["28"]["inputs"]["batch_size"] = int(prompt_json.get("batch_size") or 1)
 
+        # 可选：变体模式，以已有图片为起点（替换空 latent）
+        init_image = str(prompt_json.get("init_image") or "").strip()
+        if init_image:
+            self._inject_init_image(wf, init_image)
+
         # 采样参数
         seed = prompt_json.get("seed")
         if seed is None:
@@ -423,52 +722,271 @@ class AnimaExecutor:
 
         return wf
 
+    # -------------------------
+    # Pre-submit validation
+    # -------------------------
+    def _fetch_object_info(self) -> Any:
+        url = urljoin(self.config.comfyui_url.rstrip("/") + "/", "object_info")
+        return self._http_get_json(url, timeout=min(float(self.config.timeout_s), 10.0))
+
+    def validate_prompt(self, prompt: Dict[str, Any]) -> None:
+        """按缓存的 /object_info 校验注入后的 workflow（枚举值、模型 / LoRA 名、数值范围）。
+
+        不通过时抛出 PromptValidationError（ValueError），无需等 /prompt 往返。
+        进程内模式下 ComfyUI 的 validate_prompt 本身就在本地执行，这里跳过；
+        健康监控报告后端不可用时也跳过（不在挂起的后端上等待 /object_info 超时）。
+        """
+        if self.config.object_info_ttl_s <= 0 or self.inprocess is not None:
+            return
+        if self.health.status().get("healthy") is False:
+            return
+        self.object_info.validate(prompt)
+
     # -------------------------
     # Health check
     # -------------------------
     def check_comfyui_health(self) -> Tuple[bool, str]:
         """
-        检查 ComfyUI 是否可访问。
+        检查 ComfyUI 是否可访问（立即探测一次，并更新缓存的健康状态）。
         返回 (is_healthy, message)
         """
+        return self.health.probe()
+
+    def health_status(self) -> Dict[str, Any]:
+        """返回缓存的后端健康状态（不阻塞；后台探测线程按需启动）。"""
+        if self.inprocess is not None:
+            return {"healthy": True, "message": "进程内执行", "breaker": "closed"}
+        self.health.ensure_started()
+        return self.health.status()
+
+    def _probe_backend(self) -> Tuple[bool, str]:
+        """轻量探测 /system_stats（短超时），供健康监控与熔断器的 half-open 探测使用。"""
         try:
             url = urljoin(self.config.comfyui_url.rstrip("/") + "/", "system_stats")
-            self._http_get_json(url)
+            self._http_get_json(url, timeout=min(float(self.config.timeout_s), 3.0))
             return True, f"ComfyUI 运行正常 ({self.config.comfyui_url})"
         except Exception as e:
-            error_msg = str(e)
-            # 提供友好的错误提示
-            if "Connection refused" in error_msg or "连接" in error_msg:
-                return False, (
-                    f"无法连接到 ComfyUI ({self.config.comfyui_url})\n"
-                    f"请确认：\n"
-                    f"  1. ComfyUI 已启动\n"
-                    f"  2. 地址和端口正确（可通过 COMFYUI_URL 环境变量修改）\n"
-                    f"  3. 防火墙未阻止连接"
-                )
-            elif "timeout" in error_msg.lower() or "超时" in error_msg:
-                return False, (
-                    f"连接 ComfyUI 超时 ({self.config.comfyui_url})\n"
-                    f"可能原因：网络延迟、ComfyUI 负载过高"
-                )
-            else:
-                return False, f"ComfyUI 连接错误: {error_msg}"
+            return False, self._describe_connection_error(e)
+
+    def _describe_connection_error(self, e: BaseException) -> str:
+        error_msg = str(e)
+        # 提供友好的错误提示
+        if "Connection refused" in error_msg or "连接" in error_msg:
+            return (
+                f"无法连接到 ComfyUI ({self.config.comfyui_url})\n"
+                f"请确认：\n"
+                f"  1. ComfyUI 已启动\n"
+                f"  2. 地址和端口正确（可通过 COMFYUI_URL 环境变量修改）\n"
+                f"  3. 防火墙未阻止连接"
+            )
+        elif "timeout" in error_msg.lower() or "超时" in error_msg:
+            return (
+                f"连接 ComfyUI 超时 ({self.config.comfyui_url})\n"
+                f"可能原因：网络延迟、ComfyUI 负载过高"
+            )
+        else:
+            return f"ComfyUI 连接错误: {error_msg}"
+
+    @staticmethod
+    def _is_transport_error(e: BaseException) -> bool:
+        """连接层面的失败（拒绝连接 / 超时）；ComfyUI 已返回 HTTP 错误（如 400 校验失败）则不算。"""
+        return getattr(e, "response", None) is None and not hasattr(e, "code")
+
+    # -------------------------
+    # 耗时估计 / ETA
+    # -------------------------
+    def _backend_name(self) -> str:
+        return "inprocess" if self.inprocess is not None else self.config.comfyui_url
+
+    def _ensure_cost_model(self) -> None:
+        """首次估计前，用最近历史记录中的实测耗时预热模型。"""
+        if self._cost_model_loaded:
+            return
+        with self._cost_model_lock:
+            if self._cost_model_loaded:
+                return
+            try:
+                records = self.history.list_recent(500)
+            except Exception:
+                records = []
+            samples = []
+            for rec in reversed(records):
+                job = (rec.timings or {}).get("job")
+                seconds = (rec.timings or {}).get("execute_s")
+                if isinstance(job, dict) and seconds:
+                    samples.append((CostModel.key(job.get("backend", ""), job), job, float(seconds)))
+            self.cost_model.load(samples)
+            self._cost_model_loaded = True
+
+    def warmup(self) -> None:
+        """提前完成首次生成时才做的本地初始化（目前为：从历史记录加载耗时模型），供常驻进程在后台调用。"""
+        self._ensure_cost_model()
+
+    def estimate_job(self, prompt: Dict[str, Any]) -> Tuple[Dict[str, Any], float, bool]:
+        """估计注入后 workflow 的执行耗时，返回 (成本特征, 预计秒数, 模型是否可信)。"""
+        self._ensure_cost_model()
+        features = job_features(prompt)
+        features["backend"] = self._backend_name()
+        predicted, confident = self.cost_model.predict(CostModel.key(features["backend"], features), features)
+        return features, predicted, confident
+
+    def _job_timeout(self, predicted_s: float, confident: bool) -> Optional[float]:
+        """按任务的执行超时：模型可信时为预计耗时 × 倍数，限制在 [120 秒, timeout_s]；否则为 None（只用固定超时）。
+
+        从任务在 ComfyUI 中开始执行时计时：排在其他客户端的任务后面等待的时间不计入。
+        """
+        if not confident or self.config.timeout_factor <= 0:
+            return None
+        return min(float(self.config.timeout_s), max(_MIN_JOB_TIMEOUT_S, predicted_s * self.config.timeout_factor))
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """本执行器当前的任务（排队中 / 执行中）及其预计排队等待与完成时间。"""
+        return self.scheduler.jobs()
+
+    # -------------------------
+    # 指标
+    # -------------------------
+    def _register_metrics(self) -> None:
+        m = self.metrics
+        m.describe("anima_stage_seconds", "histogram", "generate() 各阶段耗时（秒）")
+        m.describe("anima_jobs_total", "counter", "生成任务数（按结果：ok / cancelled / timeout / unavailable / error）")
+        m.describe("anima_images_total", "counter", "生成的图片数")
+        m.gauge(
+            "anima_scheduler_jobs",
+            "本地调度器中的任务数（outstanding = 已进入 ComfyUI，waiting = 本地排队中）",
+            lambda: [
+                ({"priority": priority, "state": state}, count)
+                for state in ("outstanding", "waiting")
+                for priority, count in self.scheduler.stats()[state].items()
+            ],
+        )
+        m.gauge(
+            "anima_backend_up",
+            "后端是否可用（熔断器未打开为 1）",
+            lambda: [({"backend": self._backend_name()}, 0 if self.inprocess is None and self.breaker.state == "open" else 1)],
+        )
+
+    @contextmanager
+    def _stage(self, timings: Optional[Dict[str, Any]], name: str) -> Iterator[None]:
+        """把 with 块的耗时累加到 timings["<name>_s"]（timings 为 None 时不记录），并触发 stage_start / stage_end 钩子。"""
+        hooks = self.hooks
+        ts = time.time()
+        if hooks.active(STAGE_START):
+            hooks.emit(STAGE_START, self._hook_payload(ts, stage=name))
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if timings is not None:
+                key = f"{name}_s"
+                timings[key] = timings.get(key, 0.0) + elapsed
+            if hooks.active(STAGE_END):
+                hooks.emit(STAGE_END, self._hook_payload(ts, stage=name, duration_s=elapsed, error=error))
+
+    @staticmethod
+    def _outcome_of(e: BaseException) -> str:
+        if isinstance(e, JobCancelledError):
+            return "cancelled"
+        if isinstance(e, TimeoutError):
+            return "timeout"
+        if isinstance(e, BackendUnavailableError):
+            return "unavailable"
+        return "error"
+
+    def _metric_labels(self, prompt_json: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            "backend": self._backend_name(),
+            "model": str(prompt_json.get("unet_name") or self.config.unet_name or ""),
+        }
+
+    def _observe_timings(self, labels: Dict[str, str], timings: Dict[str, Any]) -> None:
+        for key, value in timings.items():
+            if key.endswith("_s") and key != "predicted_s" and isinstance(value, (int, float)):
+                self.metrics.observe("anima_stage_seconds", float(value), stage=key[:-2], **labels)
+
+    def metrics_text(self) -> str:
+        """Prometheus 文本格式（0.0.4）的指标。"""
+        return self.metrics.render()
+
+    # -------------------------
+    # 剖析钩子
+    # -------------------------
+    def _hook_payload(self, ts: float, **extra: Any) -> Dict[str, Any]:
+        """钩子 payload：当前线程正在执行的任务（job / request_id / prompt_id）+ 开始时刻 + 线程。"""
+        job = getattr(self._job_local, "job", None) or {}
+        payload = {
+            "job": job.get("job"),
+            "request_id": job.get("request_id"),
+            "prompt_id": job.get("prompt_id"),
+            "ts": ts,
+            "thread": threading.get_ident(),
+        }
+        payload.update(extra)
+        return payload
+
+    @contextmanager
+    def _http_call(self, method: str, url: str) -> Iterator[None]:
+        """对 ComfyUI 的一次 HTTP 请求：结束时触发 http_call 钩子。"""
+        if not self.hooks.active(HTTP_CALL):
+            yield
+            return
+        ts = time.time()
+        started = time.perf_counter()
+        status: Optional[int] = 200
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            response = getattr(e, "response", None)
+            status = getattr(response, "status_code", None) or getattr(e, "code", None)
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.hooks.emit(HTTP_CALL, self._hook_payload(
+                ts, method=method, url=url, status=status, duration_s=time.perf_counter() - started, error=error
+            ))
 
     # -------------------------
     # ComfyUI execution
     # -------------------------
-    def queue_prompt(self, prompt: Dict[str, Any]) -> str:
+    def queue_prompt(self, prompt: Dict[str, Any], front: bool = False) -> str:
+        """提交到 ComfyUI 队列；front=True 时插到队首（交互式任务）。"""
+        prompt_id = self._submit_prompt(prompt, front)
+        with self._active_lock:
+            self._active_prompts[prompt_id] = time.time()
+        return prompt_id
+
+    def _submit_prompt(self, prompt: Dict[str, Any], front: bool = False) -> str:
+        if self.inprocess is not None:
+            try:
+                return self.inprocess.queue_prompt(prompt, self._client_id, front=front)
+            except InProcessUnavailableError as e:
+                # ComfyUI 内部接口不兼容：本实例此后一律走 HTTP
+                print(f"[ComfyUI-AnimaTool] In-process submission unavailable, fallback to HTTP: {e}", file=sys.stderr)
+                self.inprocess = None
+
         url = urljoin(self.config.comfyui_url.rstrip("/") + "/", "prompt")
         payload = {"prompt": prompt, "client_id": self._client_id}
+        if front:
+            payload["front"] = True
         
         try:
             resp = self._http_post_json(url, payload)
         except Exception as e:
-            # 先检查 ComfyUI 是否可访问
-            is_healthy, health_msg = self.check_comfyui_health()
-            if not is_healthy:
-                raise RuntimeError(health_msg) from e
-            raise
+            if not self._is_transport_error(e):
+                # ComfyUI 已返回 HTTP 错误（如 400 校验失败），说明可以访问
+                self.breaker.record_success()
+                raise
+            # 不再逐请求探测：记入熔断器，连续失败后后续请求直接快速失败
+            message = self._describe_connection_error(e)
+            self.breaker.record_failure(message)
+            raise RuntimeError(message) from e
+        self.breaker.record_success()
         
         prompt_id = str(resp.get("prompt_id") or "")
         if not prompt_id:
@@ -479,17 +997,126 @@ class AnimaExecutor:
             raise RuntimeError(f"ComfyUI /prompt 返回异常：{resp}")
         return prompt_id
 
-    def wait_history(self, prompt_id: str) -> Dict[str, Any]:
-        url = urljoin(self.config.comfyui_url.rstrip("/") + "/", f"history/{prompt_id}")
-        deadline = time.time() + float(self.config.timeout_s)
-        last = None
-        while time.time() < deadline:
-            data = self._http_get_json(url)
-            last = data
-            if isinstance(data, dict) and prompt_id in data:
-                return data[prompt_id]
-            time.sleep(float(self.config.poll_interval_s))
-        raise TimeoutError(f"等待 ComfyUI 生成超时：prompt_id={prompt_id}, last={last}")
+    def wait_history(
+        self,
+        prompt_id: str,
+        cancel_token: Optional[CancelToken] = None,
+        timeout_s: Optional[float] = None,
+        exec_timeout_s: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """等待任务完成并返回其 history 条目。
+
+        timeout_s（默认 config.timeout_s）从提交起计时；exec_timeout_s 从任务离开 ComfyUI 的等待队列起计时，
+        不含排在其他任务（包括其他客户端的任务）后面的时间。
+        超时或 cancel_token 被取消时，先撤销 ComfyUI 中的任务（删除排队项 / 中断执行）再抛出异常。
+        """
+        timeout_s = float(self.config.timeout_s if timeout_s is None else timeout_s)
+        try:
+            if self.inprocess is not None and self.inprocess.owns(prompt_id):
+                # 进程内后端在超时 / 取消时自行撤销任务
+                return self.inprocess.wait_history(prompt_id, timeout_s, cancel_token, exec_timeout_s=exec_timeout_s)
+            return self._poll_history(prompt_id, cancel_token, timeout_s, exec_timeout_s)
+        finally:
+            with self._active_lock:
+                self._active_prompts.pop(prompt_id, None)
+
+    def _prompt_pending(self, prompt_id: str) -> bool:
+        """任务是否仍在 ComfyUI 的等待队列中（查询失败时视为仍在等待：偶发错误不能提前开始按任务计时）"""
+        try:
+            url = urljoin(self.config.comfyui_url.rstrip("/") + "/", "queue")
+            queue = self._http_get_json(url, timeout=min(float(self.config.timeout_s), 10.0))
+        except Exception:
+            return True
+        return any(len(item) > 1 and item[1] == prompt_id for item in (queue or {}).get("queue_pending") or [])
+
+    def _poll_history(
+        self, prompt_id: str, cancel_token: Optional[CancelToken], timeout_s: float, exec_timeout_s: Optional[float] = None
+    ) -> Dict[str, Any]:
+        try:
+            url = urljoin(self.config.comfyui_url.rstrip("/") + "/", f"history/{prompt_id}")
+            deadline = time.time() + timeout_s
+            last = None
+            polls = 0
+            while time.time() < deadline:
+                polls += 1
+                if (
+                    exec_timeout_s is not None
+                    and polls % _QUEUE_CHECK_EVERY == 1
+                    and not self._prompt_pending(prompt_id)
+                ):
+                    # 开始执行：按任务的超时从此刻起计时
+                    deadline = min(deadline, time.time() + exec_timeout_s)
+                    exec_timeout_s = None
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                try:
+                    data = self._http_get_json(url)
+                except Exception as e:
+                    if self._is_transport_error(e):
+                        self.breaker.record_failure(self._describe_connection_error(e))
+                    raise
+                last = data
+                if isinstance(data, dict) and prompt_id in data:
+                    return data[prompt_id]
+                if cancel_token is not None:
+                    cancel_token.wait(float(self.config.poll_interval_s))
+                else:
+                    time.sleep(float(self.config.poll_interval_s))
+            raise TimeoutError(f"等待 ComfyUI 生成超时：prompt_id={prompt_id}, last={last}")
+        except (TimeoutError, JobCancelledError):
+            self.cancel_job(prompt_id)
+            raise
+
+    def cancel_job(self, prompt_id: str) -> str:
+        """撤销 ComfyUI 中的任务：仍在排队则删除，正在执行则中断。
+
+        返回 "deleted" / "interrupted" / "running" / "not_found"（已不在队列中）/ "failed"。
+        旧版 ComfyUI 的 /interrupt 不认 prompt_id、总是中断当前任务：查到运行中到发出中断之间
+        本任务若已结束，就会误中断别的客户端的任务，因此这类后端上不中断，返回 "running"（任务会跑完）。
+        """
+        try:
+            if self.inprocess is not None and self.inprocess.owns(prompt_id):
+                return self.inprocess.cancel(prompt_id)
+
+            base = self.config.comfyui_url.rstrip("/") + "/"
+            timeout = min(float(self.config.timeout_s), 10.0)
+            queue = self._http_get_json(urljoin(base, "queue"), timeout=timeout)
+            pending = any(len(item) > 1 and item[1] == prompt_id for item in (queue or {}).get("queue_pending") or [])
+            # 删除排队项（不在队列中时是空操作），再检查是否正在执行（删除前可能刚开始执行）
+            self._http_post_json(urljoin(base, "queue"), {"delete": [prompt_id]}, timeout=timeout, expect_json=False)
+            queue = self._http_get_json(urljoin(base, "queue"), timeout=timeout)
+            running = [item[1] for item in (queue or {}).get("queue_running") or [] if len(item) > 1]
+            if prompt_id in running:
+                if not self._supports_targeted_interrupt(base, timeout):
+                    print(
+                        f"[ComfyUI-AnimaTool] ComfyUI does not support targeted interrupt; "
+                        f"prompt {prompt_id} keeps running",
+                        file=sys.stderr,
+                    )
+                    return "running"
+                self._http_post_json(urljoin(base, "interrupt"), {"prompt_id": prompt_id}, timeout=timeout, expect_json=False)
+                return "interrupted"
+            return "deleted" if pending else "not_found"
+        except Exception as e:
+            print(f"[ComfyUI-AnimaTool] Failed to cancel prompt {prompt_id}: {e}", file=sys.stderr)
+            return "failed"
+
+    def _supports_targeted_interrupt(self, base: str, timeout: float) -> bool:
+        """按 /system_stats 报告的 comfyui_version 判断 /interrupt 是否支持 prompt_id（版本未知视为不支持）。"""
+        if self._targeted_interrupt is None:
+            stats = self._http_get_json(urljoin(base, "system_stats"), timeout=timeout)
+            version = str(((stats or {}).get("system") or {}).get("comfyui_version") or "")
+            parts = re.findall(r"\d+", version.split("-")[0])[:3]
+            self._targeted_interrupt = (
+                len(parts) == 3 and tuple(int(x) for x in parts) >= _TARGETED_INTERRUPT_MIN_VERSION
+            )
+        return self._targeted_interrupt
+
+    def cancel_active_jobs(self) -> int:
+        """撤销本执行器提交且仍在等待结果的全部任务（例如服务退出前），返回撤销的数量。"""
+        with self._active_lock:
+            prompt_ids = list(self._active_prompts)
+        return sum(1 for pid in prompt_ids if self.cancel_job(pid) in ("deleted", "interrupted"))
 
     def _extract_images(self, prompt_id: str, history_item: Dict[str, Any]) -> List[GeneratedImage]:
         outputs = history_item.get("outputs") or {}
@@ -516,25 +1143,84 @@ class AnimaExecutor:
                 )
         return images
 
-    def _download_images(self, images: List[GeneratedImage]) -> List[GeneratedImage]:
-        """下载图片并保存到本地，同时保留原始 bytes 用于 base64 编码"""
+    def _resolve_local_image(self, im: GeneratedImage) -> Optional[Path]:
+        """同机模式：在 ComfyUI 的 output 目录中直接定位图片文件。
+
+        仅处理 type=output 的图片；路径必须位于 output 目录内，且文件存在。
+        """
+        if not self.config.comfyui_output_dir or im.folder_type != "output":
+            return None
+        try:
+            root = Path(self.config.comfyui_output_dir).resolve()
+            src = (root / (im.subfolder or "") / im.filename).resolve()
+            src.relative_to(root)
+        except Exception:
+            return None
+        return src if src.is_file() else None
+
+    def _link_local_image(self, src: Path, dst: Path) -> Path:
+        """按 output_link_mode 把 ComfyUI 的输出文件落到 output_dir，返回最终路径。"""
+        mode = self.config.output_link_mode
+        if mode == "reference":
+            return src
+        if dst.resolve() == src:
+            return src
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists():
+            dst.unlink()
+        if mode == "hardlink":
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass  # 跨设备 / 文件系统不支持时退回复制
+        shutil.copy2(src, dst)
+        return dst
+
+    def _download_images(
+        self,
+        images: List[GeneratedImage],
+        include_base64: bool = True,
+        timings: Optional[Dict[str, Any]] = None,
+    ) -> List[GeneratedImage]:
+        """获取图片并保存到本地。
+
+        - 同机模式（配置了 comfyui_output_dir）：直接引用 / 硬链接 ComfyUI 的输出文件
+        - 其他情况：经 /view 下载
+        - 仅在 include_base64 时保留原始 bytes（用于 base64 编码）
+        - timings：累加 download_s（读取 / 下载）与 disk_write_s（落盘 / 链接）
+        """
         out_dir = Path(self.config.output_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
+        if timings is None:
+            timings = {}
 
         downloaded: List[GeneratedImage] = []
         for im in images:
-            # 总是下载内容（用于 base64）
-            content = self._http_get_bytes(im.view_url)
-            
+            content = None
             saved_path = None
-            if self.config.download_images:
-                # 复刻 ComfyUI 的 subfolder 结构（可选）
-                sub_dir = out_dir / (im.subfolder or "")
-                sub_dir.mkdir(parents=True, exist_ok=True)
-                dst = sub_dir / im.filename
-                dst.write_bytes(content)
-                saved_path = str(dst)
-            
+            local = self._resolve_local_image(im)
+
+            if local is not None:
+                if self.config.download_images:
+                    with self._stage(timings, "disk_write"):
+                        saved_path = str(self._link_local_image(local, out_dir / (im.subfolder or "") / im.filename))
+                if include_base64:
+                    with self._stage(timings, "download"):
+                        content = local.read_bytes()
+            else:
+                with self._stage(timings, "download"):
+                    content = self._http_get_bytes(im.view_url)
+                if self.config.download_images:
+                    # 复刻 ComfyUI 的 subfolder 结构（可选）
+                    with self._stage(timings, "disk_write"):
+                        sub_dir = out_dir / (im.subfolder or "")
+                        sub_dir.mkdir(parents=True, exist_ok=True)
+                        dst = sub_dir / im.filename
+                        dst.write_bytes(content)
+                    saved_path = str(dst)
+                if not include_base64:
+                    content = None
+
             downloaded.append(
                 GeneratedImage(
                     filename=im.filename,
@@ -547,6 +1233,106 @@ class AnimaExecutor:
             )
         return downloaded
 
+    def _postprocess_enabled(self) -> bool:
+        if not self.config.output_format and not (self.config.thumbnail_size or 0) > 0:
+            return False
+        if not imaging.pillow_available():
+            if not getattr(self, "_pillow_warned", False):
+                print("[ComfyUI-AnimaTool] Pillow not installed, skip transcoding / thumbnails.", file=sys.stderr)
+                self._pillow_warned = True
+            return False
+        return True
+
+    def thumbnails_enabled(self) -> bool:
+        """是否会为结果生成缩略图（已配置 thumbnail_size 且 Pillow 可用）。"""
+        return (self.config.thumbnail_size or 0) > 0 and self._postprocess_enabled()
+
+    def _postprocess_images(self, images: List[GeneratedImage], include_base64: bool) -> List[GeneratedImage]:
+        """输出后处理：转码为 WebP/JPEG 并生成有界尺寸的缩略图（在进程池中执行）。
+
+        原图保持不变；处理失败的图片原样返回。
+        """
+        if not images or not self._postprocess_enabled():
+            return images
+
+        output_format = imaging.normalize_format(self.config.output_format)
+        thumbnail_size = max(0, int(self.config.thumbnail_size or 0))
+        pool = imaging.get_pool(int(self.config.postprocess_workers))
+
+        futures = []
+        for im in images:
+            source: Any = im.saved_path or im.content
+            if not source:
+                futures.append(None)
+                continue
+            # 派生文件总是写到本工具的 output_dir（reference 模式下原图可能在 ComfyUI 目录里）
+            dst_dir = str(Path(self.config.output_dir) / (im.subfolder or "")) if im.saved_path else None
+            futures.append(pool.submit(
+                imaging.process_image,
+                source, im.filename, dst_dir,
+                output_format, int(self.config.output_quality), thumbnail_size, include_base64,
+            ))
+
+        processed: List[GeneratedImage] = []
+        for im, fut in zip(images, futures):
+            if fut is None:
+                processed.append(im)
+                continue
+            try:
+                variants = fut.result()
+            except Exception as e:
+                if "BrokenProcessPool" in type(e).__name__:
+                    imaging.reset_pool()
+                print(f"[ComfyUI-AnimaTool] Post-processing failed for {im.filename}: {e}", file=sys.stderr)
+                processed.append(im)
+                continue
+            processed.append(replace(im, transcoded=variants.get("transcoded"), thumbnail=variants.get("thumbnail")))
+        return processed
+
+    def _build_image_entries(self, images: List[GeneratedImage], include_base64: bool) -> List[Dict[str, Any]]:
+        """构建结果中的图片信息（URL / 本地路径 / base64 / data URL / markdown 等多种格式）"""
+        images_data = []
+        for im in images:
+            mime_type = self._get_mime_type(im.filename)
+            content = im.content
+            if im.transcoded is not None:
+                # 转码后的版本更小：base64 / mime_type 使用转码结果，原图仍在 file_path
+                mime_type = im.transcoded["mime_type"]
+                content = im.transcoded.get("content") if include_base64 else None
+            b64 = base64.b64encode(content).decode("ascii") if content else None
+
+            img_info = {
+                "filename": im.filename,
+                "subfolder": im.subfolder,
+                "type": im.folder_type,
+                # URL 格式
+                "url": im.view_url,
+                "view_url": im.view_url,  # 兼容旧字段
+                # 本地路径
+                "file_path": im.saved_path,
+                "saved_path": im.saved_path,  # 兼容旧字段
+                # Base64 格式（用于 MCP / Gemini / 嵌入）
+                "base64": b64,
+                "mime_type": mime_type,
+                # Data URL（可直接用于 <img src> 或 markdown）
+                "data_url": f"data:{mime_type};base64,{b64}" if b64 else None,
+                # Markdown 格式（AI 可直接输出）
+                "markdown": f"![{im.filename}]({im.view_url})",
+            }
+            if im.transcoded is not None:
+                img_info["transcoded_path"] = im.transcoded.get("file_path")
+            if im.thumbnail is not None:
+                thumb = im.thumbnail
+                img_info["thumbnail"] = {
+                    "file_path": thumb.get("file_path"),
+                    "mime_type": thumb["mime_type"],
+                    "width": thumb["width"],
+                    "height": thumb["height"],
+                    "base64": base64.b64encode(thumb["content"]).decode("ascii") if thumb.get("content") else None,
+                }
+            images_data.append(img_info)
+        return images_data
+
     def _get_mime_type(self, filename: str) -> str:
         """根据文件名推断 MIME 类型"""
         ext = Path(filename).suffix.lower()
@@ -558,6 +1344,19 @@ class AnimaExecutor:
             ".gif": "image/gif",
         }.get(ext, "image/png")
 
+    def get_history_image_path(self, history_id: Any, index: int) -> Optional[Path]:
+        """返回历史记录中第 index 张图片的本地路径；不存在时返回 None。"""
+        record = self.history.get(str(history_id))
+        if record is None or record.id != _safe_int(history_id):
+            return None
+        if not 0 <= index < len(record.images):
+            return None
+        path = record.images[index]
+        if not path:
+            return None
+        p = Path(path)
+        return p if p.is_file() else None
+
     def check_models(self) -> Tuple[bool, str]:
         """
         检查模型文件是否存在（如果配置了 COMFYUI_MODELS_DIR）。
@@ -577,57 +1376,164 @@ class AnimaExecutor:
             f"并放置到 ComfyUI/models/ 对应子目录"
         )
 
-    def generate(self, prompt_json: Dict[str, Any]) -> Dict[str, Any]:
+    def generate(
+        self,
+        prompt_json: Dict[str, Any],
+        *,
+        include_base64: Optional[bool] = None,
+        idempotency_key: Optional[str] = None,
+        cancel_token: Optional[CancelToken] = None,
+        priority: Optional[str] = None,
+        client: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
         输入结构化 JSON，执行生成。
 
+        include_base64：结果中是否内嵌 base64；None 时使用 config.embed_base64。
+        idempotency_key：重试时传同一个 key，不会重复提交（执行中则等待同一任务，已完成则返回保存的结果）。
+        cancel_token：被取消时撤销 ComfyUI 中的任务并抛出 JobCancelledError（客户端断开 / 请求取消）。
+        priority：interactive / normal（默认）/ batch；决定本地排队顺序，interactive 插到 ComfyUI 队首。
+        client：请求方标识（见 admission.client_identity），同优先级内按客户端加权公平排队。
+
         返回：
         - prompt_id
         - positive / negative（最终发送给 ComfyUI 的文本）
         - width / height
         - images: [{filename, url, file_path, base64, mime_type, markdown}]
         """
+        priority = normalize_priority(priority)
+        return self.idempotency.run(
+            idempotency_key,
+            request_fingerprint("generate", prompt_json, include_base64),
+            lambda: self._generate(
+                prompt_json,
+                include_base64=include_base64,
+                cancel_token=cancel_token,
+                priority=priority,
+                client=client,
+            ),
+        )
+
+    def _generate(
+        self,
+        prompt_json: Dict[str, Any],
+        *,
+        include_base64: Optional[bool] = None,
+        cancel_token: Optional[CancelToken] = None,
+        priority: str = "normal",
+        client: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        labels = self._metric_labels(prompt_json)
+        # 本线程正在执行的任务：钩子 payload 据此关联 request_id 与 prompt_id
+        job = {"job": uuid.uuid4().hex[:12], "request_id": current_request_id() or new_request_id(), "prompt_id": None}
+        outer = getattr(self._job_local, "job", None)
+        self._job_local.job = job
+        ts = time.time()
+        started = time.perf_counter()
+        if self.hooks.active(JOB_START):
+            self.hooks.emit(JOB_START, self._hook_payload(ts, priority=priority, client=client))
+        outcome = "ok"
+        result: Dict[str, Any] = {}
+        try:
+            result = self._generate_job(
+                prompt_json,
+                include_base64=include_base64,
+                cancel_token=cancel_token,
+                priority=priority,
+                client=client,
+            )
+        except Exception as e:
+            outcome = self._outcome_of(e)
+            self.metrics.inc("anima_jobs_total", outcome=outcome, **labels)
+            raise
+        finally:
+            if self.hooks.active(JOB_END):
+                self.hooks.emit(JOB_END, self._hook_payload(
+                    ts,
+                    duration_s=time.perf_counter() - started,
+                    outcome=outcome,
+                    priority=priority,
+                    client=client,
+                    timings=result.get("timings"),
+                    comfy_window=job.get("comfy_window"),
+                ))
+            self._job_local.job = outer
+        self.metrics.inc("anima_jobs_total", outcome="ok", **labels)
+        self.metrics.inc("anima_images_total", len(result.get("images") or []), **labels)
+        self._observe_timings(labels, result.get("timings") or {})
+        return result
+
+    def _generate_job(
+        self,
+        prompt_json: Dict[str, Any],
+        *,
+        include_base64: Optional[bool] = None,
+        cancel_token: Optional[CancelToken] = None,
+        priority: str = "normal",
+        client: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        started = time.perf_counter()
+        timings: Dict[str, Any] = {}
         # 预检查：模型文件
-        models_ok, models_msg = self.check_models()
+        with self._stage(timings, "model_check"):
+            models_ok, models_msg = self.check_models()
         if not models_ok:
             raise RuntimeError(models_msg)
         
-        prompt = self._inject(prompt_json)
-        prompt_id = self.queue_prompt(prompt)
-        history_item = self.wait_history(prompt_id)
-        images = self._extract_images(prompt_id, history_item)
-        images = self._download_images(images)
+        if self.inprocess is None:
+            # 后端熔断中立即失败（BackendUnavailableError），不再等待连接超时
+            self.health.ensure_started()
+            self.breaker.before_request()
+        with self._stage(timings, "inject"):
+            prompt = self._inject(prompt_json)
+        with self._stage(timings, "validate"):
+            self.validate_prompt(prompt)
+        features, predicted_s, confident = self.estimate_job(prompt)
+        # 在本地按优先级排队，轮到时才进入 ComfyUI（任务完成后归还名额）
+        with ExitStack() as stack:
+            with self._stage(timings, "queue_wait"):
+                slot = stack.enter_context(self.scheduler.slot(
+                    priority, cancel_token, client=client, weight=self.admission.weight(client), cost=predicted_s
+                ))
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            submitted = time.perf_counter()
+            with self._stage(timings, "submit"):
+                prompt_id = self.queue_prompt(prompt, front=slot.front)
+            self._job_local.job["prompt_id"] = prompt_id
+            self.scheduler.set_prompt_id(slot.job_id, prompt_id)
+            exec_timeout_s = self._job_timeout(predicted_s, confident)
+            with self._stage(None, "wait_history"):
+                history_item = self.wait_history(prompt_id, cancel_token, exec_timeout_s=exec_timeout_s)
+        comfy_s = time.perf_counter() - submitted
+        # ComfyUI 记录的执行时长不含在其队列中的等待；取不到时退回提交到完成的总时长
+        self._job_local.job["comfy_window"] = execution_window(history_item)
+        execute_s = execution_seconds(history_item)
+        timings["comfy_s"] = comfy_s
+        timings["execute_s"] = execute_s if execute_s is not None else comfy_s
+        # 提交后在 ComfyUI 队列中等待的时间（含提交请求本身）
+        timings["comfy_queue_s"] = max(0.0, comfy_s - timings["execute_s"])
+        self.cost_model.observe(CostModel.key(features["backend"], features), features, timings["execute_s"])
 
-        # 构建图片信息（包含多种格式）
-        images_data = []
-        for im in images:
-            mime_type = self._get_mime_type(im.filename)
-            b64 = base64.b64encode(im.content).decode("ascii") if im.content else None
-            
-            img_info = {
-                "filename": im.filename,
-                "subfolder": im.subfolder,
-                "type": im.folder_type,
-                # URL 格式
-                "url": im.view_url,
-                "view_url": im.view_url,  # 兼容旧字段
-                # 本地路径
-                "file_path": im.saved_path,
-                "saved_path": im.saved_path,  # 兼容旧字段
-                # Base64 格式（用于 MCP / Gemini / 嵌入）
-                "base64": b64,
-                "mime_type": mime_type,
-                # Data URL（可直接用于 <img src> 或 markdown）
-                "data_url": f"data:{mime_type};base64,{b64}" if b64 else None,
-                # Markdown 格式（AI 可直接输出）
-                "markdown": f"![{im.filename}]({im.view_url})",
-            }
-            images_data.append(img_info)
+        images = self._extract_images(prompt_id, history_item)
+        if include_base64 is None:
+            include_base64 = self.config.embed_base64
+        # 未落盘时，后处理需要原图 bytes
+        keep_content = include_base64 or (not self.config.download_images and self._postprocess_enabled())
+        timings.setdefault("download_s", 0.0)
+        timings.setdefault("disk_write_s", 0.0)
+        images = self._download_images(images, include_base64=keep_content, timings=timings)
+        with self._stage(timings, "postprocess"):
+            images = self._postprocess_images(images, include_base64=include_base64)
+        if not include_base64:
+            images = [replace(im, content=None) for im in images]
+
+        with self._stage(timings, "encode"):
+            images_data = self._build_image_entries(images, include_base64)
 
         # 回显最终参数（便于调试）
         actual_seed = int(prompt["19"]["inputs"]["seed"])
-        actual_width = int(prompt["28"]["inputs"]["width"])
-        actual_height = int(prompt["28"]["inputs"]["height"])
+        actual_width, actual_height = self._latent_size(prompt)
 
         result = {
             "success": True,
@@ -640,16 +1546,32 @@ class AnimaExecutor:
             "images": images_data,
         }
 
+        timings["total_s"] = time.perf_counter() - started
+        stored = {k: round(v, 3) for k, v in timings.items()}
+        stored["predicted_s"] = round(predicted_s, 2)
+        stored["job"] = features
+
         # 记录到历史
-        record = self.history.add(
-            params=prompt_json,
-            positive_text=result["positive"],
-            negative_text=result["negative"],
-            prompt_id=prompt_id,
-            seed=actual_seed,
-            width=actual_width,
-            height=actual_height,
-        )
+        with self._stage(timings, "history_write"):
+            record = self.history.add(
+                params=prompt_json,
+                positive_text=result["positive"],
+                negative_text=result["negative"],
+                prompt_id=prompt_id,
+                seed=actual_seed,
+                width=actual_width,
+                height=actual_height,
+                images=[im.saved_path for im in images],
+                timings=stored,
+            )
         result["history_id"] = record.id
+        if self.hooks.active(HISTORY_WRITE):
+            self.hooks.emit(HISTORY_WRITE, self._hook_payload(time.time(), history_id=record.id))
+
+        # 各阶段耗时（秒）；历史记录中保存的版本不含 history_write_s，total_s 也不含写历史
+        timings["total_s"] = time.perf_counter() - started
+        result["timings"] = {k: round(v, 3) for k, v in timings.items()}
+        result["timings"]["predicted_s"] = round(predicted_s, 2)
+        result["request_id"] = self._job_local.job["request_id"]
 
         return result
@@ -0,0 +1,73 @@
+"""
+任务取消：客户端断开 / 请求被取消 / 等待超时时，让 ComfyUI 放弃对应的任务。
+
+- CancelToken：线程安全的取消标记，由前端持有、传入 AnimaExecutor.generate()
+- 执行器在提交前与等待期间检查标记；取消时从 ComfyUI 队列删除任务，已在执行则中断
+- run_cancellable()：在线程中执行同步生成，同时轮询客户端是否断开，
+  并把 asyncio 的取消（如 MCP 的 notifications/cancelled）转成 CancelToken.cancel()
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class JobCancelledError(RuntimeError):
+    """生成任务已被取消（客户端断开或请求被取消）。"""
+
+
+class CancelToken:
+    """取消标记：cancel() 后 cancelled 为真，等待中的 wait() 立即返回。"""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "已取消") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待最多 timeout 秒，期间被取消则提前返回 True。"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise JobCancelledError(f"生成任务已取消：{self.reason}")
+
+
+async def run_cancellable(
+    fn: Callable[[CancelToken], T],
+    *,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    poll_interval_s: float = 0.5,
+) -> T:
+    """在工作线程中执行 fn(token)。
+
+    - is_disconnected：客户端断开检测（如 Starlette 的 request.is_disconnected）；断开时取消 token，
+      并等待 fn 清理完 ComfyUI 任务后抛出 JobCancelledError
+    - 当前协程被取消时同样取消 token（工作线程会尽快结束并撤销 ComfyUI 任务）
+    """
+    token = CancelToken()
+    task = asyncio.ensure_future(asyncio.to_thread(fn, token))
+    try:
+        if is_disconnected is None:
+            return await asyncio.shield(task)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval_s)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                token.cancel("客户端已断开")
+                return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        token.cancel("请求已取消")
+        raise
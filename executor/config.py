@@ -57,6 +57,38 @@ class AnimaToolConfig:
     - ANIMATOOL_POLL_INTERVAL: 轮询间隔（秒，默认 1）
     - ANIMATOOL_TARGET_MP: 目标像素数（MP，默认 1.0）
     - ANIMATOOL_ROUND_TO: 分辨率对齐倍数（默认 16）
+    - COMFYUI_OUTPUT_DIR: ComfyUI 的 output 目录（同机/共享挂载时直接读取，不走 /view）
+    - ANIMATOOL_OUTPUT_LINK_MODE: 同机模式下的落盘方式 hardlink/reference/copy（默认 hardlink）
+    - ANIMATOOL_EMBED_BASE64: 结果中是否内嵌 base64（默认 true）
+    - ANIMATOOL_OUTPUT_FORMAT: 转码格式 webp/jpeg/png（默认不转码，需要 Pillow）
+    - ANIMATOOL_OUTPUT_QUALITY: 转码质量（默认 85）
+    - ANIMATOOL_THUMBNAIL_SIZE: 缩略图最长边（像素，0 关闭；MCP Server 默认 768）
+    - ANIMATOOL_POSTPROCESS_WORKERS: 后处理进程数（默认 2，0 表示使用线程）
+    - ANIMATOOL_CONTACT_SHEET_SIZE: 拼图（contact sheet）最长边（像素，默认 2048）
+    - ANIMATOOL_OBJECT_INFO_TTL: 提交前校验所用 /object_info 缓存的有效期（秒，默认 300，0 关闭校验）
+    - ANIMATOOL_IDEMPOTENCY_TTL: 带 idempotency_key 的请求结果保留时长（秒，默认 600，0 关闭）
+    - ANIMATOOL_MAX_OUTSTANDING: 同时提交到 ComfyUI 队列中未完成的任务上限，其余按优先级在本地排队（默认 2，0 不限制）
+    - ANIMATOOL_SCHEDULER_POLICY: 同优先级内的排队策略 fair（按客户端公平）/ sjf（预计耗时最短优先，默认 fair）
+    - ANIMATOOL_SJF_MAX_WAIT: sjf 策略的老化上限，排队超过该秒数的任务按到达顺序优先（默认 120）
+    - ANIMATOOL_TIMEOUT_FACTOR: 按任务设置执行超时 = 预计耗时 × 该倍数，从任务在 ComfyUI 中开始执行时计时（不少于 120 秒、不超过 ANIMATOOL_TIMEOUT；默认 4，0 使用固定超时）
+    - ANIMATOOL_CLIENT_MAX_CONCURRENT: 每个客户端（API key / MCP 会话 / IP）同时进行的请求上限（默认 4，0 不限制）
+    - ANIMATOOL_CLIENT_RATE: 每个客户端每分钟可提交的任务数（repeat 按次数计，默认 0 不限制）
+    - ANIMATOOL_CLIENT_BURST: 速率限制的突发上限（任务数，默认等于 ANIMATOOL_CLIENT_RATE）
+    - ANIMATOOL_CLIENT_WEIGHTS: 公平排队权重，如 "key1=4,ip:10.0.0.5=2"（默认均为 1）
+    - ANIMATOOL_HEALTH_INTERVAL: 后台探测 ComfyUI 健康状态的间隔（秒，默认 10，0 关闭后台探测）
+    - ANIMATOOL_BREAKER_FAILURES: 连续多少次连接失败后熔断，快速拒绝请求（默认 3）
+    - ANIMATOOL_BREAKER_RESET: 熔断后首次探测恢复前的冷却时间（秒，默认 5，连续失败时加倍至 60）
+    - ANIMATOOL_TRACE_DIR: 设置后把采样请求写成 Chrome trace-event JSON 到该目录（默认不记录）
+    - ANIMATOOL_TRACE_SAMPLE: trace 采样率（0~1，默认 0.05）
+    - ANIMATOOL_VARIATION_DENOISE: reroll 变体模式（img2img）的默认 denoise（默认 0.45）
+    - ANIMATOOL_HISTORY_BACKEND: 历史存储后端 jsonl/sqlite（默认 jsonl）
+    - ANIMATOOL_HISTORY_DIR: 历史文件（history.jsonl / history.sqlite3）所在目录（默认 outputs/）
+    - ANIMATOOL_HISTORY_FLUSH_INTERVAL: 历史批量写盘的最长间隔（秒，默认 0.2）
+    - ANIMATOOL_HISTORY_BATCH_SIZE: 历史批量写盘的条数阈值（默认 64）
+    - ANIMATOOL_HISTORY_FSYNC: 历史写盘 fsync 策略 never/batch/always（默认 never）
+    - ANIMATOOL_HISTORY_SEGMENT_MB: 历史活动段超过该大小（MB）时封存为新分段（默认 0，不分段）
+    - ANIMATOOL_HISTORY_SEGMENT_PERIOD: 历史按周期分段，目前支持 daily（默认不按周期）
+    - ANIMATOOL_HISTORY_COMPACT: 封存分段时是否压缩（去重提示词与参数，默认 false）
 
     示例：
         # Windows PowerShell
@@ -95,6 +127,43 @@ class AnimaToolConfig:
         ) if os.environ.get("ANIMATOOL_OUTPUT_DIR") else Path(__file__).resolve().parent.parent / "outputs"
     )
 
+    # 同机模式：ComfyUI 的 output 目录（作为 custom node 运行时自动探测）
+    # 设置后直接从该目录解析输出图片，不再经 /view 回环下载
+    comfyui_output_dir: Optional[Path] = field(
+        default_factory=lambda: (
+            Path(os.environ["COMFYUI_OUTPUT_DIR"]) if os.environ.get("COMFYUI_OUTPUT_DIR") else None
+        )
+    )
+    # 同机模式下如何落到 output_dir：
+    # - hardlink：硬链接（跨设备时自动退回复制）
+    # - reference：不落盘，file_path 直接指向 ComfyUI 的原文件
+    # - copy：复制
+    output_link_mode: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_OUTPUT_LINK_MODE", "hardlink").strip().lower()
+    )
+    # 结果中是否内嵌 base64（关闭后仅在显式请求时才把图片读入内存）
+    embed_base64: bool = field(
+        default_factory=lambda: _get_env_bool("ANIMATOOL_EMBED_BASE64", True)
+    )
+
+    # 输出后处理（需要 Pillow）：转码与缩略图，原图始终保留
+    output_format: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_OUTPUT_FORMAT", "")
+    )
+    output_quality: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_OUTPUT_QUALITY", 85)
+    )
+    # None 表示未配置，由各前端决定默认值（MCP Server 默认开启缩略图）
+    thumbnail_size: Optional[int] = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_THUMBNAIL_SIZE", -1) if os.environ.get("ANIMATOOL_THUMBNAIL_SIZE") else None
+    )
+    postprocess_workers: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_POSTPROCESS_WORKERS", 2)
+    )
+    contact_sheet_size: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_CONTACT_SHEET_SIZE", 2048)
+    )
+
     # 轮询历史接口等待执行完成
     timeout_s: float = field(
         default_factory=lambda: _get_env_float("ANIMATOOL_TIMEOUT", 600.0)
@@ -102,6 +171,58 @@ class AnimaToolConfig:
     poll_interval_s: float = field(
         default_factory=lambda: _get_env_float("ANIMATOOL_POLL_INTERVAL", 1.0)
     )
+    # 同一 idempotency_key 的重试在该时长内直接复用结果（0 关闭）
+    idempotency_ttl_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_IDEMPOTENCY_TTL", 600.0)
+    )
+    # 只让少量任务进入 ComfyUI 的 FIFO 队列，其余按优先级在本地排队（0 不限制）
+    max_outstanding: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_MAX_OUTSTANDING", 2)
+    )
+    scheduler_policy: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_SCHEDULER_POLICY", "fair").strip().lower() or "fair"
+    )
+    sjf_max_wait_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_SJF_MAX_WAIT", 120.0)
+    )
+    # 耗时模型可信后，按预计耗时设置每个任务的超时（0 关闭，始终使用 timeout_s）
+    timeout_factor: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_TIMEOUT_FACTOR", 4.0)
+    )
+    # 按客户端的准入控制与加权公平排队
+    client_max_concurrent: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_CLIENT_MAX_CONCURRENT", 4)
+    )
+    client_rate_per_min: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_CLIENT_RATE", 0.0)
+    )
+    client_burst: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_CLIENT_BURST", 0.0)
+    )
+    client_weights: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_CLIENT_WEIGHTS", "")
+    )
+    # 后端健康监控与熔断：故障期间请求立即失败，而不是各自等到超时
+    health_interval_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_HEALTH_INTERVAL", 10.0)
+    )
+    breaker_failures: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_BREAKER_FAILURES", 3)
+    )
+    breaker_reset_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_BREAKER_RESET", 5.0)
+    )
+    # Chrome trace 导出（见 profiling.ChromeTracer）：目录为空时不记录
+    trace_dir: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_TRACE_DIR", "")
+    )
+    trace_sample_rate: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_TRACE_SAMPLE", 0.05)
+    )
+    # 提交前按缓存的 /object_info 校验枚举值与模型名（0 关闭）
+    object_info_ttl_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_OBJECT_INFO_TTL", 300.0)
+    )
 
     # 分辨率生成：当只给 aspect_ratio 时，按目标像素数估算宽高
     target_megapixels: float = field(
@@ -114,6 +235,43 @@ class AnimaToolConfig:
         default_factory=lambda: _get_env_int("ANIMATOOL_ROUND_TO", 16)
     )
 
+    # reroll 变体模式：以历史图片为起点（LoadImage → VAEEncode）低 denoise 重采样，
+    # 未显式指定 steps 时步数按 denoise 比例缩减
+    variation_denoise: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_VARIATION_DENOISE", 0.45)
+    )
+
+    # 历史存储后端：jsonl（默认）/ sqlite（大历史量时按 id / prompt_id 索引查询）
+    history_backend: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_HISTORY_BACKEND", "jsonl")
+    )
+    # 历史文件所在目录（两种后端共用；None 为 outputs/）
+    history_dir: Optional[Path] = field(
+        default_factory=lambda: (
+            Path(os.environ["ANIMATOOL_HISTORY_DIR"]).expanduser() if os.environ.get("ANIMATOOL_HISTORY_DIR") else None
+        )
+    )
+    # JSONL 后端的后台批量写入（group commit）
+    history_flush_interval_s: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_HISTORY_FLUSH_INTERVAL", 0.2)
+    )
+    history_batch_size: int = field(
+        default_factory=lambda: _get_env_int("ANIMATOOL_HISTORY_BATCH_SIZE", 64)
+    )
+    history_fsync: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_HISTORY_FSYNC", "never").strip().lower()
+    )
+    # JSONL 后端的分段：按大小 / 日期封存活动段，封存时可选压缩
+    history_segment_mb: float = field(
+        default_factory=lambda: _get_env_float("ANIMATOOL_HISTORY_SEGMENT_MB", 0.0)
+    )
+    history_segment_period: str = field(
+        default_factory=lambda: os.environ.get("ANIMATOOL_HISTORY_SEGMENT_PERIOD", "")
+    )
+    history_compact: bool = field(
+        default_factory=lambda: _get_env_bool("ANIMATOOL_HISTORY_COMPACT", False)
+    )
+
     # -------------------------
     # 模型配置
     # -------------------------
@@ -0,0 +1,170 @@
+"""
+任务耗时模型：根据已完成任务的实测执行时间，预测新任务在 ComfyUI 中的执行耗时。
+
+任务成本主要取决于 宽 × 高 × steps × batch_size 以及 LoRA 数量，这些在 _inject 之后都已确定。
+按 (后端, 模型) 分别拟合线性模型：
+
+    执行秒数 ≈ w0 + w1 · units + w2 · units · loras      （units = 百万像素 × steps × batch）
+
+用带先验的岭回归（向先验权重收缩），样本少时退化为先验，样本多时跟随实测；
+旧样本按指数衰减，GPU / 驱动 / 模型变化后会逐渐适应。
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 先验：约 1 秒固定开销 + 每 百万像素·step 0.25 秒 + 每个 LoRA 额外 5%
+_PRIOR = (1.0, 0.25, 0.0125)
+_RIDGE = 0.5
+_DECAY = 0.98
+# 有效样本数达到该值后才认为预测可信（用于按任务设置超时）
+_CONFIDENT_SAMPLES = 5.0
+
+
+def job_features(prompt: Dict[str, Any]) -> Dict[str, Any]:
+    """从注入后的 workflow 中提取成本特征。"""
+    width = height = 0
+    batch = 1
+    steps = 0
+    loras = 0
+    model = ""
+    for node in prompt.values():
+        class_type = node.get("class_type")
+        inputs = node.get("inputs") or {}
+        if class_type == "EmptyLatentImage":
+            width, height = int(inputs.get("width") or 0), int(inputs.get("height") or 0)
+            batch = int(inputs.get("batch_size") or 1)
+        elif class_type == "ImageScale" and not width:
+            width, height = int(inputs.get("width") or 0), int(inputs.get("height") or 0)
+        elif class_type == "RepeatLatentBatch":
+            batch = int(inputs.get("amount") or 1)
+        elif class_type == "KSampler":
+            steps = int(inputs.get("steps") or 0)
+        elif class_type in ("LoraLoaderModelOnly", "LoraLoader"):
+            loras += 1
+        elif class_type == "UNETLoader":
+            model = str(inputs.get("unet_name") or "")
+    units = width * height / 1e6 * steps * max(1, batch)
+    return {
+        "width": width,
+        "height": height,
+        "steps": steps,
+        "batch": batch,
+        "loras": loras,
+        "model": model,
+        "units": round(units, 4),
+    }
+
+
+def execution_seconds(history_item: Dict[str, Any]) -> Optional[float]:
+    """从 ComfyUI history 的 status.messages 中取实际执行时长（不含在 ComfyUI 队列中的等待）。"""
+    window = execution_window(history_item)
+    return None if window is None else max(0.0, window[1] - window[0])
+
+
+def execution_window(history_item: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """ComfyUI 实际执行的起止时刻（Unix 秒），取不到时为 None。"""
+    messages = ((history_item or {}).get("status") or {}).get("messages") or []
+    start = end = None
+    for message in messages:
+        if not isinstance(message, (list, tuple)) or len(message) < 2 or not isinstance(message[1], dict):
+            continue
+        event, data = message[0], message[1]
+        if event == "execution_start":
+            start = data.get("timestamp")
+        elif event in ("execution_success", "execution_error", "execution_interrupted"):
+            end = data.get("timestamp")
+    if start is None or end is None:
+        return None
+    # ComfyUI 的时间戳为毫秒
+    return float(start) / 1000.0, float(end) / 1000.0
+
+
+def _vector(features: Dict[str, Any]) -> Tuple[float, float, float]:
+    units = float(features.get("units") or 0.0)
+    return 1.0, units, units * float(features.get("loras") or 0)
+
+
+def _solve3(a: List[List[float]], b: List[float]) -> Optional[List[float]]:
+    """3×3 线性方程组（高斯消元，部分主元）。"""
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(3):
+        pivot = max(range(col, 3), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(3):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                for c in range(col, 4):
+                    m[r][c] -= f * m[col][c]
+    return [m[i][3] / m[i][i] for i in range(3)]
+
+
+class _Fit:
+    __slots__ = ("xtx", "xty", "n", "weights")
+
+    def __init__(self) -> None:
+        self.xtx = [[0.0] * 3 for _ in range(3)]
+        self.xty = [0.0] * 3
+        self.n = 0.0
+        self.weights: Tuple[float, ...] = _PRIOR
+
+    def observe(self, x: Tuple[float, float, float], y: float) -> None:
+        for i in range(3):
+            self.xty[i] = self.xty[i] * _DECAY + x[i] * y
+            for j in range(3):
+                self.xtx[i][j] = self.xtx[i][j] * _DECAY + x[i] * x[j]
+        self.n = self.n * _DECAY + 1.0
+        a = [[self.xtx[i][j] + (_RIDGE if i == j else 0.0) for j in range(3)] for i in range(3)]
+        b = [self.xty[i] + _RIDGE * _PRIOR[i] for i in range(3)]
+        solved = _solve3(a, b)
+        if solved is not None:
+            self.weights = tuple(solved)
+
+
+class CostModel:
+    """按 (后端, 模型) 分别拟合的执行耗时模型（线程安全）。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._fits: Dict[str, _Fit] = {}
+
+    @staticmethod
+    def key(backend: str, features: Dict[str, Any]) -> str:
+        return f"{backend}|{features.get('model') or ''}"
+
+    def observe(self, key: str, features: Dict[str, Any], seconds: float) -> None:
+        if seconds is None or seconds <= 0:
+            return
+        with self._lock:
+            fit = self._fits.get(key)
+            if fit is None:
+                fit = self._fits[key] = _Fit()
+            fit.observe(_vector(features), float(seconds))
+
+    def predict(self, key: str, features: Dict[str, Any]) -> Tuple[float, bool]:
+        """返回 (预计执行秒数, 是否可信)。"""
+        with self._lock:
+            fit = self._fits.get(key)
+            weights = fit.weights if fit is not None else _PRIOR
+            confident = fit is not None and fit.n >= _CONFIDENT_SAMPLES
+        seconds = sum(w * v for w, v in zip(weights, _vector(features)))
+        # 外推到样本范围之外时线性模型可能给出负值
+        return max(seconds, 0.05), confident
+
+    def load(self, samples: Iterable[Tuple[str, Dict[str, Any], float]]) -> int:
+        """批量导入历史样本 (key, features, seconds)（按时间从旧到新），返回导入条数。"""
+        count = 0
+        for key, features, seconds in samples:
+            self.observe(key, features, seconds)
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                key: {"samples": round(fit.n, 1), "weights": [round(w, 4) for w in fit.weights]}
+                for key, fit in self._fits.items()
+            }
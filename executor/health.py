@@ -0,0 +1,199 @@
+"""
+ComfyUI 后端健康监控与熔断器。
+
+ComfyUI 宕机时，如果每个请求都各自连接 /prompt 直到超时，故障期间每个请求都要白等 timeout_s。
+
+- HealthMonitor：后台线程定期探测 /system_stats，缓存后端状态，供 /health 直接返回（不阻塞请求）
+- CircuitBreaker：连续失败达到阈值（或后台探测失败）后进入 open 状态，此时请求立即失败（BackendUnavailableError）；
+  冷却期过后进入 half-open，由一个请求先做一次轻量探测，成功才恢复放行，失败则加倍冷却时间
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# probe() 返回 (是否健康, 说明)
+Probe = Callable[[], Tuple[bool, str]]
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendUnavailableError(RuntimeError):
+    """ComfyUI 后端不可用（熔断中），请求被立即拒绝；retry_after_s 为建议的重试等待时间。"""
+
+    def __init__(self, message: str, retry_after_s: float = 0.0):
+        super().__init__(message)
+        self.retry_after_s = max(0.0, float(retry_after_s))
+
+
+class CircuitBreaker:
+    """线程安全的熔断器（closed → open → half-open → closed）。"""
+
+    def __init__(
+        self,
+        probe: Optional[Probe] = None,
+        failure_threshold: int = 3,
+        reset_timeout_s: float = 5.0,
+        max_reset_timeout_s: float = 60.0,
+    ):
+        self._probe = probe
+        self._threshold = max(1, int(failure_threshold))
+        self._base_reset = max(0.0, float(reset_timeout_s))
+        self._max_reset = max(self._base_reset, float(max_reset_timeout_s))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._reset_timeout = self._base_reset
+        self._open_until = 0.0
+        self._last_error = ""
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    @property
+    def last_error(self) -> str:
+        with self._lock:
+            return self._last_error
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self._open_until - time.monotonic()) if self._state != CLOSED else 0.0
+
+    def _open_locked(self, message: str, backoff: bool) -> None:
+        if backoff and self._state != CLOSED:
+            self._reset_timeout = min(self._max_reset, max(self._base_reset, self._reset_timeout * 2))
+        elif self._state == CLOSED:
+            self._reset_timeout = self._base_reset
+        self._state = OPEN
+        self._open_until = time.monotonic() + self._reset_timeout
+        self._last_error = message
+
+    def _rejection(self) -> BackendUnavailableError:
+        retry = max(0.0, self._open_until - time.monotonic())
+        return BackendUnavailableError(
+            f"ComfyUI 当前不可用，已暂停提交（约 {retry:.0f} 秒后重试）：{self._last_error}", retry_after_s=retry
+        )
+
+    def before_request(self) -> None:
+        """请求前调用：熔断中立即抛出 BackendUnavailableError；冷却期满时先探测一次再放行。"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN or time.monotonic() < self._open_until:
+                # half-open 期间只允许一个探测，其余请求继续快速失败
+                raise self._rejection()
+            self._state = HALF_OPEN
+
+        try:
+            ok, message = self._probe() if self._probe is not None else (True, "")
+        except Exception as e:
+            # 探测本身出错也按失败处理，否则会一直停在 half-open、拒绝所有请求
+            ok, message = False, f"健康探测出错: {e}"
+        with self._lock:
+            if ok:
+                self._close_locked()
+                return
+            self._open_locked(message, backoff=True)
+            raise self._rejection()
+
+    def _close_locked(self) -> None:
+        self._state = CLOSED
+        self._failures = 0
+        self._reset_timeout = self._base_reset
+        self._last_error = ""
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._close_locked()
+
+    def record_failure(self, message: str) -> None:
+        """记录一次连接层面的失败（拒绝连接 / 超时）；达到阈值时熔断。"""
+        with self._lock:
+            self._failures += 1
+            self._last_error = message
+            if self._state == HALF_OPEN or self._failures >= self._threshold:
+                self._open_locked(message, backoff=self._state == HALF_OPEN)
+
+    def trip(self, message: str) -> None:
+        """后台探测发现后端不可用：直接熔断（已熔断时不延长冷却）。"""
+        with self._lock:
+            if self._state == CLOSED:
+                self._open_locked(message, backoff=False)
+            else:
+                self._last_error = message
+
+
+class HealthMonitor:
+    """后台定期探测后端并缓存结果；探测结果同步给熔断器。
+
+    interval_s <= 0 时不启动后台线程，status() 只反映熔断器与最近一次按需探测的结果。
+    """
+
+    def __init__(self, probe: Probe, breaker: CircuitBreaker, interval_s: float = 10.0):
+        self._probe = probe
+        self.breaker = breaker
+        self._interval = float(interval_s)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._healthy: Optional[bool] = None
+        self._message = "尚未探测"
+        self._checked_at: Optional[float] = None
+        self._latency_ms: Optional[float] = None
+
+    def ensure_started(self) -> None:
+        if self._interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="anima-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def probe(self) -> Tuple[bool, str]:
+        """立即探测一次，更新缓存并返回 (是否健康, 说明)。"""
+        start = time.perf_counter()
+        ok, message = self._probe()
+        with self._lock:
+            self._healthy = ok
+            self._message = message
+            self._checked_at = time.time()
+            self._latency_ms = round((time.perf_counter() - start) * 1000.0, 1)
+        return ok, message
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            ok, message = self.probe()
+            if ok:
+                self.breaker.record_success()
+            else:
+                self.breaker.trip(message)
+            # 不健康时探测得更勤，以便尽快恢复放行
+            wait = self._interval if ok else min(self._interval, max(1.0, self.breaker.retry_after()))
+            self._stop.wait(wait)
+
+    def status(self) -> Dict[str, Any]:
+        """返回缓存的后端状态（不发起网络请求）。"""
+        with self._lock:
+            status: Dict[str, Any] = {
+                "healthy": self._healthy,
+                "message": self._message,
+                "checked_at": self._checked_at,
+                "latency_ms": self._latency_ms,
+            }
+        state = self.breaker.state
+        status["breaker"] = state
+        if state != CLOSED:
+            status["healthy"] = False
+            status["message"] = self.breaker.last_error or status["message"]
+            status["retry_after_s"] = round(self.breaker.retry_after(), 1)
+        return status
@@ -2,17 +2,34 @@
 生成历史管理器。
 
 - 内存：deque(maxlen=N) 保持最近 N 条
-- 文件：JSONL 追加写入，启动时加载最近 N 条到内存
+- 文件：JSONL 追加写入，启动时从文件末尾倒读最近 N 条到内存（与历史总量无关）
+- 索引：history.jsonl.idx 记录 id → 字节偏移，按 id 查旧记录只需一次 seek
+- 写入：后台线程批量追加（group commit），add() 分配 id 后立即返回
+- 分段：活动段超过大小或跨日时封存为 history.<first>-<last>.jsonl，可选压缩（段内字符串 / 参数表）；
+  读取透明地跨越所有分段
+- 检索：tag / 画师 / 角色倒排索引（首次 search() 时构建，之后随 add() 增量维护）
+- 多进程：写入在文件锁内进行，id 由共享的 seq 文件分配；其他进程追加的记录在查询时增量并入内存窗口
 """
 from __future__ import annotations
 
+import atexit
 import json
+import os
+import re
+import struct
+import sys
 import threading
+import time
+from array import array
+from bisect import bisect_left
 from collections import deque
-from dataclasses import asdict, dataclass, fields
+from copy import deepcopy
+from dataclasses import asdict, dataclass, field, fields
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from .history_search import HistoryIndex, Query
 
 
 @dataclass
@@ -28,6 +45,8 @@ class GenerationRecord:
     seed: Optional[int] = None       # 实际使用的种子
     width: Optional[int] = None
     height: Optional[int] = None
+    images: List[Optional[str]] = field(default_factory=list)  # 本地图片路径（与结果 images 下标对应）
+    timings: Dict[str, Any] = field(default_factory=dict)      # 各阶段耗时（秒）与成本特征，供 ETA 模型学习
 
     # -- 序列化 --
 
@@ -52,10 +71,610 @@ class GenerationRecord:
         return f"#{self.id} [{self.timestamp[:19]}] {artist} | {count}, {tags} | seed:{self.seed} | {size}"
 
 
+def _iter_lines_reverse(path: Path, block_size: int = 65536) -> Iterator[Tuple[int, bytes]]:
+    """从文件末尾向前逐行读取，产出 (行起始偏移, 行内容)。"""
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            read = min(block_size, pos)
+            pos -= read
+            f.seek(pos)
+            chunk = f.read(read) + tail
+            lines = chunk.split(b"\n")
+            # 第一段可能是不完整的行，留到下一轮拼接
+            tail = lines.pop(0)
+            offset = pos + len(tail) + 1
+            starts = []
+            for line in lines:
+                starts.append((offset, line))
+                offset += len(line) + 1
+            for item in reversed(starts):
+                yield item
+        if tail:
+            yield 0, tail
+
+
+def _parse_record(line: bytes) -> Optional[GenerationRecord]:
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return GenerationRecord.from_dict(json.loads(line))
+    except Exception:
+        return None
+
+
+_ID_PREFIX = re.compile(rb'^\s*\{"id":\s*(\d+)[,}]')
+
+
+def _peek_id(line: bytes) -> Optional[int]:
+    """快速取出行中的 id（记录按 to_dict() 序列化，id 总在最前），必要时回退完整解析。"""
+    m = _ID_PREFIX.match(line)
+    if m:
+        return int(m.group(1))
+    rec = _parse_record(line)
+    return rec.id if rec is not None else None
+
+
+class _OffsetIndex:
+    """history.jsonl 的 sidecar 索引：定长 16 字节条目 (id, offset)，按追加顺序（即 id 递增）排列。
+
+    查找使用内存中按 id 排序的副本，每次只读入索引文件新追加的条目。
+    """
+
+    _ENTRY = struct.Struct("<QQ")
+
+    def __init__(self, history_file: Path):
+        self._history_file = history_file
+        self._index_file = history_file.with_name(history_file.name + ".idx")
+        self._lock = threading.Lock()
+        self._ready = False  # 本进程内已确认索引覆盖整个 history 文件
+        # 内存副本：_ids 升序、_offsets 与之对齐；_loaded 为已读入的文件条目数，_tail 为文件中第 _loaded 条
+        self._ids = array("Q")
+        self._offsets = array("Q")
+        self._loaded = 0
+        self._tail: Optional[Tuple[int, int]] = None
+
+    def _read_entry(self, f, i: int) -> Tuple[int, int]:
+        f.seek(i * self._ENTRY.size)
+        return self._ENTRY.unpack(f.read(self._ENTRY.size))
+
+    def _entry_count(self) -> int:
+        try:
+            return self._index_file.stat().st_size // self._ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def _scan(self, start: int, out) -> None:
+        """从 history 文件的 start 偏移扫描到末尾，把 (id, offset) 写入 out。"""
+        with self._history_file.open("rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                record_id = _peek_id(line) if line.endswith(b"\n") else None
+                if record_id is not None:
+                    out.write(self._ENTRY.pack(record_id, offset))
+                offset += len(line)
+
+    def _rebuild(self) -> None:
+        tmp = self._index_file.with_name(self._index_file.name + ".tmp")
+        with tmp.open("wb") as out:
+            self._scan(0, out)
+        os.replace(tmp, self._index_file)
+
+    def ensure(self) -> None:
+        """确认索引覆盖整个 history 文件（本进程内只检查一次）。"""
+        with self._lock:
+            if not self._ready:
+                self._sync_locked()
+
+    def sync(self) -> None:
+        """无条件与 history 文件对齐：缺失则重建，落后（例如其他进程追加过）则增量补齐。
+
+        多进程写入时须在文件锁内、追加之前调用，保证索引没有空洞。
+        """
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if not self._history_file.exists():
+            self._ready = True
+            return
+        n = self._entry_count()
+        if n == 0:
+            self._rebuild()
+            self._ready = True
+            return
+
+        # 校验最后一条索引，并从它之后补齐未索引的记录
+        with self._index_file.open("rb") as f:
+            last_id, last_off = self._read_entry(f, n - 1)
+        covered = None
+        with self._history_file.open("rb") as f:
+            f.seek(last_off)
+            line = f.readline()
+            if line.endswith(b"\n") and _peek_id(line) == last_id:
+                covered = last_off + len(line)
+        if covered is None:
+            self._rebuild()
+        elif covered < self._history_file.stat().st_size:
+            with self._index_file.open("ab") as out:
+                self._scan(covered, out)
+        self._ready = True
+
+    def append(self, entries: List[Tuple[int, int]]) -> None:
+        """记录一批追加 [(id, offset), ...]；索引尚未确认完整时跳过（之后 ensure() 会补齐）。"""
+        with self._lock:
+            if not self._ready or not entries:
+                return
+            with self._index_file.open("ab") as f:
+                f.write(b"".join(self._ENTRY.pack(i, off) for i, off in entries))
+
+    def id_range(self) -> Tuple[int, int]:
+        """索引中的最小 / 最大 id（多进程写入时 id 在文件中只是近似有序）。"""
+        with self._lock:
+            self._load_locked()
+            if not self._ids:
+                return 0, 0
+            return self._ids[0], self._ids[-1]
+
+    def last_id(self) -> int:
+        n = self._entry_count()
+        if n == 0:
+            return 0
+        with self._index_file.open("rb") as f:
+            return self._read_entry(f, n - 1)[0]
+
+    def reset(self) -> None:
+        """丢弃索引文件（所属 history 文件被整体重写后调用），下次 ensure() 时重建。"""
+        with self._lock:
+            self._index_file.unlink(missing_ok=True)
+            self._ready = False
+            self._clear_loaded()
+
+    def _clear_loaded(self) -> None:
+        self._ids = array("Q")
+        self._offsets = array("Q")
+        self._loaded = 0
+        self._tail = None
+
+    def _load_locked(self) -> None:
+        """把索引文件新追加的条目并入内存副本；文件被重建（末条已读条目对不上）时整体重新读入。"""
+        n = self._entry_count()
+        try:
+            with self._index_file.open("rb") as f:
+                if self._loaded and (n < self._loaded or self._read_entry(f, self._loaded - 1) != self._tail):
+                    self._clear_loaded()
+                if n == self._loaded:
+                    return
+                f.seek(self._loaded * self._ENTRY.size)
+                data = f.read((n - self._loaded) * self._ENTRY.size)
+        except FileNotFoundError:
+            self._clear_loaded()
+            return
+        data = data[: len(data) - len(data) % self._ENTRY.size]
+        ids, offsets = self._ids, self._offsets
+        for record_id, offset in self._ENTRY.iter_unpack(data):
+            if not ids or record_id > ids[-1]:
+                ids.append(record_id)
+                offsets.append(offset)
+            else:
+                # 多进程写入时 id 在文件中只在小范围内乱序：插入到排序位置
+                i = bisect_left(ids, record_id)
+                if i < len(ids) and ids[i] == record_id:
+                    offsets[i] = offset
+                else:
+                    ids.insert(i, record_id)
+                    offsets.insert(i, offset)
+            self._tail = (record_id, offset)
+            self._loaded += 1
+
+    def entries(self) -> List[Tuple[int, int]]:
+        """全部 (id, offset)，按 id 升序。"""
+        self.ensure()
+        with self._lock:
+            self._load_locked()
+            return list(zip(self._ids, self._offsets))
+
+    def lookup(self, record_id: int) -> Optional[int]:
+        """查找 id 对应的字节偏移（在内存副本中二分查找）。"""
+        self.ensure()
+        with self._lock:
+            self._load_locked()
+            i = bisect_left(self._ids, record_id)
+            if i < len(self._ids) and self._ids[i] == record_id:
+                return self._offsets[i]
+        return None
+
+
+_TABLE_KEY = "__table__"
+
+
+class _Segment:
+    """一个历史分段文件（活动段 history.jsonl，或已封存的 history.<first>-<last>.jsonl）。
+
+    封存段可被压缩：首行为字符串 / 参数表 {"__table__": {"strings": [...], "params": [...]}}，
+    之后每条记录的 positive_text / negative_text / params 存为表下标。
+    """
+
+    def __init__(self, path: Path, first_id: Optional[int] = None, last_id: Optional[int] = None):
+        self.path = path
+        self.first_id = first_id
+        self.last_id = last_id
+        self.index = _OffsetIndex(path)
+        self._table: Any = None
+        self._table_loaded = False
+
+    @property
+    def sealed(self) -> bool:
+        return self.first_id is not None
+
+    def table(self) -> Optional[Dict[str, List[Any]]]:
+        """读取压缩段的首行表（仅封存段可能被压缩，结果缓存）。"""
+        if not self.sealed:
+            return None
+        if not self._table_loaded:
+            self._table = None
+            try:
+                with self.path.open("rb") as f:
+                    first = f.readline()
+                if first.startswith(b'{"' + _TABLE_KEY.encode() + b'"'):
+                    self._table = json.loads(first)[_TABLE_KEY]
+            except Exception:
+                pass
+            self._table_loaded = True
+        return self._table
+
+    def invalidate(self) -> None:
+        self._table_loaded = False
+        self.index.reset()
+
+    def decode(self, line: bytes) -> Optional[GenerationRecord]:
+        table = self.table()
+        if table is None:
+            return _parse_record(line)
+        line = line.strip()
+        if not line or line.startswith(b'{"' + _TABLE_KEY.encode() + b'"'):
+            return None
+        try:
+            d = json.loads(line)
+            strings = table["strings"]
+            d["positive_text"] = strings[d["positive_text"]]
+            d["negative_text"] = strings[d["negative_text"]]
+            d["params"] = deepcopy(table["params"][d["params"]])
+            return GenerationRecord.from_dict(d)
+        except Exception:
+            return None
+
+    def iter_reverse(self) -> Iterator[GenerationRecord]:
+        if not self.path.exists():
+            return
+        for _offset, line in _iter_lines_reverse(self.path):
+            rec = self.decode(line)
+            if rec is not None:
+                yield rec
+
+    def iter_forward(self) -> Iterator[GenerationRecord]:
+        for _offset, rec in self.iter_with_offsets():
+            yield rec
+
+    def iter_with_offsets(self) -> Iterator[Tuple[int, GenerationRecord]]:
+        """顺序遍历 (字节偏移, 记录)"""
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            offset = 0
+            for line in f:
+                rec = self.decode(line)
+                if rec is not None:
+                    yield offset, rec
+                offset += len(line)
+
+    def read_at(self, offset: int, record_id: int) -> Optional[GenerationRecord]:
+        """读取 offset 处的记录；该处不是 record_id（分段被压缩 / 重写过）时返回 None。"""
+        try:
+            with self.path.open("rb") as f:
+                f.seek(offset)
+                rec = self.decode(f.readline())
+        except OSError:
+            return None
+        return rec if rec is not None and rec.id == record_id else None
+
+    def read(self, record_id: int) -> Optional[GenerationRecord]:
+        """经偏移索引读取一条记录。"""
+        if not self.path.exists():
+            return None
+        offset = self.index.lookup(record_id)
+        if offset is None:
+            return None
+        return self.read_at(offset, record_id)
+
+
+def _sealed_segment_name(history_file: Path, first_id: int, last_id: int) -> Path:
+    return history_file.with_name(f"{history_file.stem}.{first_id:08d}-{last_id:08d}{history_file.suffix}")
+
+
+def _discover_sealed_segments(history_file: Path) -> List[_Segment]:
+    """找出 history_file 的全部封存段，按 id 范围升序。"""
+    pattern = re.compile(re.escape(history_file.stem) + r"\.(\d+)-(\d+)" + re.escape(history_file.suffix) + "$")
+    segments = []
+    if history_file.parent.exists():
+        for p in history_file.parent.iterdir():
+            m = pattern.match(p.name)
+            if m:
+                segments.append(_Segment(p, int(m.group(1)), int(m.group(2))))
+    segments.sort(key=lambda seg: seg.first_id)
+    return segments
+
+
+def iter_history_records(history_file: Path) -> Iterator[GenerationRecord]:
+    """按 id 顺序遍历 history_file 的全部记录（依次跨越封存段与活动段）。"""
+    history_file = Path(history_file)
+    for seg in _discover_sealed_segments(history_file) + [_Segment(history_file)]:
+        yield from seg.iter_forward()
+
+
+def compact_segment_file(path: Path) -> bool:
+    """压缩一个封存段：重复的提示词文本与参数只在段首的表中存一份。已压缩时返回 False。"""
+    seg = _Segment(Path(path), 0, 0)
+    if seg.table() is not None:
+        return False
+
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+    params_list: List[Any] = []
+    params_ids: Dict[str, int] = {}
+
+    def _intern_string(text: str) -> int:
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text)
+        return string_ids[text]
+
+    def _intern_params(params: Any) -> int:
+        key = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        if key not in params_ids:
+            params_ids[key] = len(params_list)
+            params_list.append(params)
+        return params_ids[key]
+
+    rows = []
+    for rec in seg.iter_forward():
+        d = rec.to_dict()
+        d["positive_text"] = _intern_string(rec.positive_text)
+        d["negative_text"] = _intern_string(rec.negative_text)
+        d["params"] = _intern_params(rec.params)
+        rows.append(d)
+
+    tmp = seg.path.with_name(seg.path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write((json.dumps({_TABLE_KEY: {"strings": strings, "params": params_list}}, ensure_ascii=False) + "\n").encode("utf-8"))
+        for d in rows:
+            f.write((json.dumps(d, ensure_ascii=False) + "\n").encode("utf-8"))
+    os.replace(tmp, seg.path)
+    seg.index.reset()
+    return True
+
+
+_FSYNC_POLICIES = ("never", "batch", "always")
+
+
+class _GroupCommitWriter:
+    """后台批量写入线程。
+
+    - 按条数（max_batch）或时间（flush_interval_s）阈值把排队的记录一次写盘
+    - fsync 策略：never（交给 OS）/ batch（每批写完 fsync）/ always（每批 fsync，且 add() 等到落盘才返回）
+    - flush() 等待已提交的记录全部写完；close() 写完剩余记录后退出
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[GenerationRecord], bool], None],
+        flush_interval_s: float = 0.2,
+        max_batch: int = 64,
+        fsync: str = "never",
+    ):
+        if fsync not in _FSYNC_POLICIES:
+            raise ValueError(f"不支持的 fsync 策略：{fsync!r}，仅支持：{_FSYNC_POLICIES}")
+        self._write_batch = write_batch
+        self._interval = max(0.0, float(flush_interval_s))
+        self._max_batch = max(1, int(max_batch))
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        self._pending: List[GenerationRecord] = []
+        self._first_pending_at = 0.0
+        self._submitted = 0
+        self._written = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="animatool-history-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def synchronous(self) -> bool:
+        """fsync=always 时调用方需等待自己的记录落盘"""
+        return self._fsync == "always"
+
+    def submit(self, record: GenerationRecord) -> int:
+        """排队一条记录，返回其序号（供 wait() 使用）"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("history writer 已关闭")
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.append(record)
+            self._submitted += 1
+            if len(self._pending) >= self._max_batch or self.synchronous:
+                self._flush_requested = True
+            self._cond.notify_all()
+            return self._submitted
+
+    def wait(self, seq: int, timeout: Optional[float] = None) -> bool:
+        """等待序号 seq 及之前的记录写盘"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._written >= seq or not self._thread.is_alive(), timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前提交的记录全部写盘；返回是否在超时前完成。"""
+        with self._cond:
+            seq = self._submitted
+            if self._written >= seq:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= seq or not self._thread.is_alive(), timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending and self._closed:
+                    return
+                deadline = self._first_pending_at + self._interval
+                while not (self._closed or self._flush_requested or len(self._pending) >= self._max_batch):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self._max_batch], self._pending[self._max_batch:]
+                # 剩余的记录已经超时 / 被请求刷新，下一轮立即写
+                self._flush_requested = bool(self._pending)
+
+            try:
+                self._write_batch(batch, self._fsync != "never")
+            except Exception:
+                pass  # 写入失败不影响主流程
+
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+
+
+class _InterProcessLock:
+    """跨进程互斥（history.jsonl.lock 上的 flock / msvcrt 锁），同一进程内可重入。
+
+    平台不支持文件锁时退化为进程内锁。
+    """
+
+    def __init__(self, lock_file: Path):
+        self._lock_file = lock_file
+        self._local_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def _lock_fd(self, fd: int) -> None:
+        try:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return
+        except ImportError:
+            pass
+        try:
+            import msvcrt
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:
+                    continue  # LK_LOCK 约 10 秒后放弃，继续等待
+        except ImportError:
+            pass
+
+    def _unlock_fd(self, fd: int) -> None:
+        try:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return
+        except ImportError:
+            pass
+        try:
+            import msvcrt
+
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except ImportError:
+            pass
+
+    def __enter__(self) -> "_InterProcessLock":
+        self._local_lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._fd is None:
+                    self._lock_file.parent.mkdir(parents=True, exist_ok=True)
+                    self._fd = os.open(str(self._lock_file), os.O_RDWR | os.O_CREAT, 0o644)
+                self._lock_fd(self._fd)
+            except OSError:
+                pass  # 文件锁不可用时仅保证进程内互斥
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            try:
+                self._unlock_fd(self._fd)
+            except OSError:
+                pass
+        self._local_lock.release()
+
+
+class _IdAllocator:
+    """跨进程共享的 id 分配器：history.jsonl.seq 保存最后分配的 id，在 seq 文件自身的锁内读取并递增。
+
+    不使用 history.jsonl.lock：写入线程在整批写盘 / fsync / 轮转期间持有它，add() 不应因此等待磁盘 I/O。
+    """
+
+    def __init__(self, seq_file: Path):
+        self._seq_file = seq_file
+        self._lock = _InterProcessLock(seq_file)
+        self._fd: Optional[int] = None
+
+    def allocate(self, floor: Callable[[], int]) -> Optional[int]:
+        """分配下一个 id；seq 文件为空（首次使用）时以 floor()（已知的最大 id）为起点。读写失败返回 None。"""
+        with self._lock:
+            try:
+                if self._fd is None:
+                    self._seq_file.parent.mkdir(parents=True, exist_ok=True)
+                    self._fd = os.open(str(self._seq_file), os.O_RDWR | os.O_CREAT, 0o644)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                raw = os.read(self._fd, 32).strip()
+                last = int(raw) if raw else floor()
+                # 定长写入原地覆盖，无需 truncate / rename
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, b"%020d" % (last + 1))
+                return last + 1
+            except (OSError, ValueError):
+                return None
+
+
 class HistoryManager:
     """线程安全的生成历史管理器（内存 + JSONL 持久化）"""
 
-    def __init__(self, history_file: Optional[Path] = None, maxlen: int = 50):
+    def __init__(
+        self,
+        history_file: Optional[Path] = None,
+        maxlen: int = 50,
+        flush_interval_s: float = 0.2,
+        max_batch: int = 64,
+        fsync: str = "never",
+        segment_max_bytes: int = 0,
+        segment_period: str = "",
+        compact_on_rotate: bool = False,
+    ):
         self._maxlen = maxlen
         self._lock = threading.Lock()
         self._records: deque[GenerationRecord] = deque(maxlen=maxlen)
@@ -65,47 +684,299 @@ class HistoryManager:
             history_file = Path(__file__).resolve().parent.parent / "outputs" / "history.jsonl"
         self._history_file = history_file
 
+        # 分段：活动段 + 已封存段（按 id 升序）
+        self._segment_max_bytes = max(0, int(segment_max_bytes))
+        self._segment_period = (segment_period or "").strip().lower()
+        if self._segment_period not in ("", "daily"):
+            raise ValueError(f"不支持的分段周期：{segment_period!r}，仅支持：daily")
+        self._compact_on_rotate = compact_on_rotate
+        self._segments_lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._active = _Segment(history_file)
+        self._sealed: List[_Segment] = _discover_sealed_segments(history_file)
+        self._active_date = self._read_active_date()
+
+        # 多进程：写入 / 轮转 / 压缩都在文件锁内进行，id 由共享的 seq 文件分配
+        self._ipc_lock = _InterProcessLock(history_file.with_name(history_file.name + ".lock"))
+        self._ids = _IdAllocator(history_file.with_name(history_file.name + ".seq"))
+        # 增量刷新：已读到的活动段 (st_dev, st_ino) 与字节位置
+        self._refresh_lock = threading.Lock()
+        self._scan_key: Optional[Tuple[int, int]] = None
+        self._scan_pos = 0
+        # 检索用倒排索引：首次 search() 时从磁盘构建一次，之后由 add() / 写入 / 刷新 / 轮转增量维护；
+        # _locations 记录每条已写盘记录所在的 (分段, 偏移)，命中窗口外的记录时直接读取
+        self._search_index: Optional[HistoryIndex] = None
+        self._search_index_lock = threading.Lock()
+        self._locations: Dict[int, Tuple[_Segment, int]] = {}
+        self._locations_lock = threading.Lock()
+        self._indexed_segments: Set[Path] = set()
+
         self._load_from_file()
 
+        self._writer = _GroupCommitWriter(self._write_batch, flush_interval_s, max_batch, fsync)
+        atexit.register(self.close)
+
     # -- 持久化 --
 
+    def _read_active_date(self) -> Optional[str]:
+        """活动段首条记录的日期（用于按日分段）"""
+        try:
+            with self._active.path.open("rb") as f:
+                rec = _parse_record(f.readline())
+            return rec.timestamp[:10] if rec is not None else None
+        except OSError:
+            return None
+
+    def _active_stat(self) -> Tuple[Optional[Tuple[int, int]], int]:
+        try:
+            st = self._active.path.stat()
+        except OSError:
+            return None, 0
+        return (st.st_dev, st.st_ino), st.st_size
+
+    def _read_window(self) -> List[GenerationRecord]:
+        """从末尾倒读最近 maxlen 条（活动段不足时继续读封存段），按 id 升序返回"""
+        with self._segments_lock:
+            segments = [self._active] + list(reversed(self._sealed))
+        tail: List[GenerationRecord] = []
+        for seg in segments:
+            for rec in seg.iter_reverse():
+                tail.append(rec)
+                if len(tail) >= self._maxlen:
+                    break
+            if len(tail) >= self._maxlen:
+                break
+        tail.sort(key=lambda r: r.id)
+        return tail
+
     def _load_from_file(self) -> None:
-        """启动时从 JSONL 文件加载历史"""
-        if not self._history_file.exists():
-            return
+        """启动时从末尾倒读最近 maxlen 条（O(maxlen)，与历史总量无关；活动段不足时继续读封存段）"""
         try:
-            lines = self._history_file.read_text(encoding="utf-8").strip().splitlines()
-            all_records: List[GenerationRecord] = []
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    all_records.append(GenerationRecord.from_dict(json.loads(line)))
-                except Exception:
-                    continue
-
-            for r in all_records[-self._maxlen :]:
-                self._records.append(r)
-
-            # 扫描所有记录以确保 next_id 是全局最大的
-            max_id = 0
-            for r in all_records:
-                if r.id > max_id:
-                    max_id = r.id
-            
+            # 先记下位置再读：之后追加的记录由 refresh() 增量并入（重复的按 id 去重）
+            self._scan_key, self._scan_pos = self._active_stat()
+            tail = self._read_window()
+            self._records.extend(tail)
+
+            # id 随追加递增：取窗口、索引与封存段中的最大值即可
+            max_id = max((r.id for r in tail), default=0)
+            if self._sealed:
+                max_id = max(max_id, self._sealed[-1].last_id)
+            try:
+                max_id = max(max_id, self._active.index.last_id())
+            except Exception:
+                pass
             self._next_id = max_id + 1
         except Exception:
             pass  # 文件损坏时静默跳过
 
-    def _append_to_file(self, record: GenerationRecord) -> None:
-        """追加一条记录到 JSONL 文件"""
+    def _should_rotate(self, records: List[GenerationRecord]) -> bool:
+        if not self._active.path.exists():
+            return False
+        if self._segment_max_bytes and self._active.path.stat().st_size >= self._segment_max_bytes:
+            return True
+        if self._segment_period == "daily" and self._active_date and records[0].timestamp[:10] != self._active_date:
+            return True
+        return False
+
+    def _refresh_segments_locked(self) -> None:
+        """重新发现封存段（其他进程可能轮转过），保留已知分段对象上的缓存（调用方持有 _segments_lock）"""
+        known = {seg.path: seg for seg in self._sealed}
+        self._sealed = [known.get(seg.path, seg) for seg in _discover_sealed_segments(self._history_file)]
+
+    def _disk_max_id(self) -> int:
+        """磁盘上已知的最大 id（seq 文件缺失时作为分配起点；调用方持有文件锁）"""
+        max_id = self._next_id - 1
         try:
-            self._history_file.parent.mkdir(parents=True, exist_ok=True)
-            with self._history_file.open("a", encoding="utf-8") as f:
-                f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+            self._active.index.sync()
+            max_id = max(max_id, self._active.index.id_range()[1])
+            with self._segments_lock:
+                self._refresh_segments_locked()
+                if self._sealed:
+                    max_id = max(max_id, max(seg.last_id for seg in self._sealed))
         except Exception:
-            pass  # 写入失败不影响主流程
+            pass
+        return max_id
+
+    def _floor_id(self) -> int:
+        """seq 文件为空（首次使用）时的分配起点：仅此时才需要等待写入方释放文件锁"""
+        with self._ipc_lock:
+            return self._disk_max_id()
+
+    def _rotate_locked(self) -> Optional[_Segment]:
+        """把活动段封存为 history.<first>-<last>.jsonl（调用方持有 _write_lock 与文件锁）"""
+        active = self._active
+        if not active.path.exists():
+            return None
+        active.index.sync()
+        first_id, last_id = active.index.id_range()
+        if not last_id:
+            return None
+
+        sealed_path = _sealed_segment_name(self._history_file, first_id, last_id)
+        with self._segments_lock:
+            os.replace(active.path, sealed_path)
+            if active.index._index_file.exists():
+                os.replace(active.index._index_file, sealed_path.with_name(sealed_path.name + ".idx"))
+            sealed = _Segment(sealed_path, first_id, last_id)
+            self._sealed.append(sealed)
+            self._refresh_segments_locked()
+            self._active = _Segment(self._history_file)
+            self._active.index.ensure()
+            self._active_date = None
+
+        # 检索索引：原活动段的记录改指向封存段（其他进程写入、本进程尚未刷新到的记录一并补进索引）
+        self._index_segment(sealed)
+        if self._compact_on_rotate:
+            self._compact_segment(sealed)
+        return sealed
+
+    def _compact_segment(self, seg: _Segment) -> bool:
+        try:
+            with self._ipc_lock, self._segments_lock:
+                changed = compact_segment_file(seg.path)
+                if changed:
+                    seg.invalidate()
+            if changed:
+                self._index_segment(seg)  # 压缩后偏移全部改变
+            return changed
+        except Exception:
+            return False
+
+    def _write_batch(self, records: List[GenerationRecord], fsync: bool) -> None:
+        """把一批记录一次追加到活动段，并更新偏移索引（在后台写入线程中执行，持有文件锁）"""
+        with self._write_lock, self._ipc_lock:
+            if self._segment_period == "daily":
+                # 活动段可能已被其他进程轮转或写入
+                self._active_date = self._read_active_date()
+            if self._should_rotate(records):
+                self._rotate_locked()
+            active = self._active
+            active.path.parent.mkdir(parents=True, exist_ok=True)
+            # 其他进程追加的记录先补进索引，保证索引与文件一致
+            active.index.sync()
+            chunks = [(json.dumps(r.to_dict(), ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+            entries: List[Tuple[int, int]] = []
+            with active.path.open("ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                for r, data in zip(records, chunks):
+                    entries.append((r.id, offset))
+                    offset += len(data)
+                f.write(b"".join(chunks))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            active.index.append(entries)
+            if self._search_index is not None:
+                with self._locations_lock:
+                    self._locations.update((record_id, (active, offset)) for record_id, offset in entries)
+            if self._active_date is None:
+                self._active_date = records[0].timestamp[:10]
+
+    def rotate(self) -> Optional[Path]:
+        """立即封存当前活动段，返回封存后的文件路径（活动段为空时返回 None）"""
+        self.flush()
+        with self._write_lock, self._ipc_lock:
+            sealed = self._rotate_locked()
+        return sealed.path if sealed is not None else None
+
+    def compact(self) -> int:
+        """压缩所有尚未压缩的封存段，返回本次压缩的段数"""
+        with self._segments_lock:
+            segments = list(self._sealed)
+        return sum(1 for seg in segments if self._compact_segment(seg))
+
+    def iter_records(self) -> Iterator[GenerationRecord]:
+        """按 id 顺序遍历全部历史记录（跨越所有分段）"""
+        self.flush()
+        with self._segments_lock:
+            self._refresh_segments_locked()
+            segments = list(self._sealed) + [self._active]
+        for seg in segments:
+            yield from seg.iter_forward()
+
+    def refresh(self) -> int:
+        """把其他进程（或同一文件上的其他实例）追加的记录并入内存窗口，返回新并入的条数。
+
+        活动段没有变化时只需一次 stat；有新内容时只读新增部分；活动段被轮转时重新倒读窗口。
+        get() / list_recent() 会自动调用。
+        """
+        with self._refresh_lock:
+            key, size = self._active_stat()
+            if key == self._scan_key and size == self._scan_pos:
+                return 0
+            try:
+                if key != self._scan_key or size < self._scan_pos:
+                    with self._segments_lock:
+                        self._refresh_segments_locked()
+                        segments = list(self._sealed) + [self._active]
+                    new = self._read_window()
+                    self._scan_pos = size
+                    # 只重读了窗口：轮转前其他进程写入的记录在尚未索引的封存段与新的活动段中，逐段补进检索索引
+                    if self._search_index is not None:
+                        for seg in segments:
+                            if not seg.sealed or seg.path not in self._indexed_segments:
+                                self._index_segment(seg)
+                    located = None
+                else:
+                    active = self._active
+                    located, consumed = self._read_appended(self._scan_pos, size)
+                    self._scan_pos += consumed
+                    new = [rec for _offset, rec in located]
+                    located = [(active, offset) for offset, _rec in located]
+                self._scan_key = key
+            except Exception:
+                return 0
+        return self._merge(new, located)
+
+    def _read_appended(self, start: int, end: int) -> Tuple[List[Tuple[int, GenerationRecord]], int]:
+        """读取活动段 [start, end) 中完整的行，返回 ([(偏移, 记录)], 消耗的字节数)；末尾未写完的行留到下次"""
+        with self._active.path.open("rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        consumed = data.rfind(b"\n") + 1
+        records = []
+        offset = start
+        for line in data[:consumed].split(b"\n"):
+            rec = _parse_record(line)
+            if rec is not None:
+                records.append((offset, rec))
+            offset += len(line) + 1
+        return records, consumed
+
+    def _merge(
+        self,
+        new: List[GenerationRecord],
+        located: Optional[List[Tuple[_Segment, int]]] = None,
+    ) -> int:
+        """把其他进程写入的记录并入内存窗口与检索索引；located 与 new 对齐，给出各条所在的 (分段, 偏移)"""
+        index = self._search_index
+        if index is not None and new:
+            for rec in new:
+                index.add_record(rec)
+            if located is not None:
+                with self._locations_lock:
+                    self._locations.update((rec.id, loc) for rec, loc in zip(new, located))
+        with self._lock:
+            by_id = {r.id: r for r in self._records}
+            added = 0
+            for rec in new:
+                if rec.id not in by_id:
+                    by_id[rec.id] = rec
+                    added += 1
+            if added:
+                items = sorted(by_id.values(), key=lambda r: r.id)[-self._maxlen:]
+                self._records.clear()
+                self._records.extend(items)
+                self._next_id = max(self._next_id, items[-1].id + 1)
+            return added
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待排队中的记录全部写盘"""
+        return self._writer.flush(timeout)
+
+    def close(self) -> None:
+        """写完排队中的记录并停止后台写入线程（进程退出时自动调用）"""
+        self._writer.close()
 
     # -- 公开 API --
 
@@ -118,11 +989,16 @@ class HistoryManager:
         seed: Optional[int] = None,
         width: Optional[int] = None,
         height: Optional[int] = None,
+        images: Optional[List[Optional[str]]] = None,
+        timings: Optional[Dict[str, Any]] = None,
     ) -> GenerationRecord:
-        """记录一次生成"""
+        """记录一次生成（id 经共享的 seq 文件分配，多个进程写同一历史文件时也不重复）"""
         with self._lock:
+            record_id = self._ids.allocate(self._floor_id)
+            if record_id is None:
+                record_id = self._next_id
             record = GenerationRecord(
-                id=self._next_id,
+                id=record_id,
                 timestamp=datetime.now().isoformat(),
                 params=params,
                 positive_text=positive_text,
@@ -131,11 +1007,19 @@ class HistoryManager:
                 seed=seed,
                 width=width,
                 height=height,
+                images=list(images or []),
+                timings=dict(timings or {}),
             )
-            self._next_id += 1
+            self._next_id = max(self._next_id, record_id) + 1
             self._records.append(record)
-            self._append_to_file(record)
-            return record
+            seq = self._writer.submit(record)
+        index = self._search_index
+        if index is not None:
+            index.add_record(record)
+        if self._writer.synchronous:
+            # 在锁外等待，便于并发的 add() 合并到同一批 fsync
+            self._writer.wait(seq)
+        return record
 
     def get(self, source: str) -> Optional[GenerationRecord]:
         """
@@ -144,6 +1028,7 @@ class HistoryManager:
         - 数字 / "#数字"：按 ID 查找
         """
         target_id = None
+        self.refresh()
         with self._lock:
             if not self._records:
                 return None
@@ -162,35 +1047,165 @@ class HistoryManager:
                 if r.id == target_id:
                     return r
 
-        # 内存找不到，尝试回退到文件搜索 (在锁外进行，避免长时间持有锁)
+        # 内存找不到，经偏移索引回退到文件 (在锁外进行，避免长时间持有锁)
         if target_id is not None:
             return self._search_in_file(target_id)
             
         return None
 
     def _search_in_file(self, target_id: int) -> Optional[GenerationRecord]:
-        """在历史文件中搜索指定 ID 的记录"""
-        if not self._history_file.exists():
-            return None
+        """在历史分段中查找指定 ID 的记录：按 id 范围定位分段后走偏移索引，索引不可用时全文件扫描"""
+        self._writer.flush()
+        for attempt in range(2):
+            if attempt:
+                # 未找到：可能由其他进程写入 / 轮转，补齐活动段索引并重新发现封存段后再试一次
+                with self._ipc_lock, self._segments_lock:
+                    self._active.index.sync()
+                    self._refresh_segments_locked()
+            with self._segments_lock:
+                candidates = [self._active] + [
+                    seg for seg in reversed(self._sealed) if seg.first_id <= target_id <= seg.last_id
+                ]
+                for seg in candidates:
+                    try:
+                        rec = seg.read(target_id)
+                    except Exception:
+                        rec = self._scan_segment(seg, target_id)
+                    if rec is not None:
+                        return rec
+        return None
+
+    def _scan_segment(self, seg: _Segment, target_id: int) -> Optional[GenerationRecord]:
+        """全段倒序扫描（索引损坏时的兜底）"""
         try:
-            lines = self._history_file.read_text(encoding="utf-8").strip().splitlines()
-            for line in reversed(lines):  # 从新到旧搜索
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    if data.get("id") == target_id:
-                        return GenerationRecord.from_dict(data)
-                except Exception:
-                    continue
+            for rec in seg.iter_reverse():
+                if rec.id == target_id:
+                    return rec
         except Exception:
             pass
         return None
 
+    def _index_segment(self, seg: _Segment) -> None:
+        """登记一个分段中每条记录的 (分段, 偏移)；检索索引中还没有的记录顺序读入并索引"""
+        index = self._search_index
+        if index is None or not seg.path.exists():
+            return
+        try:
+            entries = seg.index.entries()
+            if any(record_id not in index for record_id, _offset in entries):
+                entries = []
+                for offset, rec in seg.iter_with_offsets():
+                    index.add_record(rec)
+                    entries.append((rec.id, offset))
+        except Exception:
+            return
+        with self._locations_lock:
+            self._locations.update((record_id, (seg, offset)) for record_id, offset in entries)
+            if seg.sealed:
+                self._indexed_segments.add(seg.path)
+
+    def _ensure_search_index(self) -> HistoryIndex:
+        """首次调用时从磁盘构建检索索引（之后由 add() / 写入 / 刷新 / 轮转增量维护，不再重建）"""
+        with self._search_index_lock:
+            index = self._search_index
+            if index is None:
+                # 先发布再读盘：此后的 add() 与写入线程都会更新它，flush() 之前排队的记录已在磁盘上
+                index = self._search_index = HistoryIndex()
+                try:
+                    self.flush()
+                    with self._segments_lock:
+                        self._refresh_segments_locked()
+                        segments = list(self._sealed) + [self._active]
+                    for seg in segments:
+                        self._index_segment(seg)
+                except BaseException:
+                    self._search_index = None
+                    raise
+            return index
+
+    def _load_located(self, record_id: int) -> Optional[GenerationRecord]:
+        """按登记的 (分段, 偏移) 直接读取；没有登记或已失效（被其他进程轮转 / 压缩）时回退到按 id 查找"""
+        with self._locations_lock:
+            loc = self._locations.get(record_id)
+        if loc is not None:
+            rec = loc[0].read_at(loc[1], record_id)
+            if rec is not None:
+                return rec
+        return self._search_in_file(record_id)
+
+    def search(
+        self,
+        query: Query = "",
+        *,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[GenerationRecord]:
+        """按 tag / 画师 / 角色检索历史（从新到旧）。
+
+        query："@fkey, rain | snow" 表示 @fkey AND (rain OR snow)；也可传 [["@fkey"], ["rain", "snow"]]。
+        width / height 精确匹配；since / until 为 ISO 日期或时间前缀，两端都包含。
+        """
+        self.refresh()
+        ids = self._ensure_search_index().search(
+            query, width=width, height=height, since=since, until=until, limit=limit
+        )
+        with self._lock:
+            window = {r.id: r for r in self._records}
+        records = []
+        for record_id in ids:
+            rec = window.get(record_id) or self._load_located(record_id)
+            if rec is not None:
+                records.append(rec)
+        return records
+
     def list_recent(self, limit: int = 5) -> List[GenerationRecord]:
         """返回最近 N 条记录（从新到旧）"""
+        self.refresh()
         with self._lock:
             items = list(self._records)
             items.reverse()
             return items[:max(1, limit)]
+
+
+# 仅 JSONL 后端适用的选项及其默认值：SQLite 后端收到非默认值时提示
+_JSONL_ONLY_OPTIONS = {
+    "flush_interval_s": 0.2,
+    "max_batch": 64,
+    "segment_max_bytes": 0,
+    "segment_period": "",
+    "compact_on_rotate": False,
+}
+
+
+def create_history_manager(
+    backend: str = "jsonl",
+    maxlen: int = 50,
+    history_dir: Optional[Path] = None,
+    **jsonl_options: Any,
+):
+    """按配置创建历史管理器（history_dir 默认为 outputs/）。
+
+    - "jsonl"（默认）：HistoryManager，<history_dir>/history.jsonl（后台批量写入、可分段）；
+      jsonl_options 透传给 HistoryManager
+    - "sqlite"：SQLiteHistoryManager，<history_dir>/history.sqlite3；
+      首次创建时自动从同目录已有的 JSONL 历史（含封存段）迁移。jsonl_options 中只有 fsync 适用，
+      批量写入 / 分段 / 压缩选项设置了非默认值时给出提示
+    """
+    backend = (backend or "jsonl").strip().lower()
+    history_dir = Path(history_dir) if history_dir else Path(__file__).resolve().parent.parent / "outputs"
+    if backend == "jsonl":
+        return HistoryManager(history_dir / "history.jsonl", maxlen=maxlen, **jsonl_options)
+    if backend == "sqlite":
+        from .history_sqlite import SQLiteHistoryManager, migrate_jsonl_to_sqlite
+
+        ignored = [k for k, default in _JSONL_ONLY_OPTIONS.items() if jsonl_options.get(k, default) != default]
+        if ignored:
+            print(f"[ComfyUI-AnimaTool] SQLite history backend ignores JSONL-only options: {', '.join(ignored)}", file=sys.stderr)
+        db_file = history_dir / "history.sqlite3"
+        if not db_file.exists():
+            migrate_jsonl_to_sqlite(history_dir / "history.jsonl", db_file)
+        return SQLiteHistoryManager(db_file, maxlen=maxlen, fsync=jsonl_options.get("fsync", "never"))
+    raise ValueError(f"不支持的 history backend：{backend!r}，仅支持：jsonl / sqlite")
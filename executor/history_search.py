@@ -0,0 +1,175 @@
+"""
+历史记录检索：tag / 画师 / 角色的倒排索引。
+
+- 词项来自记录参数中的 tags、artist、character（逗号分隔，小写、下划线视为空格、去掉权重括号）
+- 查询为「逗号分隔的 AND，组内 | 分隔的 OR」，例如 "@fkey, rain | snow"
+- 倒排表为按 id 升序的列表：从最新的记录开始合并遍历，凑够 limit 即停止
+- 可附加尺寸（width / height）与日期（since / until，ISO 前缀比较）过滤
+"""
+from __future__ import annotations
+
+import bisect
+import heapq
+import re
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# 参与索引的参数字段
+INDEXED_FIELDS = ("tags", "artist", "character")
+
+_WEIGHT_SUFFIX = re.compile(r":\s*[\d.]+$")
+_SPACES = re.compile(r"\s+")
+
+Query = Union[str, Sequence[Sequence[str]]]
+
+
+def normalize_term(term: str) -> str:
+    """规范化单个词项：小写、下划线视为空格、去掉 (tag:1.2) 形式的括号与权重。"""
+    t = str(term).strip().lower().replace("_", " ")
+    t = t.strip("()[]{}").strip()
+    t = _WEIGHT_SUFFIX.sub("", t).strip()
+    return _SPACES.sub(" ", t)
+
+
+def extract_terms(params: Dict[str, Any]) -> List[str]:
+    """从生成参数中提取去重后的索引词项。"""
+    terms = []
+    seen = set()
+    for field_name in INDEXED_FIELDS:
+        value = params.get(field_name)
+        if not value:
+            continue
+        for part in str(value).split(","):
+            t = normalize_term(part)
+            if t and t not in seen:
+                seen.add(t)
+                terms.append(t)
+    return terms
+
+
+def parse_query(query: Query) -> List[List[str]]:
+    """把查询解析为 AND-of-OR 的词项组：[[a], [b, c]] 表示 a AND (b OR c)。"""
+    if isinstance(query, str):
+        groups = [part.split("|") for part in query.split(",")]
+    else:
+        groups = [list(group) for group in (query or [])]
+    parsed = []
+    for group in groups:
+        terms = [t for t in (normalize_term(x) for x in group) if t]
+        if terms:
+            parsed.append(terms)
+    return parsed
+
+
+def _contains(postings: List[int], record_id: int) -> bool:
+    i = bisect.bisect_left(postings, record_id)
+    return i < len(postings) and postings[i] == record_id
+
+
+def _iter_desc(lists: Iterable[List[int]]) -> Iterator[int]:
+    """按 id 从大到小合并多个升序列表（去重）"""
+    last = None
+    for neg_id in heapq.merge(*[(-x for x in reversed(lst)) for lst in lists]):
+        if neg_id != last:
+            last = neg_id
+            yield -neg_id
+
+
+class HistoryIndex:
+    """线程安全的历史倒排索引（只存 id 与过滤所需的元数据，记录本身由调用方按 id 读取）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._postings: Dict[str, List[int]] = {}
+        self._ids: List[int] = []
+        self._meta: Dict[int, Tuple[str, Optional[int], Optional[int]]] = {}  # id -> (timestamp, width, height)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, record_id: object) -> bool:
+        return record_id in self._meta
+
+    @staticmethod
+    def _insert(lst: List[int], record_id: int) -> None:
+        # 通常按 id 递增追加；多进程写入时可能略有乱序
+        if not lst or lst[-1] < record_id:
+            lst.append(record_id)
+        elif not _contains(lst, record_id):
+            bisect.insort(lst, record_id)
+
+    def add(
+        self,
+        record_id: int,
+        params: Dict[str, Any],
+        timestamp: str = "",
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            if record_id in self._meta:
+                return
+            self._meta[record_id] = (timestamp, width, height)
+            self._insert(self._ids, record_id)
+            for term in extract_terms(params):
+                self._insert(self._postings.setdefault(term, []), record_id)
+
+    def add_record(self, record: Any) -> None:
+        """索引一条 GenerationRecord"""
+        self.add(record.id, record.params or {}, record.timestamp, record.width, record.height)
+
+    def terms(self, prefix: str = "", limit: int = 20) -> List[Tuple[str, int]]:
+        """按出现次数列出词项（可按前缀过滤），便于提示可用的检索词"""
+        prefix = normalize_term(prefix) if prefix else ""
+        with self._lock:
+            items = [(t, len(ids)) for t, ids in self._postings.items() if t.startswith(prefix)]
+        return heapq.nlargest(limit, items, key=lambda x: x[1])
+
+    def search(
+        self,
+        query: Query = "",
+        *,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[int]:
+        """返回满足条件的 id（从新到旧，最多 limit 个）。
+
+        since / until 为 ISO 日期或时间前缀（如 "2026-10-01"），两端都包含。
+        """
+        groups = parse_query(query)
+        limit = max(1, int(limit))
+        with self._lock:
+            group_lists = [[self._postings.get(t, []) for t in group] for group in groups]
+            if any(not any(lists) for lists in group_lists):
+                return []  # 某个 AND 组没有任何命中
+
+            if group_lists:
+                # 以命中最少的组驱动遍历，其余组逐个二分校验
+                group_lists.sort(key=lambda lists: sum(len(x) for x in lists))
+                driver, others = group_lists[0], group_lists[1:]
+                candidates = _iter_desc(driver)
+            else:
+                others = []
+                candidates = reversed(self._ids)
+
+            out: List[int] = []
+            for record_id in candidates:
+                if others and not all(any(_contains(x, record_id) for x in lists) for lists in others):
+                    continue
+                if width is not None or height is not None or since or until:
+                    ts, w, h = self._meta.get(record_id, ("", None, None))
+                    if width is not None and w != width:
+                        continue
+                    if height is not None and h != height:
+                        continue
+                    if since and ts[:len(since)] < since:
+                        continue
+                    if until and ts[:len(until)] > until:
+                        continue
+                out.append(record_id)
+                if len(out) >= limit:
+                    break
+            return out
@@ -0,0 +1,239 @@
+"""
+基于 SQLite 的生成历史存储（可选后端）。
+
+- WAL 模式，读写互不阻塞；按 id / timestamp / prompt_id 建索引
+- 与 HistoryManager 相同的 add / get / list_recent / search / iter_records / flush / close API
+- 首次创建数据库时，可从已有的 history.jsonl 一次性迁移
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .history import GenerationRecord, iter_history_records
+from .history_search import HistoryIndex, Query
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    prompt_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_prompt_id ON history(prompt_id);
+"""
+
+# 存在独立列中的字段，其余字段序列化进 data
+_COLUMN_FIELDS = ("id", "timestamp", "prompt_id")
+
+
+def _record_to_row(record: GenerationRecord) -> tuple:
+    d = record.to_dict()
+    data = {k: v for k, v in d.items() if k not in _COLUMN_FIELDS}
+    return (record.id, record.timestamp, record.prompt_id, json.dumps(data, ensure_ascii=False))
+
+
+def _row_to_record(row: sqlite3.Row) -> GenerationRecord:
+    d: Dict[str, Any] = json.loads(row["data"])
+    d.update(id=row["id"], timestamp=row["timestamp"], prompt_id=row["prompt_id"])
+    return GenerationRecord.from_dict(d)
+
+
+class SQLiteHistoryManager:
+    """线程安全的生成历史管理器（SQLite 持久化，每个线程独立连接）"""
+
+    def __init__(self, db_file: Optional[Path] = None, maxlen: int = 50, fsync: str = "never"):
+        self._maxlen = maxlen
+        # fsync 策略映射到 synchronous：always / batch 时每次提交都落盘（FULL），否则 WAL 下的 NORMAL
+        self._synchronous = "FULL" if (fsync or "never").strip().lower() in ("batch", "always") else "NORMAL"
+        if db_file is None:
+            db_file = Path(__file__).resolve().parent.parent / "outputs" / "history.sqlite3"
+        self._db_file = Path(db_file)
+        self._db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        # 各线程打开的连接（close() 时统一关闭）
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._search_index: Optional[HistoryIndex] = None
+        self._search_index_lock = threading.Lock()
+        # 检索索引已收录到的最大 id：每次检索前补上之后的行（包括其他进程写入的）
+        self._indexed_max_id = 0
+
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 每个连接只在创建它的线程中使用；关闭允许在 close() 的调用线程中进行
+            conn = sqlite3.connect(str(self._db_file), timeout=30.0, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self._synchronous}")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    # -- 公开 API --
+
+    def add(
+        self,
+        params: Dict[str, Any],
+        positive_text: str = "",
+        negative_text: str = "",
+        prompt_id: Optional[str] = None,
+        seed: Optional[int] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        images: Optional[List[Optional[str]]] = None,
+        timings: Optional[Dict[str, Any]] = None,
+    ) -> GenerationRecord:
+        """记录一次生成（id 由 SQLite 分配）"""
+        record = GenerationRecord(
+            id=0,
+            timestamp=datetime.now().isoformat(),
+            params=params,
+            positive_text=positive_text,
+            negative_text=negative_text,
+            prompt_id=prompt_id,
+            seed=seed,
+            width=width,
+            height=height,
+            images=list(images or []),
+            timings=dict(timings or {}),
+        )
+        _, timestamp, prompt_id, data = _record_to_row(record)
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO history (timestamp, prompt_id, data) VALUES (?, ?, ?)",
+                (timestamp, prompt_id, data),
+            )
+        record.id = int(cur.lastrowid)
+        return record
+
+    def get(self, source: str) -> Optional[GenerationRecord]:
+        """
+        获取历史记录。
+        - "last"：最后一条
+        - 数字 / "#数字"：按 ID 查找
+        """
+        s = str(source).strip().lstrip("#")
+        conn = self._conn()
+        if s.lower() == "last":
+            row = conn.execute("SELECT * FROM history ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            try:
+                target_id = int(s)
+            except ValueError:
+                return None
+            row = conn.execute("SELECT * FROM history WHERE id = ?", (target_id,)).fetchone()
+        return _row_to_record(row) if row is not None else None
+
+    def get_by_prompt_id(self, prompt_id: str) -> Optional[GenerationRecord]:
+        """按 ComfyUI 的 prompt_id 查找"""
+        row = self._conn().execute(
+            "SELECT * FROM history WHERE prompt_id = ? ORDER BY id DESC LIMIT 1", (prompt_id,)
+        ).fetchone()
+        return _row_to_record(row) if row is not None else None
+
+    def list_recent(self, limit: int = 5) -> List[GenerationRecord]:
+        """返回最近 N 条记录（从新到旧）"""
+        rows = self._conn().execute(
+            "SELECT * FROM history ORDER BY id DESC LIMIT ?", (max(1, limit),)
+        ).fetchall()
+        return [_row_to_record(r) for r in rows]
+
+    def _ensure_search_index(self) -> HistoryIndex:
+        """首次调用时全量构建检索索引，之后只读取 id 大于已收录最大 id 的新行"""
+        with self._search_index_lock:
+            index = self._search_index
+            if index is None:
+                index = self._search_index = HistoryIndex()
+            rows = self._conn().execute(
+                "SELECT * FROM history WHERE id > ? ORDER BY id", (self._indexed_max_id,)
+            ).fetchall()
+            for row in rows:
+                index.add_record(_row_to_record(row))
+                self._indexed_max_id = row["id"]
+            return index
+
+    def search(
+        self,
+        query: Query = "",
+        *,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[GenerationRecord]:
+        """按 tag / 画师 / 角色检索历史（从新到旧），参数同 HistoryManager.search"""
+        ids = self._ensure_search_index().search(
+            query, width=width, height=height, since=since, until=until, limit=limit
+        )
+        if not ids:
+            return []
+        rows = self._conn().execute(
+            f"SELECT * FROM history WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        by_id = {row["id"]: _row_to_record(row) for row in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM history").fetchone()[0])
+
+    def iter_records(self) -> Iterator[GenerationRecord]:
+        """按 id 升序遍历全部记录"""
+        for row in self._conn().execute("SELECT * FROM history ORDER BY id"):
+            yield _row_to_record(row)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """add() 返回时已提交，无需等待（与 HistoryManager 接口一致）"""
+        return True
+
+    def close(self) -> None:
+        """关闭所有线程打开的连接；之后再调用其他方法时按需重新连接。"""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def migrate_jsonl_to_sqlite(jsonl_file: Path, db_file: Path) -> int:
+    """把 JSONL 历史（含封存段）一次性导入 SQLite（保留原 id，已存在的 id 跳过），返回导入条数。"""
+    jsonl_file = Path(jsonl_file)
+
+    manager = SQLiteHistoryManager(db_file)
+    conn = manager._conn()
+    imported = 0
+    batch: List[tuple] = []
+
+    def _flush() -> int:
+        if not batch:
+            return 0
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO history (id, timestamp, prompt_id, data) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+            n = conn.total_changes - before
+        batch.clear()
+        return n
+
+    for record in iter_history_records(jsonl_file):
+        batch.append(_record_to_row(record))
+        if len(batch) >= 1000:
+            imported += _flush()
+    imported += _flush()
+    manager.close()
+    return imported
@@ -0,0 +1,129 @@
+"""
+生成请求的幂等键（idempotency key）。
+
+Agent 框架 / HTTP 代理在超时后会自动重试；同一个 idempotency_key 的重试：
+- 原请求仍在执行：挂到同一个任务上等待结果（不再提交新的 GPU 任务）
+- 原请求已成功：在有效期内直接返回保存的结果
+- 原请求失败：不缓存失败，下一次重试重新执行
+- 同一个 key 但请求内容不同：抛出 IdempotencyConflictError
+
+结果只保存在内存中（按 TTL 与条数上限淘汰）。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from copy import deepcopy
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+
+class IdempotencyConflictError(ValueError):
+    """同一个 idempotency_key 被用于内容不同的请求。"""
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """请求内容的指纹（参数按 key 排序后 JSON 序列化再取 sha256）。"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.future: Future = Future()
+        self.expires_at: Optional[float] = None  # 完成后才开始计时
+
+
+class IdempotencyStore:
+    """线程安全的幂等结果表；同步（run）与 asyncio（run_async）调用方共用。"""
+
+    def __init__(self, ttl_s: float = 600.0, max_entries: int = 256):
+        self._ttl = float(ttl_s)
+        self._max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    def _evict_locked(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if e.expires_at is not None and e.expires_at <= now]:
+            del self._entries[key]
+        # 超出上限时丢弃最早完成的（执行中的不丢弃）
+        while len(self._entries) > self._max_entries:
+            done = next((k for k, e in self._entries.items() if e.expires_at is not None), None)
+            if done is None:
+                break
+            del self._entries[done]
+
+    def _begin(self, key: str, fingerprint: str) -> Tuple[_Entry, bool]:
+        """取得 key 对应的条目；返回 (条目, 是否由调用方负责执行)。"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    raise IdempotencyConflictError(
+                        f"idempotency_key={key!r} 已用于另一个内容不同的请求，请换一个 key"
+                    )
+                return entry, False
+            entry = _Entry(fingerprint)
+            self._entries[key] = entry
+            return entry, True
+
+    def _finish(self, key: str, entry: _Entry, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if error is not None:
+                # 失败不缓存：等待中的重试收到同一个错误，之后的重试重新执行
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            else:
+                entry.expires_at = time.monotonic() + self._ttl
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
+
+    @staticmethod
+    def _replay(result: Any) -> Any:
+        # 返回副本，避免调用方修改保存的结果
+        return deepcopy(result)
+
+    def run(self, key: Optional[str], fingerprint: str, fn: Callable[[], Any]) -> Any:
+        """按幂等键执行 fn()；key 为空或未启用时直接执行。"""
+        if not key or not self.enabled:
+            return fn()
+        entry, owner = self._begin(key, fingerprint)
+        if not owner:
+            return self._replay(entry.future.result())
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, entry, error=e)
+            raise
+        self._finish(key, entry, result=result)
+        return self._replay(result)
+
+    async def run_async(self, key: Optional[str], fingerprint: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """run() 的 asyncio 版本：fn 返回协程；等待中的重试不占用线程。"""
+        if not key or not self.enabled:
+            return await fn()
+        entry, owner = self._begin(key, fingerprint)
+        if not owner:
+            return self._replay(await asyncio.wrap_future(entry.future))
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, entry, error=e)
+            raise
+        self._finish(key, entry, result=result)
+        return self._replay(result)
@@ -0,0 +1,193 @@
+"""
+输出图片后处理：转码（WebP/JPEG）与缩略图。
+
+- 依赖 Pillow（可选）；未安装时整个阶段自动跳过，结果与原来一致
+- 在进程池中执行，避免图片编码长时间占用服务进程的 GIL
+- 原图始终保留在磁盘上，派生文件写到 output_dir（缩略图放在 thumbs/ 子目录）；
+  目标格式与原图相同时不转码，派生文件不会写到原图路径上
+- 多图结果可拼成一张带标签的 contact sheet，减小 MCP 返回体积
+"""
+from __future__ import annotations
+
+import io
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# format 名 -> (Pillow 格式, 扩展名, MIME)
+_FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "jpg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL.Image  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def normalize_format(fmt: Optional[str]) -> Optional[str]:
+    """规范化输出格式名；空值 / original 表示保持原格式。"""
+    s = (fmt or "").strip().lower()
+    if not s or s == "original":
+        return None
+    if s not in _FORMATS:
+        raise ValueError(f"不支持的输出格式：{fmt!r}，仅支持：webp / jpeg / png")
+    return "jpeg" if s == "jpg" else s
+
+
+def get_pool(workers: int) -> Executor:
+    """返回共享的后处理进程池；workers<=0 时使用线程池（例如不便 fork 子进程的宿主）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if workers > 0:
+                try:
+                    _pool = ProcessPoolExecutor(max_workers=workers)
+                except Exception:
+                    _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="animatool-imaging")
+            else:
+                _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="animatool-imaging")
+        return _pool
+
+
+def reset_pool() -> None:
+    """丢弃（已损坏的）进程池，下次使用时重建。"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _open(source: Any):
+    from PIL import Image
+
+    if isinstance(source, (bytes, bytearray)):
+        img = Image.open(io.BytesIO(source))
+    else:
+        img = Image.open(str(source))
+    img.load()
+    return img
+
+
+def _encode(img, fmt: str, quality: int) -> bytes:
+    pil_fmt = _FORMATS[fmt][0]
+    if pil_fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    if pil_fmt == "PNG":
+        img.save(buf, format=pil_fmt, optimize=True)
+    else:
+        img.save(buf, format=pil_fmt, quality=int(quality))
+    return buf.getvalue()
+
+
+def _variant(img, data: bytes, fmt: str, dst: Optional[Path], return_content: bool) -> Dict[str, Any]:
+    if dst is not None:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(data)
+    return {
+        "file_path": str(dst) if dst is not None else None,
+        "mime_type": _FORMATS[fmt][2],
+        "width": img.width,
+        "height": img.height,
+        "size": len(data),
+        "content": data if return_content or dst is None else None,
+    }
+
+
+def _same_format(filename: str, fmt: str) -> bool:
+    source = _FORMATS.get(Path(filename).suffix.lower().lstrip("."))
+    return source is not None and source[0] == _FORMATS[fmt][0]
+
+
+def process_image(
+    source: Any,
+    filename: str,
+    dst_dir: Optional[str],
+    output_format: Optional[str],
+    quality: int,
+    thumbnail_size: int,
+    return_content: bool,
+) -> Dict[str, Dict[str, Any]]:
+    """转码 + 缩略图（在工作进程中执行）。
+
+    source：原图路径或 bytes；dst_dir 为 None 时不落盘，只返回 bytes。
+    返回 {"transcoded": {...}, "thumbnail": {...}}（未启用的项不出现）。
+    """
+    img = _open(source)
+    stem = Path(filename).stem
+    out_dir = Path(dst_dir) if dst_dir else None
+    result: Dict[str, Dict[str, Any]] = {}
+
+    # 目标格式与原图相同时不转码：派生文件会与原图同名，覆盖原图（hardlink 模式下即 ComfyUI 自己的输出）
+    if output_format and not _same_format(filename, output_format):
+        data = _encode(img, output_format, quality)
+        dst = out_dir / f"{stem}{_FORMATS[output_format][1]}" if out_dir else None
+        result["transcoded"] = _variant(img, data, output_format, dst, return_content)
+
+    if thumbnail_size > 0:
+        thumb_fmt = output_format if output_format in ("webp", "jpeg") else "webp"
+        thumb = img.copy()
+        thumb.thumbnail((thumbnail_size, thumbnail_size))
+        data = _encode(thumb, thumb_fmt, quality)
+        dst = out_dir / "thumbs" / f"{stem}{_FORMATS[thumb_fmt][1]}" if out_dir else None
+        # 缩略图体积有界，总是返回 bytes（供 MCP / JSON 内嵌）
+        result["thumbnail"] = _variant(thumb, data, thumb_fmt, dst, True)
+
+    return result
+
+
+def make_contact_sheet(
+    tiles: List[Tuple[Any, str]],
+    dst_path: Optional[str],
+    max_size: int = 2048,
+    output_format: str = "webp",
+    quality: int = 85,
+) -> Dict[str, Any]:
+    """把多张图片拼成一张带标签的拼图（在工作进程中执行）。
+
+    tiles：[(原图路径或 bytes, 标签), ...]；拼图最长边不超过 max_size。
+    """
+    import math
+
+    from PIL import Image, ImageDraw
+
+    n = len(tiles)
+    if n == 0:
+        raise ValueError("contact sheet 至少需要一张图片")
+
+    cols = int(math.ceil(math.sqrt(n)))
+    rows = int(math.ceil(n / cols))
+    label_h = max(14, int(max_size) // max(cols, rows) // 16)
+    cell = max(64, min(int(max_size) // cols, int(max_size) // rows - label_h))
+
+    sheet = Image.new("RGB", (cols * cell, rows * (cell + label_h)), (24, 24, 24))
+    draw = ImageDraw.Draw(sheet)
+    for i, (source, label) in enumerate(tiles):
+        x = (i % cols) * cell
+        y = (i // cols) * (cell + label_h)
+        try:
+            img = _open(source)
+            img.thumbnail((cell, cell))
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            sheet.paste(img, (x + (cell - img.width) // 2, y + (cell - img.height) // 2))
+        except Exception:
+            pass  # 单张读取失败时留空，标签照常绘制
+        draw.text((x + 4, y + cell + 1), label, fill=(235, 235, 235))
+
+    fmt = normalize_format(output_format) or "webp"
+    data = _encode(sheet, fmt, quality)
+    dst = Path(dst_path) if dst_path else None
+    return _variant(sheet, data, fmt, dst, True)
@@ -0,0 +1,277 @@
+"""
+进程内执行后端（ComfyUI extension 模式）。
+
+作为 custom node 加载时，本工具与 ComfyUI 处于同一进程。此时无需再经回环 HTTP
+调用 /prompt、轮询 /history：直接把任务放进 PromptServer.instance.prompt_queue，
+并通过拦截 PromptServer.send_sync 的执行事件得知任务开始与完成。
+
+ComfyUI 内部接口在各版本间有差异；任何不兼容都会抛出 InProcessUnavailableError，
+由 AnimaExecutor 退回 HTTP 路径。
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from .cancellation import CancelToken, JobCancelledError
+
+# 代表任务结束的执行事件
+_DONE_EVENTS = ("execution_success", "execution_error", "execution_interrupted")
+
+# 等待完成事件时检查取消标记的间隔（只看内存中的标记，不查询 history）
+_CANCEL_CHECK_S = 0.25
+
+
+class _Waiter:
+    """一个已提交任务的执行事件：started 在开始执行时置位，done 在结束时置位。"""
+
+    def __init__(self) -> None:
+        self.started = threading.Event()
+        self.done = threading.Event()
+
+
+class InProcessUnavailableError(RuntimeError):
+    """ComfyUI 内部接口不可用（或版本不兼容），应退回 HTTP。"""
+
+
+class InProcessBackend:
+    """通过 ComfyUI 内部的 PromptServer 提交任务并等待完成。
+
+    prompt_server / execution_module 可注入，便于用假的 PromptServer 测试：
+    - prompt_server 需要提供 number、prompt_queue（put / get_history / get_current_queue / delete_queue_item）、send_sync、loop
+    - execution_module 需要提供 validate_prompt
+
+    ComfyUI 自己的 /prompt 处理器在事件循环上分配 server.number 并入队；这里同样把分配与入队
+    交给事件循环执行（loop 未运行时退回本地锁），保证编号不重复、队首插入的顺序正确。
+    """
+
+    def __init__(self, prompt_server: Any, execution_module: Any):
+        self.server = prompt_server
+        self.execution = execution_module
+        self._lock = threading.Lock()
+        self._enqueue_lock = threading.Lock()
+        self._waiters: Dict[str, _Waiter] = {}
+        self._install_listener()
+
+    @classmethod
+    def from_comfyui(cls) -> Optional["InProcessBackend"]:
+        """在 ComfyUI 进程内构造后端；不在 ComfyUI 内或接口缺失时返回 None。"""
+        try:
+            import execution
+            from server import PromptServer
+        except Exception:
+            return None
+        instance = getattr(PromptServer, "instance", None)
+        if instance is None or not hasattr(instance, "prompt_queue") or not hasattr(execution, "validate_prompt"):
+            return None
+        return cls(instance, execution)
+
+    # -------------------------
+    # 执行事件
+    # -------------------------
+    def _install_listener(self) -> None:
+        original = self.server.send_sync
+
+        def send_sync(event, data, sid=None):
+            try:
+                self._on_event(event, data)
+            except Exception:
+                pass  # 监听失败不能影响 ComfyUI 自身的消息推送
+            return original(event, data, sid)
+
+        self.server.send_sync = send_sync
+
+    def _on_event(self, event: str, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        with self._lock:
+            waiter = self._waiters.get(prompt_id)
+        if waiter is None:
+            return
+        if event in _DONE_EVENTS or (event == "executing" and data.get("node") is None):
+            waiter.started.set()
+            waiter.done.set()
+        elif event in ("execution_start", "executing"):
+            waiter.started.set()
+
+    def owns(self, prompt_id: str) -> bool:
+        with self._lock:
+            return prompt_id in self._waiters
+
+    # -------------------------
+    # 提交
+    # -------------------------
+    def _running_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        """PromptServer 的事件循环（正在运行且当前线程不在其中时才返回）"""
+        loop = getattr(self.server, "loop", None)
+        if loop is None or not loop.is_running():
+            return None
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        return None if running is loop else loop
+
+    def _call_validate(self, prompt_id: str, prompt: Dict[str, Any]) -> Tuple[Any, ...]:
+        """兼容不同版本的 execution.validate_prompt 签名（同步 / async）。"""
+        fn = self.execution.validate_prompt
+        try:
+            n_params = len(inspect.signature(fn).parameters)
+        except (TypeError, ValueError):
+            n_params = 1
+
+        if n_params >= 3:
+            res = fn(prompt_id, prompt, None)
+        elif n_params == 2:
+            res = fn(prompt_id, prompt)
+        else:
+            res = fn(prompt)
+
+        if inspect.isawaitable(res):
+            loop = getattr(self.server, "loop", None)
+            if loop is None:
+                raise InProcessUnavailableError("PromptServer.loop 不可用，无法执行 validate_prompt")
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                # 在事件循环线程内同步等待会死锁；调用方必须在工作线程中执行
+                raise InProcessUnavailableError("不能在 ComfyUI 事件循环线程内同步提交任务")
+            res = asyncio.run_coroutine_threadsafe(res, loop).result()
+
+        if not isinstance(res, (tuple, list)) or len(res) < 3:
+            raise InProcessUnavailableError(f"validate_prompt 返回值不兼容：{res!r}")
+        return tuple(res)
+
+    def queue_prompt(self, prompt: Dict[str, Any], client_id: str, front: bool = False) -> str:
+        """校验并把任务放进 ComfyUI 的 prompt_queue，返回 prompt_id。"""
+        prompt_id = str(uuid.uuid4())
+        try:
+            valid = self._call_validate(prompt_id, prompt)
+        except InProcessUnavailableError:
+            raise
+        except TypeError as e:
+            raise InProcessUnavailableError(f"validate_prompt 调用失败：{e}") from e
+
+        if not valid[0]:
+            node_errors = valid[3] if len(valid) > 3 else None
+            raise RuntimeError(f"ComfyUI 执行错误：{valid[1]}" + (f" {node_errors}" if node_errors else ""))
+
+        # 先登记等待者，再入队，避免错过执行事件
+        with self._lock:
+            self._waiters[prompt_id] = _Waiter()
+
+        def enqueue() -> None:
+            number = int(getattr(self.server, "number", 0))
+            self.server.number = number + 1
+            if front:
+                number = -number
+            item: Tuple[Any, ...] = (number, prompt_id, prompt, {"client_id": client_id}, valid[2])
+            if hasattr(self.execution, "SENSITIVE_EXTRA_DATA_KEYS"):
+                # 新版 ComfyUI 的队列项多一个 sensitive 字段
+                item = item + ({},)
+            self.server.prompt_queue.put(item)
+
+        async def enqueue_on_loop() -> None:
+            enqueue()
+
+        try:
+            loop = self._running_loop()
+            if loop is not None:
+                # 与 ComfyUI 的 /prompt 处理器一样在事件循环上分配编号并入队
+                asyncio.run_coroutine_threadsafe(enqueue_on_loop(), loop).result()
+            else:
+                with self._enqueue_lock:
+                    enqueue()
+        except Exception as e:
+            with self._lock:
+                self._waiters.pop(prompt_id, None)
+            raise InProcessUnavailableError(f"prompt_queue.put 失败：{e}") from e
+
+        return prompt_id
+
+    # -------------------------
+    # 等待
+    # -------------------------
+    def _get_history_item(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        history = self.server.prompt_queue.get_history(prompt_id=prompt_id)
+        if isinstance(history, dict):
+            return history.get(prompt_id)
+        return None
+
+    def _current_queue(self) -> Tuple[Any, Any]:
+        queue = self.server.prompt_queue
+        get_current = getattr(queue, "get_current_queue_volatile", None) or queue.get_current_queue
+        return get_current()
+
+    def cancel(self, prompt_id: str) -> str:
+        """从 prompt_queue 删除等待中的任务，或中断正在执行的任务。
+
+        返回 "deleted" / "interrupted" / "not_found"。
+        """
+        queue = self.server.prompt_queue
+        if queue.delete_queue_item(lambda item: item[1] == prompt_id):
+            return "deleted"
+        running, _pending = self._current_queue()
+        if any(item[1] == prompt_id for item in running):
+            import comfy.model_management
+
+            comfy.model_management.interrupt_current_processing(True)
+            return "interrupted"
+        return "not_found"
+
+    def wait_history(
+        self,
+        prompt_id: str,
+        timeout_s: float,
+        cancel_token: Optional[CancelToken] = None,
+        exec_timeout_s: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """等待 send_sync 送来的完成事件，然后从 prompt_queue 的内存历史中取结果
+        （cancel_token 被取消时抛出 JobCancelledError）。
+
+        exec_timeout_s 从收到任务开始执行的事件（execution_start）起计时。
+        """
+        with self._lock:
+            waiter = self._waiters.get(prompt_id)
+        if waiter is None:
+            raise KeyError(f"prompt_id 不是由进程内后端提交的：{prompt_id}")
+
+        deadline = time.time() + float(timeout_s)
+        try:
+            while time.time() < deadline:
+                if exec_timeout_s is not None and waiter.started.is_set():
+                    deadline = min(deadline, time.time() + exec_timeout_s)
+                    exec_timeout_s = None
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise JobCancelledError(f"生成任务已取消：{cancel_token.reason}")
+                wait_s = deadline - time.time()
+                if cancel_token is not None or exec_timeout_s is not None:
+                    wait_s = min(wait_s, _CANCEL_CHECK_S)
+                if not waiter.done.wait(timeout=max(0.0, wait_s)):
+                    continue
+                # execution_success 早于 task_done 写入 history，收到事件后再短暂等待 history 落地
+                item = self._get_history_item(prompt_id)
+                if item is not None:
+                    return item
+                time.sleep(0.01)
+            raise TimeoutError(f"等待 ComfyUI 生成超时：prompt_id={prompt_id}")
+        except (TimeoutError, JobCancelledError):
+            # 放弃等待的任务不再占用 GPU
+            try:
+                self.cancel(prompt_id)
+            except Exception as e:
+                print(f"[ComfyUI-AnimaTool] Failed to cancel prompt {prompt_id}: {e}", file=sys.stderr)
+            raise
+        finally:
+            with self._lock:
+                self._waiters.pop(prompt_id, None)
@@ -0,0 +1,138 @@
+"""
+进程内指标：直方图 / 计数器 / 回调式 gauge，按 Prometheus 文本格式（0.0.4）导出。
+
+不依赖 prometheus_client；FastAPI 的 /metrics 与 ComfyUI 扩展的 /anima/metrics 直接返回 render() 的结果。
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 覆盖 毫秒级的本地阶段 ~ 分钟级的 GPU 执行
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+GaugeFn = Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """线程安全的指标表。"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, GaugeFn] = {}
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        """记录一次直方图观测值（秒）。"""
+        key = _label_key(labels)
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(len(self._buckets))
+            if index < len(self._buckets):
+                hist.counts[index] += 1
+            hist.sum += value
+            hist.count += 1
+
+    def inc(self, name: str, amount: float = 1.0, **labels: object) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def gauge(self, name: str, help_text: str, fn: GaugeFn) -> None:
+        """注册回调式 gauge：render() 时调用 fn() 取 [(labels, value), ...]。"""
+        self.describe(name, "gauge", help_text)
+        self._gauges[name] = fn
+
+    def snapshot(self, name: str) -> Dict[LabelKey, Tuple[int, float]]:
+        """直方图 name 各标签组合的 (次数, 总和)，便于测试与调试。"""
+        with self._lock:
+            return {key: (h.count, h.sum) for key, h in self._histograms.get(name, {}).items()}
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, default_kind: str) -> None:
+            kind, help_text = self._help.get(name, (default_kind, ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (list(h.counts), h.sum, h.count) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+        gauges = dict(self._gauges)
+
+        for name in sorted(counters):
+            header(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            header(name, "histogram")
+            for key, (counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(self._buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        for name in sorted(gauges):
+            try:
+                samples = list(gauges[name]())
+            except Exception:
+                continue  # 采集失败不影响其余指标
+            header(name, "gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,160 @@
+"""
+提交前校验：基于缓存的 ComfyUI /object_info 检查注入后的 workflow。
+
+- 一次请求取回整份 /object_info，带 TTL 缓存（并发的校验共用同一次拉取）
+- 检查枚举输入（sampler_name / scheduler / 模型与 LoRA 文件名等）与 INT / FLOAT 的取值范围
+- 出错时一次性给出所有问题，并用 difflib 给出最接近的候选值
+- 校验失败且缓存已有一段时间时先刷新再确认（例如刚放入新的 LoRA）
+- /object_info 不可用、或健康监控报告后端不可用时跳过校验，由 ComfyUI 自己报错
+"""
+from __future__ import annotations
+
+import difflib
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class PromptValidationError(ValueError):
+    """workflow 未通过提交前校验；errors 为逐条的错误说明。"""
+
+    def __init__(self, errors: List[str]):
+        self.errors = list(errors)
+        super().__init__("参数校验失败：\n" + "\n".join(f"  - {e}" for e in self.errors))
+
+
+def _enum_options(spec: Any) -> Optional[List[Any]]:
+    """从输入定义中取出枚举候选（旧格式 [[...], {...}]，新格式 ["COMBO", {"options": [...]}]）。"""
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    if isinstance(spec[0], (list, tuple)):
+        return list(spec[0])
+    if spec[0] == "COMBO" and len(spec) > 1 and isinstance(spec[1], dict):
+        options = spec[1].get("options")
+        if isinstance(options, (list, tuple)):
+            return list(options)
+    return None
+
+
+def _suggest(value: Any, options: List[Any]) -> List[str]:
+    text = str(value)
+    candidates = [str(o) for o in options]
+    # 路径分隔符 / 大小写不同也算接近
+    normalized = text.replace("\\", "/").lower()
+    exact = [c for c in candidates if c.replace("\\", "/").lower() == normalized]
+    if exact:
+        return exact[:3]
+    return difflib.get_close_matches(text, candidates, n=3, cutoff=0.5)
+
+
+def _format_options(options: List[Any], limit: int = 12) -> str:
+    shown = ", ".join(str(o) for o in options[:limit])
+    return shown + (f" …（共 {len(options)} 项）" if len(options) > limit else "")
+
+
+def validate_graph(prompt: Dict[str, Any], node_info: Callable[[str], Optional[Dict[str, Any]]]) -> List[str]:
+    """按节点定义校验 workflow，返回错误列表（空列表表示通过）。
+
+    node_info(class_type) 返回该节点的 /object_info 条目；返回 None 表示信息不可用，跳过该节点。
+    """
+    errors: List[str] = []
+    for node_id, node in prompt.items():
+        class_type = node.get("class_type")
+        info = node_info(class_type)
+        if info is None:
+            continue
+        if not info:
+            errors.append(f"节点 {node_id}：ComfyUI 中不存在节点类型 {class_type}（未安装对应的 custom node？）")
+            continue
+
+        specs: Dict[str, Any] = {}
+        for section in ("required", "optional"):
+            specs.update((info.get("input") or {}).get(section) or {})
+
+        for name, value in (node.get("inputs") or {}).items():
+            if isinstance(value, list):
+                continue  # 连线
+            spec = specs.get(name)
+            if spec is None:
+                continue
+
+            opts = spec[1] if isinstance(spec, (list, tuple)) and len(spec) > 1 and isinstance(spec[1], dict) else {}
+            options = _enum_options(spec)
+            if options is not None:
+                # 上传类输入（LoadImage.image）由节点自己校验，列表只是当时 input 目录的快照
+                if opts.get("image_upload") or opts.get("upload"):
+                    continue
+                if options and value not in options:
+                    msg = f"{class_type}.{name}={value!r} 不是可用值"
+                    suggestions = _suggest(value, options)
+                    if suggestions:
+                        msg += f"，是否想用：{', '.join(suggestions)}"
+                    else:
+                        msg += f"，可用值：{_format_options(options)}"
+                    errors.append(msg)
+                continue
+
+            kind = spec[0] if isinstance(spec, (list, tuple)) and spec else None
+            if kind in ("INT", "FLOAT") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                lo, hi = opts.get("min"), opts.get("max")
+                if lo is not None and value < lo:
+                    errors.append(f"{class_type}.{name}={value} 小于最小值 {lo}")
+                elif hi is not None and value > hi:
+                    errors.append(f"{class_type}.{name}={value} 大于最大值 {hi}")
+    return errors
+
+
+class ObjectInfoCache:
+    """缓存整份 /object_info 的结果（线程安全，带 TTL）。
+
+    fetch() 返回 ComfyUI 的原始响应 {class_type: info}；抛异常视为不可用。
+    """
+
+    def __init__(self, fetch: Callable[[], Any], ttl_s: float = 300.0, min_refresh_s: float = 10.0):
+        self._fetch = fetch
+        self._ttl = float(ttl_s)
+        self._min_refresh = float(min_refresh_s)
+        # 拉取在锁内进行：同时到达的校验只发起一次请求
+        self._lock = threading.Lock()
+        self._stamp: Optional[float] = None
+        self._data: Optional[Dict[str, Any]] = None
+
+    def snapshot(self, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """返回 {class_type: info}；/object_info 不可用时返回 None。"""
+        max_age = self._ttl if max_age is None else max_age
+        with self._lock:
+            now = time.monotonic()
+            if self._stamp is not None and now - self._stamp < max_age:
+                return self._data
+            try:
+                data = self._fetch()
+                data = data if isinstance(data, dict) else None
+            except Exception:
+                data = None
+            # 拉取失败只短暂缓存，避免 ComfyUI 暂时不可用时长时间关闭校验
+            self._stamp = now if data is not None else now - max(0.0, self._ttl - self._min_refresh)
+            self._data = data
+            return data
+
+    def get(self, class_type: str, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """返回节点定义；节点不存在时返回 {}；/object_info 不可用时返回 None。"""
+        data = self.snapshot(max_age)
+        if data is None:
+            return None
+        return data.get(class_type) or {}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stamp = None
+            self._data = None
+
+    def validate(self, prompt: Dict[str, Any]) -> None:
+        """校验 workflow，失败时抛出 PromptValidationError。
+
+        首次失败时重新拉取一次（缓存超过 min_refresh_s 时），避免因缓存过期误报。
+        """
+        errors = validate_graph(prompt, self.get)
+        if errors:
+            errors = validate_graph(prompt, lambda c: self.get(c, max_age=self._min_refresh))
+        if errors:
+            raise PromptValidationError(errors)
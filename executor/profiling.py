@@ -0,0 +1,221 @@
+"""
+剖析钩子与 Chrome trace 导出。
+
+AnimaExecutor 在以下位置触发钩子（订阅者收到 (事件名, payload)）：
+
+- job_start / job_end：一次 generate() 的开始 / 结束（job_end 带 outcome、timings 与 ComfyUI 执行时间窗）
+- stage_start / stage_end：各阶段（model_check、inject、validate、queue_wait、submit、wait_history、
+  download、disk_write、postprocess、encode、history_write）的前后
+- http_call：每次对 ComfyUI 的 HTTP 请求（method、url、status、耗时、错误）
+- history_write：写入一条生成历史
+
+payload 总是包含 job（每次 generate() 一个）、request_id（repeat 的多次生成共用）、prompt_id（尚未提交时为 None）、
+ts（开始时刻，time.time() 秒）与 thread；不属于任何生成任务的 HTTP 请求（如健康探测）job 为 None。
+订阅者在触发线程中同步调用，应尽量轻量；订阅者抛出的异常会被忽略。
+
+request_id 由各前端通过 request_scope() 设置（HTTP 的 X-Request-ID、MCP 的 JSON-RPC 请求 id），
+asyncio.to_thread 会把它带到执行生成的工作线程；未设置时 generate() 自动生成。
+
+ChromeTracer 按采样率记录部分请求，写成 Chrome trace-event 格式（JSON 数组，可直接用
+chrome://tracing 或 https://ui.perfetto.dev 打开），每个线程一行，ComfyUI 的实际执行时间单独一行。
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Union
+
+JOB_START = "job_start"
+JOB_END = "job_end"
+STAGE_START = "stage_start"
+STAGE_END = "stage_end"
+HTTP_CALL = "http_call"
+HISTORY_WRITE = "history_write"
+
+EVENTS = (JOB_START, JOB_END, STAGE_START, STAGE_END, HTTP_CALL, HISTORY_WRITE)
+
+HookFn = Callable[[str, Dict[str, Any]], None]
+
+_request_id: ContextVar[Optional[str]] = ContextVar("anima_request_id", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+@contextmanager
+def request_scope(request_id: Optional[str] = None) -> Iterator[str]:
+    """在 with 块内把 request_id 设为当前请求 id（None 时生成新的）。"""
+    request_id = str(request_id) if request_id else new_request_id()
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+
+class Hooks:
+    """线程安全的钩子注册表。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # 写时复制：emit() 不加锁
+        self._subscribers: Dict[str, tuple] = {name: () for name in EVENTS}
+
+    def subscribe(self, event: str, fn: HookFn) -> Callable[[], None]:
+        """订阅事件（"*" 表示全部），返回取消订阅的函数。"""
+        names = EVENTS if event == "*" else (event,)
+        for name in names:
+            if name not in self._subscribers:
+                raise ValueError(f"未知的钩子事件：{name!r}（可用：{', '.join(EVENTS)}）")
+        with self._lock:
+            for name in names:
+                self._subscribers[name] = self._subscribers[name] + (fn,)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                for name in names:
+                    self._subscribers[name] = tuple(f for f in self._subscribers[name] if f is not fn)
+
+        return unsubscribe
+
+    def active(self, event: str) -> bool:
+        """是否有订阅者（没有时调用方可跳过构造 payload）。"""
+        return bool(self._subscribers.get(event))
+
+    def emit(self, event: str, payload: Dict[str, Any]) -> None:
+        for fn in self._subscribers.get(event, ()):
+            try:
+                fn(event, payload)
+            except Exception as e:
+                print(f"[ComfyUI-AnimaTool] Hook {getattr(fn, '__name__', fn)!r} failed on {event}: {e}", file=sys.stderr)
+
+
+class ChromeTracer:
+    """把采样请求的钩子事件写成 Chrome trace-event JSON。
+
+    每个进程一个文件 anima-trace-<pid>-<时间>.json；请求结束时把该请求的事件追加到文件
+    （JSON 数组格式允许省略结尾的 "]"，进程被杀掉时文件依然可以打开）。
+    """
+
+    _COMFY_TID = 0  # ComfyUI 实际执行时间窗所在的行
+
+    def __init__(self, trace_dir: Union[str, Path], sample_rate: float = 1.0):
+        self.trace_dir = Path(trace_dir)
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.path = self.trace_dir / f"anima-trace-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        self._lock = threading.Lock()
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self._named_threads: Set[int] = set()
+        self._file = None
+        self._unsubscribe: Optional[Callable[[], None]] = None
+
+    def attach(self, hooks: Hooks) -> "ChromeTracer":
+        self._unsubscribe = hooks.subscribe("*", self._on_event)
+        return self
+
+    def close(self) -> None:
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _us(seconds: float) -> int:
+        return int(seconds * 1_000_000)
+
+    def _on_event(self, event: str, payload: Dict[str, Any]) -> None:
+        job = payload.get("job")
+        if not job:
+            return
+        if event == JOB_START:
+            if random.random() < self.sample_rate:
+                with self._lock:
+                    self._buffers[job] = []
+            return
+
+        with self._lock:
+            buffer = self._buffers.get(job)
+        if buffer is None:
+            return
+        request_id = payload.get("request_id")
+
+        args = {"job": job, "request_id": request_id, "prompt_id": payload.get("prompt_id")}
+        tid = payload.get("thread") or 0
+        if event == STAGE_END:
+            if payload.get("error"):
+                args["error"] = payload["error"]
+            buffer.append(self._span(payload["stage"], "stage", payload, tid, args))
+        elif event == HTTP_CALL:
+            args.update({k: payload.get(k) for k in ("method", "url", "status", "error") if payload.get(k) is not None})
+            name = f"{payload.get('method')} {str(payload.get('url') or '').split('?')[0].rsplit('/', 1)[-1]}"
+            buffer.append(self._span(name, "http", payload, tid, args))
+        elif event == HISTORY_WRITE:
+            args["history_id"] = payload.get("history_id")
+            buffer.append({"name": "history_record", "cat": "history", "ph": "i", "s": "t",
+                           "ts": self._us(payload["ts"]), "pid": os.getpid(), "tid": tid, "args": args})
+        elif event == JOB_END:
+            args.update({k: payload.get(k) for k in ("outcome", "priority", "client", "timings")})
+            buffer.append(self._span(f"generate {request_id}", "job", payload, tid, args))
+            window = payload.get("comfy_window")
+            if window:
+                buffer.append({
+                    "name": f"ComfyUI execute {payload.get('prompt_id')}", "cat": "comfyui", "ph": "X",
+                    "ts": self._us(window[0]), "dur": self._us(max(0.0, window[1] - window[0])),
+                    "pid": os.getpid(), "tid": self._COMFY_TID, "args": args,
+                })
+            with self._lock:
+                self._buffers.pop(job, None)
+            self._flush(buffer)
+
+    def _span(self, name: str, cat: str, payload: Dict[str, Any], tid: int, args: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": self._us(payload["ts"]),
+            "dur": self._us(payload.get("duration_s") or 0.0),
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        }
+
+    def _metadata_locked(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        meta: List[Dict[str, Any]] = []
+        names = {t.ident: t.name for t in threading.enumerate()}
+        names[self._COMFY_TID] = "ComfyUI (execution)"
+        for tid in sorted({e["tid"] for e in events} - self._named_threads):
+            self._named_threads.add(tid)
+            meta.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                         "args": {"name": names.get(tid, f"thread-{tid}")}})
+        return meta
+
+    def _flush(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        try:
+            with self._lock:
+                if self._file is None:
+                    self.trace_dir.mkdir(parents=True, exist_ok=True)
+                    self._file = self.path.open("a", encoding="utf-8")
+                    self._file.write("[\n")
+                for event in self._metadata_locked(events) + events:
+                    self._file.write(json.dumps(event, ensure_ascii=False, default=str) + ",\n")
+                self._file.flush()
+        except OSError as e:
+            print(f"[ComfyUI-AnimaTool] Failed to write trace {self.path}: {e}", file=sys.stderr)
@@ -0,0 +1,259 @@
+"""
+提交调度：按优先级把任务放进 ComfyUI，并限制同时在 ComfyUI 中未完成的任务数。
+
+ComfyUI 的队列是 FIFO；批量任务一次性全部提交后，交互式请求要排在所有批量任务之后。
+因此本地先排队，只让少量任务（max_outstanding）进入 ComfyUI：
+
+- 优先级：interactive（MCP 等在线用户）> normal（默认）> batch（CLI / 批量）
+- 同优先级内的顺序由 policy 决定：
+  - fair（默认）：按客户端加权公平排队（WFQ）。每个任务的虚拟完成时间 = max(队列虚拟时间, 该客户端上一个任务的完成时间)
+    + cost / weight，按虚拟完成时间出队；一次提交大量任务的客户端不会挡住其他客户端
+  - sjf：预计耗时最短的任务先出队；等待超过 max_wait_s 的任务按到达顺序优先（老化上限，避免大任务饿死）
+- interactive 不受低优先级任务占用的名额限制，并使用 ComfyUI 的 front 提交插到队首，
+  因此最多只需等待 ComfyUI 当前正在执行的那一个任务
+
+cost 为预计执行秒数（见 cost_model），同时用于 ETA / 排队等待估计（jobs()）。
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from .cancellation import CancelToken, JobCancelledError
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BATCH = "batch"
+
+PRIORITIES: Dict[str, int] = {INTERACTIVE: 0, NORMAL: 1, BATCH: 2}
+POLICIES = ("fair", "sjf")
+
+
+def normalize_priority(priority: Union[str, int, None], default: str = NORMAL) -> str:
+    """把 "interactive" / "normal" / "batch"（或 0 / 1 / 2）规范为优先级名；无法识别时抛出 ValueError。"""
+    if priority is None or priority == "":
+        return default
+    if isinstance(priority, int) and not isinstance(priority, bool):
+        for name, rank in PRIORITIES.items():
+            if rank == priority:
+                return name
+    elif isinstance(priority, str) and priority.strip().lower() in PRIORITIES:
+        return priority.strip().lower()
+    raise ValueError(f"priority 必须是 {', '.join(PRIORITIES)} 之一：{priority!r}")
+
+
+class _Job:
+    __slots__ = (
+        "id", "priority", "client", "cost", "start", "enqueued_at", "granted_at",
+        "prompt_id", "event", "granted", "abandoned",
+    )
+
+    def __init__(self, priority: str, client: Optional[str], cost: float, start: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.priority = priority
+        self.client = client
+        self.cost = cost
+        self.start = start
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.prompt_id: Optional[str] = None
+        self.event = threading.Event()
+        self.granted = False
+        self.abandoned = False
+
+
+class Slot:
+    """已获得的提交名额；front 为 True 时应使用 ComfyUI 的队首提交。"""
+
+    __slots__ = ("priority", "front", "job_id", "queue_wait_s")
+
+    def __init__(self, priority: str, front: bool, job_id: str, queue_wait_s: float):
+        self.priority = priority
+        self.front = front
+        self.job_id = job_id
+        self.queue_wait_s = queue_wait_s
+
+
+class JobScheduler:
+    """线程安全的优先级提交闸门。
+
+    max_outstanding <= 0 表示不限制（不排队，也不使用队首提交），但仍登记任务以便估计 ETA。
+    """
+
+    def __init__(self, max_outstanding: int = 2, policy: str = "fair", max_wait_s: float = 120.0):
+        if policy not in POLICIES:
+            raise ValueError(f"policy 必须是 {', '.join(POLICIES)} 之一：{policy!r}")
+        self.max_outstanding = int(max_outstanding)
+        self.policy = policy
+        self.max_wait_s = float(max_wait_s)
+        self._lock = threading.Lock()
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._outstanding: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        # 已放行、尚未完成的任务（按放行顺序），用于估计排队等待
+        self._running: Dict[str, _Job] = {}
+        # 加权公平排队：每个优先级的虚拟时间，以及 (优先级, 客户端) 上一个任务的虚拟完成时间
+        self._vtime: Dict[str, float] = {name: 0.0 for name in PRIORITIES}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_outstanding > 0
+
+    def _admissible_locked(self, priority: str) -> bool:
+        if not self.enabled:
+            return True
+        if priority == INTERACTIVE:
+            # 交互式任务只与其他交互式任务共享名额
+            return self._outstanding[INTERACTIVE] < self.max_outstanding
+        return sum(self._outstanding.values()) < self.max_outstanding
+
+    def _head_locked(self) -> Optional[tuple]:
+        """下一个应出队的条目（sjf 策略下优先选择等待超过老化上限的任务）。"""
+        while self._heap and self._heap[0][-1].abandoned:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        head = self._heap[0]
+        if self.policy == "sjf" and self.max_wait_s > 0:
+            deadline = time.monotonic() - self.max_wait_s
+            aged = [e for e in self._heap if e[0] == head[0] and not e[-1].abandoned and e[-1].enqueued_at <= deadline]
+            if aged:
+                return min(aged, key=lambda e: e[-1].enqueued_at)
+        return head
+
+    def _dispatch_locked(self) -> None:
+        while True:
+            entry = self._head_locked()
+            if entry is None:
+                break
+            job: _Job = entry[-1]
+            if not self._admissible_locked(job.priority):
+                break
+            if entry is self._heap[0]:
+                heapq.heappop(self._heap)
+            else:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+            self._vtime[job.priority] = max(self._vtime[job.priority], job.start)
+            job.granted = True
+            job.granted_at = time.monotonic()
+            self._outstanding[job.priority] += 1
+            self._running[job.id] = job
+            job.event.set()
+
+    def _release(self, job: _Job) -> None:
+        with self._lock:
+            self._outstanding[job.priority] -= 1
+            self._running.pop(job.id, None)
+            self._dispatch_locked()
+
+    def _enqueue_locked(self, priority: str, client: Optional[str], weight: float, cost: float) -> _Job:
+        cost = max(float(cost), 1e-6)
+        # 未指定客户端的任务视为同一个匿名客户端（彼此之间按到达顺序）
+        key = (priority, client or "")
+        start = max(self._vtime[priority], self._last_finish.get(key, 0.0))
+        finish = start + cost / max(weight, 1e-6)
+        self._last_finish[key] = finish
+        if len(self._last_finish) > 1024:
+            # 已落后于虚拟时间的客户端与新客户端等价，不必保留
+            self._last_finish = {k: v for k, v in self._last_finish.items() if v > self._vtime[k[0]]}
+        job = _Job(priority, client, cost, start)
+        order = cost if self.policy == "sjf" else finish
+        heapq.heappush(self._heap, (PRIORITIES[priority], order, next(self._seq), job))
+        return job
+
+    @contextmanager
+    def slot(
+        self,
+        priority: str = NORMAL,
+        cancel_token: Optional[CancelToken] = None,
+        *,
+        client: Optional[str] = None,
+        weight: float = 1.0,
+        cost: float = 1.0,
+    ) -> Iterator[Slot]:
+        """等待轮到本任务后取得名额；退出 with 块（任务完成 / 失败 / 取消）时归还。
+
+        client / weight 用于同优先级内的加权公平排队；cost 为预计执行秒数。
+        """
+        priority = normalize_priority(priority)
+        with self._lock:
+            job = self._enqueue_locked(priority, client, weight, cost)
+            self._dispatch_locked()
+
+        while not job.event.wait(0.25 if cancel_token is not None else None):
+            if cancel_token is not None and cancel_token.cancelled:
+                with self._lock:
+                    if not job.granted:
+                        job.abandoned = True
+                        self._dispatch_locked()
+                        raise JobCancelledError(f"生成任务已取消：{cancel_token.reason}")
+                break  # 取消与放行同时发生：已占用名额，交给下面的 finally 归还
+
+        try:
+            front = self.enabled and priority == INTERACTIVE
+            yield Slot(priority, front, job.id, (job.granted_at or job.enqueued_at) - job.enqueued_at)
+        finally:
+            self._release(job)
+
+    def set_prompt_id(self, job_id: str, prompt_id: str) -> None:
+        with self._lock:
+            job = self._running.get(job_id)
+            if job is not None:
+                job.prompt_id = prompt_id
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """当前任务及其 ETA：running（已进入 ComfyUI）按放行顺序，queued 按预计出队顺序。
+
+        queue_wait_s 为预计还需等待多久开始执行，eta_s 为预计还需多久完成。
+        """
+        now = time.monotonic()
+        with self._lock:
+            running = list(self._running.values())
+            waiting = sorted((e for e in self._heap if not e[-1].abandoned), key=lambda e: e[:3])
+            waiting_jobs = [e[-1] for e in waiting]
+        result: List[Dict[str, Any]] = []
+        ahead = 0.0
+        for job in running:
+            remaining = max(0.0, job.cost - (now - (job.granted_at or now)))
+            result.append(self._describe(job, "running", now, ahead, ahead + remaining))
+            ahead += remaining
+        for job in waiting_jobs:
+            result.append(self._describe(job, "queued", now, ahead, ahead + job.cost))
+            ahead += job.cost
+        return result
+
+    @staticmethod
+    def _describe(job: _Job, state: str, now: float, wait: float, eta: float) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "state": state,
+            "priority": job.priority,
+            "client": job.client,
+            "prompt_id": job.prompt_id,
+            "waited_s": round(now - job.enqueued_at, 1),
+            "predicted_s": round(job.cost, 1),
+            "queue_wait_s": round(wait, 1),
+            "eta_s": round(eta, 1),
+        }
+
+    def stats(self) -> Dict[str, object]:
+        """当前在 ComfyUI 中未完成 / 本地排队中的任务数（按优先级）。"""
+        with self._lock:
+            waiting = {name: 0 for name in PRIORITIES}
+            for entry in self._heap:
+                job = entry[-1]
+                if not job.abandoned:
+                    waiting[job.priority] += 1
+            return {
+                "max_outstanding": self.max_outstanding,
+                "policy": self.policy,
+                "outstanding": dict(self._outstanding),
+                "waiting": waiting,
+            }
@@ -4,6 +4,13 @@
 用法（在 ComfyUI-AnimaTool 目录下）：
     python -m servers.cli --json-file example.json
     python -m servers.cli --json '{"aspect_ratio":"9:16", ...}'
+
+常驻模式（循环调用 CLI 的脚本适用）：
+    python -m servers.cli --daemon &        # 在 Unix socket 上保持预热的执行器
+    python -m servers.cli --json-file example.json   # 常驻进程在运行时自动作为薄客户端
+    python -m servers.cli --stop-daemon
+
+常驻进程未运行、ANIMATOOL_* / COMFYUI_* 配置与常驻进程不一致（或 --no-daemon）时在本进程内执行。详见 servers/cli_daemon.py。
 """
 from __future__ import annotations
 
@@ -18,7 +25,7 @@ _PARENT = Path(__file__).resolve().parent.parent
 if str(_PARENT) not in sys.path:
     sys.path.insert(0, str(_PARENT))
 
-from executor import AnimaExecutor, AnimaToolConfig
+from servers.cli_daemon import CliDaemon, DaemonNotRunning, animatool_env, request, socket_path
 
 
 def _load_json_arg(s: str) -> Dict[str, Any]:
@@ -46,7 +53,39 @@ def main() -> int:
     parser.add_argument("--comfyui-url", default="http://127.0.0.1:8188", help="ComfyUI 地址")
     parser.add_argument("--json", default=None, help="直接传入 JSON object 字符串")
     parser.add_argument("--json-file", default=None, help="从文件读取 JSON object")
+    parser.add_argument(
+        "--priority",
+        default="batch",
+        choices=["interactive", "normal", "batch"],
+        help="排队优先级（默认 batch：排在 MCP 等交互式请求之后）",
+    )
+    parser.add_argument("--daemon", action="store_true", help="以常驻进程运行（前台），供后续 CLI 调用复用")
+    parser.add_argument("--stop-daemon", action="store_true", help="停止常驻进程")
+    parser.add_argument("--daemon-status", action="store_true", help="查看常驻进程状态")
+    parser.add_argument("--no-daemon", action="store_true", help="不使用常驻进程，始终在本进程内执行")
+    parser.add_argument("--socket", default=None, help="常驻进程的 socket 路径（默认 ANIMATOOL_CLI_SOCKET 或运行时目录）")
     args = parser.parse_args()
+    path = socket_path(args.socket)
+
+    if args.daemon:
+        try:
+            CliDaemon(path, comfyui_url=str(args.comfyui_url)).serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            raise SystemExit(str(e)) from e
+        return 0
+    if args.stop_daemon or args.daemon_status:
+        try:
+            response = request({"op": "stop" if args.stop_daemon else "status"}, path)
+        except DaemonNotRunning:
+            print(f"CLI 常驻进程未运行（{path}）", file=sys.stderr)
+            return 1
+        except PermissionError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        print(json.dumps(response.get("result"), ensure_ascii=False, indent=2))
+        return 0
 
     if not args.json and not args.json_file:
         raise SystemExit("必须提供 --json 或 --json-file")
@@ -55,9 +94,39 @@ def main() -> int:
 
     payload = _load_json_arg(args.json) if args.json else _load_json_file(args.json_file)
 
-    cfg = AnimaToolConfig(comfyui_url=str(args.comfyui_url))
-    ex = AnimaExecutor(config=cfg)
-    result = ex.generate(payload)
+    result = None
+    if not args.no_daemon:
+        try:
+            response = request(
+                {
+                    "op": "generate",
+                    "payload": payload,
+                    "priority": args.priority,
+                    "comfyui_url": str(args.comfyui_url),
+                    "env": animatool_env(),
+                },
+                path,
+            )
+        except DaemonNotRunning:
+            response = None
+        except PermissionError as e:
+            print(f"{e}；在本进程内执行", file=sys.stderr)
+            response = None
+        if response is not None and response.get("error_type") == "ConfigMismatch":
+            print(f"{response.get('error')}；在本进程内执行", file=sys.stderr)
+            response = None
+        if response is not None:
+            if not response.get("ok"):
+                raise SystemExit(f"{response.get('error_type') or 'Error'}: {response.get('error')}")
+            result = response["result"]
+
+    if result is None:
+        # 常驻进程未运行：在本进程内执行（仅此时才加载 executor）
+        from executor import AnimaExecutor, AnimaToolConfig
+
+        cfg = AnimaToolConfig(comfyui_url=str(args.comfyui_url))
+        ex = AnimaExecutor(config=cfg)
+        result = ex.generate(payload, priority=args.priority)
     print(json.dumps(result, ensure_ascii=False, indent=2))
     return 0
 
@@ -0,0 +1,321 @@
+"""
+CLI 常驻进程：在本机 Unix socket 上保持预热好的 AnimaExecutor（模板、历史、连接、耗时模型），
+python -m servers.cli 检测到常驻进程时只做薄客户端，省去每次调用的导入与初始化。
+
+启动 / 查看 / 停止：
+    python -m servers.cli --daemon &
+    python -m servers.cli --daemon-status
+    python -m servers.cli --stop-daemon
+
+socket 路径：--socket，或环境变量 ANIMATOOL_CLI_SOCKET；默认 $XDG_RUNTIME_DIR/animatool-cli.sock
+（未设置时为临时目录下的 animatool-cli-<uid>.sock），权限 0600，仅当前用户可连接；
+客户端只连接属于当前用户的 socket。
+
+配置：执行器按常驻进程启动时的 ANIMATOOL_* / COMFYUI_* 环境变量创建。客户端随请求发送自己的这些环境变量，
+与常驻进程不一致时请求被拒绝（ConfigMismatch），客户端改为在本进程内执行；修改配置后需重启常驻进程。
+
+协议：每个连接一个请求，一行 JSON 请求、一行 JSON 响应（UTF-8）。
+  {"op": "generate", "payload": {...}, "priority": "batch", "comfyui_url": "http://...", "env": {"ANIMATOOL_...": "..."}}
+  {"op": "status"} / {"op": "stop"}
+  响应：{"ok": true, "result": {...}} 或 {"ok": false, "error": "...", "error_type": "..."}
+客户端在等待结果时断开（如 Ctrl-C），常驻进程撤销对应的 ComfyUI 任务。
+
+本模块顶层只导入标准库：薄客户端不加载 executor。
+"""
+from __future__ import annotations
+
+import json
+import os
+import select
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from executor import AnimaExecutor
+
+SOCKET_ENV = "ANIMATOOL_CLI_SOCKET"
+# AnimaToolConfig 读取的非 ANIMATOOL_* 环境变量（后端地址与目录同样决定执行器行为）
+COMFYUI_ENV = ("COMFYUI_URL", "COMFYUI_OUTPUT_DIR", "COMFYUI_MODELS_DIR")
+
+# 连接常驻进程的超时：连不上时应尽快退回进程内执行
+_CONNECT_TIMEOUT_S = 0.5
+
+
+def unix_sockets_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+def animatool_env() -> Dict[str, str]:
+    """影响执行器配置的环境变量（ANIMATOOL_* 与 COMFYUI_URL 等，不含 socket 路径本身）"""
+    return {
+        k: v
+        for k, v in os.environ.items()
+        if (k.startswith("ANIMATOOL_") and k != SOCKET_ENV) or k in COMFYUI_ENV
+    }
+
+
+def socket_path(path: Optional[str] = None) -> Path:
+    """常驻进程的 socket 路径：参数 > ANIMATOOL_CLI_SOCKET > 运行时目录"""
+    path = path or os.environ.get(SOCKET_ENV, "")
+    if path:
+        return Path(path).expanduser()
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return Path(runtime_dir) / "animatool-cli.sock"
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return Path(tempfile.gettempdir()) / f"animatool-cli-{uid}.sock"
+
+
+# -------------------------
+# 客户端
+# -------------------------
+class DaemonNotRunning(Exception):
+    """常驻进程未运行（socket 不存在或拒绝连接）：调用方应退回进程内执行。"""
+
+
+class ConfigMismatch(Exception):
+    """客户端的环境变量配置与常驻进程不一致：请求未执行，调用方应退回进程内执行。"""
+
+
+def _check_owner(path: Path) -> None:
+    """socket 必须属于当前用户：临时目录下的路径可被其他用户抢先创建"""
+    if not hasattr(os, "getuid"):
+        return
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{path} 属于其他用户（uid {st.st_uid}），拒绝连接")
+
+
+def _read_line(sock: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+
+def request(message: Dict[str, Any], path: Optional[Path] = None) -> Dict[str, Any]:
+    """向常驻进程发送一个请求并等待响应。
+
+    连接失败时抛出 DaemonNotRunning（请求尚未送达，可以安全地改为进程内执行）；
+    连接后常驻进程异常退出时抛出 RuntimeError（请求可能已提交，不应重试）。
+    """
+    if not unix_sockets_supported():
+        raise DaemonNotRunning("当前平台不支持 Unix socket")
+    path = path or socket_path()
+    _check_owner(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(_CONNECT_TIMEOUT_S)
+        try:
+            sock.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout) as e:
+            raise DaemonNotRunning(f"{path}: {e}") from e
+        # 生成可能持续数分钟：连接建立后不再设超时
+        sock.settimeout(None)
+        sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        line = _read_line(sock)
+    finally:
+        sock.close()
+    if not line:
+        raise RuntimeError("CLI 常驻进程在返回结果前断开了连接")
+    return json.loads(line)
+
+
+def daemon_running(path: Optional[Path] = None) -> bool:
+    try:
+        return bool(request({"op": "status"}, path).get("ok"))
+    except (DaemonNotRunning, RuntimeError, ValueError, OSError):
+        return False
+
+
+# -------------------------
+# 常驻进程
+# -------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self) -> None:
+        try:
+            message = json.loads(self.rfile.readline() or b"null")
+            if not isinstance(message, dict):
+                raise ValueError("请求必须是一个 JSON object")
+            response = self.server.daemon.dispatch(message, self.connection)
+        except Exception as e:
+            response = {"ok": False, "error": str(e), "error_type": type(e).__name__}
+        try:
+            self.wfile.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # 客户端已断开
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path: str, daemon: "CliDaemon"):
+            self.daemon = daemon
+            super().__init__(path, _Handler)
+else:  # pragma: no cover - 无 AF_UNIX 的平台（Windows）
+    _Server = None  # type: ignore[assignment,misc]
+
+
+class CliDaemon:
+    """常驻进程：按 ComfyUI 地址各保持一个 AnimaExecutor，每个连接在独立线程中处理。"""
+
+    def __init__(self, path: Optional[Path] = None, comfyui_url: Optional[str] = None):
+        self.path = path or socket_path()
+        self.default_url = comfyui_url
+        self.started = time.time()
+        self._executors: Dict[str, "AnimaExecutor"] = {}
+        self._executors_lock = threading.Lock()
+        self._env = animatool_env()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._served = 0
+        self._server: Optional[Any] = None
+
+    def executor_for(self, comfyui_url: Optional[str]) -> "AnimaExecutor":
+        from executor import AnimaExecutor, AnimaToolConfig
+
+        key = comfyui_url or self.default_url or ""
+        with self._executors_lock:
+            executor = self._executors.get(key)
+            if executor is None:
+                config = AnimaToolConfig(comfyui_url=key) if key else AnimaToolConfig()
+                executor = AnimaExecutor(config=config)
+                executor.warmup()
+                self._executors[key] = executor
+            return executor
+
+    def dispatch(self, message: Dict[str, Any], conn: socket.socket) -> Dict[str, Any]:
+        op = message.get("op")
+        if op == "generate":
+            return {"ok": True, "result": self._generate(message, conn)}
+        if op == "status":
+            return {"ok": True, "result": self.status()}
+        if op == "stop":
+            # shutdown() 会等待 serve_forever 退出，不能在处理线程中直接调用
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True, "result": {"stopping": True}}
+        raise ValueError(f"未知的请求：{op!r}（可用：generate / status / stop）")
+
+    def _generate(self, message: Dict[str, Any], conn: socket.socket) -> Dict[str, Any]:
+        from executor import CancelToken
+
+        payload = message.get("payload")
+        if not isinstance(payload, dict):
+            raise ValueError("payload 必须是一个 JSON object")
+        env = message.get("env")
+        if env is not None and env != self._env:
+            changed = sorted(k for k in set(env) | set(self._env) if env.get(k) != self._env.get(k))
+            raise ConfigMismatch(f"配置环境变量与常驻进程不一致：{', '.join(changed)}（修改配置后需重启常驻进程）")
+        executor = self.executor_for(message.get("comfyui_url"))
+        token = CancelToken()
+        outcome: Dict[str, Any] = {}
+
+        def run() -> None:
+            try:
+                outcome["result"] = executor.generate(
+                    payload, priority=message.get("priority") or "batch", client="cli", cancel_token=token
+                )
+            except BaseException as e:
+                outcome["error"] = e
+
+        worker = threading.Thread(target=run, name="anima-cli-job", daemon=True)
+        with self._lock:
+            self._active += 1
+        try:
+            worker.start()
+            while worker.is_alive():
+                worker.join(0.5)
+                if worker.is_alive() and not token.cancelled and _peer_closed(conn):
+                    # 客户端已断开（Ctrl-C）：撤销 ComfyUI 中的任务，等工作线程清理完
+                    token.cancel("CLI 客户端已断开")
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._served += 1
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "socket": str(self.path),
+                "uptime_s": round(time.time() - self.started, 1),
+                "comfyui_urls": [url or "(default)" for url in list(self._executors)],
+                "active": self._active,
+                "served": self._served,
+            }
+
+    def _claim_socket(self) -> None:
+        if self.path.exists() or self.path.is_symlink():
+            try:
+                _check_owner(self.path)
+            except PermissionError as e:
+                raise RuntimeError(str(e)) from e
+            if daemon_running(self.path):
+                raise RuntimeError(f"CLI 常驻进程已在运行：{self.path}")
+            # 上次异常退出留下的 socket 文件
+            self.path.unlink()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def serve_forever(self) -> None:
+        if _Server is None:
+            raise RuntimeError("当前平台不支持 Unix socket，无法启动 CLI 常驻进程")
+        self._claim_socket()
+        # 先建好默认执行器：第一个请求无需再等初始化
+        self.executor_for(None)
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _Server(str(self.path), self)
+        finally:
+            os.umask(old_umask)
+        print(f"[ComfyUI-AnimaTool] CLI daemon listening on {self.path} (pid {os.getpid()})", file=sys.stderr)
+        try:
+            self._server.serve_forever(poll_interval=0.5)
+        finally:
+            self._server.server_close()
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+            with self._executors_lock:
+                executors = list(self._executors.values())
+            for executor in executors:
+                try:
+                    executor.history.close()
+                except Exception as e:
+                    # 一个执行器关闭失败不影响其余执行器写完历史
+                    print(f"[ComfyUI-AnimaTool] Failed to close history: {e}", file=sys.stderr)
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def _peer_closed(conn: socket.socket) -> bool:
+    """客户端是否已关闭连接（请求行之后客户端不再发送数据，可读即意味着 EOF）"""
+    try:
+        readable, _, _ = select.select([conn], [], [], 0)
+        if not readable:
+            return False
+        return conn.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
@@ -9,7 +9,7 @@ from __future__ import annotations
 import json
 import sys
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Literal, Optional
 
 # 确保能 import 上层 executor
 _PARENT = Path(__file__).resolve().parent.parent
@@ -18,21 +18,56 @@ if str(_PARENT) not in sys.path:
 
 from copy import deepcopy
 
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel, Field
 
-from executor import AnimaExecutor, AnimaToolConfig
+from executor import (
+    AnimaExecutor,
+    AnimaToolConfig,
+    BackendUnavailableError,
+    CancelToken,
+    IdempotencyConflictError,
+    JobCancelledError,
+    PromptValidationError,
+    ThrottledError,
+    attach_image_urls,
+    client_identity,
+    request_fingerprint,
+    request_scope,
+    run_cancellable,
+)
 
 
 class GenerateRequest(BaseModel):
     # 允许任意字段（由 tool schema 约束；服务端只做最小校验）
     payload: Dict[str, Any] = Field(default_factory=dict)
+    include_base64: Optional[bool] = Field(default=None, description="是否内嵌 base64；图片也可经 image_url 二进制下载")
+    idempotency_key: Optional[str] = Field(default=None, description="幂等键：重试时传同一个值不会重复生成（也可用 Idempotency-Key 请求头）")
+    priority: Literal["interactive", "normal", "batch"] = Field(default="normal", description="排队优先级：interactive 插到批量任务之前")
 
 
 class RerollRequest(BaseModel):
     source: str = Field(..., description="历史记录引用：'last' 或历史 ID")
     overrides: Dict[str, Any] = Field(default_factory=dict, description="覆盖参数")
+    variation: bool = Field(default=False, description="变体模式：以历史图片为起点低 denoise 重采样（img2img）")
+    variation_strength: Optional[float] = Field(default=None, gt=0, le=1, description="变体 denoise，默认 0.45")
+    variation_image: int = Field(default=0, ge=0, description="以历史记录中的第几张图为起点")
+    include_base64: Optional[bool] = Field(default=None, description="是否内嵌 base64；图片也可经 image_url 二进制下载")
+    idempotency_key: Optional[str] = Field(default=None, description="幂等键：重试时传同一个值不会重复生成（也可用 Idempotency-Key 请求头）")
+    priority: Literal["interactive", "normal", "batch"] = Field(default="normal", description="排队优先级：interactive 插到批量任务之前")
+
+
+def _client_of(request: Request) -> str:
+    """请求方标识：X-API-Key / Authorization: Bearer，否则客户端 IP。"""
+    return client_identity(request.headers, request.client.host if request.client else None)
+
+
+def _repeat_of(params: Dict[str, Any]) -> int:
+    try:
+        return max(1, int(params.get("repeat") or 1))
+    except (TypeError, ValueError):
+        return 1
 
 
 def _read_text(path: Path) -> str:
@@ -53,8 +88,25 @@ def create_app() -> FastAPI:
 
     @app.get("/health")
     def health() -> Dict[str, Any]:
-        # 不做真实连通性探测（避免阻塞），只返回配置
-        return {"status": "ok", "comfyui_url": config.comfyui_url}
+        # 返回后台健康监控缓存的后端状态（不在请求中探测，避免阻塞）
+        return {
+            "status": "ok",
+            "comfyui_url": config.comfyui_url,
+            "backend": executor.health_status(),
+            "scheduler": executor.scheduler.stats(),
+            "admission": executor.admission.stats(),
+        }
+
+    @app.get("/jobs")
+    def jobs() -> Dict[str, Any]:
+        """排队中 / 执行中的任务及其预计排队等待（queue_wait_s）与完成时间（eta_s）。"""
+        items = executor.jobs()
+        return {"count": len(items), "jobs": items}
+
+    @app.get("/metrics")
+    def metrics() -> Response:
+        """Prometheus 文本格式的各阶段耗时直方图与任务计数。"""
+        return Response(content=executor.metrics_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
     @app.get("/schema")
     def schema() -> JSONResponse:
@@ -71,39 +123,159 @@ def create_app() -> FastAPI:
             "prompt_examples": _read_text(knowledge_dir / "prompt_examples.md"),
         }
 
-    def _generate_with_repeat(payload: Dict[str, Any]) -> list[Dict[str, Any]]:
+    def _generate_with_repeat(
+        payload: Dict[str, Any],
+        request: Request,
+        include_base64: Optional[bool] = None,
+        cancel_token: Optional[CancelToken] = None,
+        priority: str = "normal",
+        client: Optional[str] = None,
+    ) -> list[Dict[str, Any]]:
         """执行生成（支持 repeat 多次独立 queue 提交），返回结果列表。"""
         repeat = max(1, int(payload.pop("repeat", 1) or 1))
+        images_base = str(request.base_url).rstrip("/") + "/images"
         results = []
         for _ in range(repeat):
             run_params = deepcopy(payload)
             if "seed" not in payload or payload.get("seed") is None:
                 run_params.pop("seed", None)
-            results.append(executor.generate(run_params))
+            result = executor.generate(
+                run_params, include_base64=include_base64, cancel_token=cancel_token, priority=priority, client=client
+            )
+            results.append(attach_image_urls(result, images_base))
         return results
 
-    @app.post("/generate")
-    def generate(req: GenerateRequest) -> Dict[str, Any]:
-        payload = req.payload or {}
+    def _pack(results: list[Dict[str, Any]]) -> Dict[str, Any]:
+        # 单次兼容旧接口，多次返回数组
+        if len(results) == 1:
+            return results[0]
+        return {"success": True, "results": results}
+
+    def _run_idempotent(key: Optional[str], fingerprint: str, fn) -> Dict[str, Any]:
+        """按幂等键执行一次请求，并把异常映射为 HTTP 错误。"""
         try:
-            results = _generate_with_repeat(payload)
-            # 单次兼容旧接口，多次返回数组
-            if len(results) == 1:
-                return results[0]
-            return {"success": True, "results": results}
+            return executor.idempotency.run(key, fingerprint, fn)
+        except HTTPException:
+            raise
+        except IdempotencyConflictError as e:
+            raise HTTPException(status_code=409, detail=str(e)) from e
+        except BackendUnavailableError as e:
+            # 熔断中：立即返回 503，而不是让每个请求等到超时
+            raise HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after_s)))}
+            ) from e
+        except JobCancelledError as e:
+            # 499：客户端已断开（nginx 约定），响应不会被读取，只用于访问日志
+            raise HTTPException(status_code=499, detail=str(e)) from e
+        except PromptValidationError as e:
+            raise HTTPException(status_code=400, detail={"error": str(e), "errors": e.errors}) from e
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) from e
 
+    async def _run_request(
+        key: Optional[str], fingerprint: str, request: Request, fn, cost: int = 1
+    ) -> Dict[str, Any]:
+        """按客户端准入后，在工作线程中执行 fn(cancel_token, client)；客户端断开时撤销 ComfyUI 中的任务。
+
+        超出该客户端的并发 / 速率限制时立即返回 429（附限流说明与 Retry-After）。
+        带幂等键的请求不随断开取消：客户端重试时会挂回同一个任务上取结果。
+        """
+        client = _client_of(request)
+        try:
+            executor.admission.acquire(client, cost)
+        except ThrottledError as e:
+            raise HTTPException(
+                status_code=429,
+                detail={"error": str(e), "throttle": e.info},
+                headers={"Retry-After": str(max(1, round(e.retry_after_s)))},
+            ) from e
+        try:
+            # X-Request-ID 随 to_thread 带到工作线程，剖析钩子 / trace 据此关联 prompt_id
+            with request_scope(request.headers.get("X-Request-ID")):
+                return await run_cancellable(
+                    lambda token: _run_idempotent(key, fingerprint, lambda: fn(token, client)),
+                    is_disconnected=None if key else request.is_disconnected,
+                )
+        finally:
+            executor.admission.release(client)
+
+    @app.post("/generate")
+    async def generate(
+        req: GenerateRequest,
+        request: Request,
+        idempotency_key: Optional[str] = Header(default=None),
+    ) -> Dict[str, Any]:
+        payload = req.payload or {}
+        return await _run_request(
+            req.idempotency_key or idempotency_key,
+            request_fingerprint("generate", payload, req.include_base64),
+            request,
+            lambda token, client: _pack(
+                _generate_with_repeat(payload, request, req.include_base64, token, req.priority, client)
+            ),
+            cost=_repeat_of(payload),
+        )
+
     @app.get("/history")
-    def history(limit: int = Query(default=5, ge=1, le=50)) -> Dict[str, Any]:
-        records = executor.history.list_recent(limit)
+    def history(
+        limit: int = Query(default=5, ge=1, le=50),
+        q: Optional[str] = Query(default=None, description="tag / 画师 / 角色检索：逗号为 AND，| 为 OR"),
+        width: Optional[int] = Query(default=None),
+        height: Optional[int] = Query(default=None),
+        since: Optional[str] = Query(default=None, description="ISO 日期 / 时间前缀（包含）"),
+        until: Optional[str] = Query(default=None, description="ISO 日期 / 时间前缀（包含）"),
+    ) -> Dict[str, Any]:
+        if q or width or height or since or until:
+            records = executor.history.search(
+                q or "", width=width, height=height, since=since, until=until, limit=limit
+            )
+        else:
+            records = executor.history.list_recent(limit)
         return {
             "count": len(records),
             "records": [r.to_dict() for r in records],
         }
 
+    @app.get("/images/{history_id}/{index}")
+    def image_file(history_id: int, index: int, request: Request) -> Response:
+        """以二进制流返回已保存的图片（支持 ETag / Last-Modified / Range）。"""
+        path = executor.get_history_image_path(history_id, index)
+        if path is None:
+            raise HTTPException(status_code=404, detail=f"图片不存在：#{history_id}/{index}")
+
+        st = path.stat()
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        # 同一 URL 的图片可能被覆盖（例如同名输出），每次按 ETag 重新校验
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=executor._get_mime_type(path.name), headers=headers)
+
     @app.post("/reroll")
-    def reroll(req: RerollRequest) -> Dict[str, Any]:
+    async def reroll(
+        req: RerollRequest,
+        request: Request,
+        idempotency_key: Optional[str] = Header(default=None),
+    ) -> Dict[str, Any]:
+        # 指纹基于请求本身（而非解析后的历史参数）：重试时 "last" 可能已指向新记录
+        fingerprint = request_fingerprint(
+            "reroll", req.source, req.overrides, req.variation,
+            req.variation_strength, req.variation_image, req.include_base64,
+        )
+        return await _run_request(
+            req.idempotency_key or idempotency_key,
+            fingerprint,
+            request,
+            lambda token, client: _reroll(req, request, token, client),
+            cost=_repeat_of(req.overrides or {}),
+        )
+
+    def _reroll(
+        req: RerollRequest,
+        request: Request,
+        cancel_token: Optional[CancelToken] = None,
+        client: Optional[str] = None,
+    ) -> Dict[str, Any]:
         record = executor.history.get(req.source)
         if record is None:
             raise HTTPException(status_code=404, detail=f"未找到历史记录：{req.source}")
@@ -116,13 +288,15 @@ def create_app() -> FastAPI:
         if "seed" not in req.overrides or req.overrides.get("seed") is None:
             merged.pop("seed", None)
 
-        try:
-            results = _generate_with_repeat(merged)
-            if len(results) == 1:
-                return results[0]
-            return {"success": True, "results": results}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e)) from e
+        if req.variation:
+            try:
+                merged = executor.prepare_variation(
+                    merged, record, strength=req.variation_strength, image_index=req.variation_image
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e)) from e
+
+        return _pack(_generate_with_repeat(merged, request, req.include_base64, cancel_token, req.priority, client))
 
     return app
 
@@ -7,15 +7,21 @@ Anima Tool MCP Server
     python -m servers.mcp_server
 
 或在 Cursor 配置中添加此 MCP Server。
+
+MCP 客户端每个会话启动一次本进程，握手超时往往较短：模块导入时只做应答 initialize / list_tools
+所需的最少工作，executor 包的导入与 AnimaExecutor 的构建（workflow 模板、历史窗口、耗时模型）
+在首次 list_tools 之后于后台线程预热，首次调用工具时若尚未完成则等待其完成。
 """
 from __future__ import annotations
 
 import asyncio
 import base64
+import functools
 import json
 import sys
+import threading
 from pathlib import Path
-from typing import Any, Dict, Sequence
+from typing import TYPE_CHECKING, Any, Dict, Sequence
 
 # 确保能 import 上层 executor
 _PARENT = Path(__file__).resolve().parent.parent
@@ -31,23 +37,58 @@ from mcp.types import (
     CallToolResult,
 )
 
-from executor import AnimaExecutor, AnimaToolConfig
+if TYPE_CHECKING:
+    from executor import AnimaExecutor
 
 
 # 创建 MCP Server
 server = Server("anima-tool")
 
-# 全局 executor（懒加载）
-_executor: AnimaExecutor | None = None
+# 全局 executor（懒加载；握手完成后在后台线程预热）
+_executor: "AnimaExecutor | None" = None
+_executor_lock = threading.Lock()
+_warmup_started = False
 
 
-def get_executor() -> AnimaExecutor:
+def get_executor() -> "AnimaExecutor":
     global _executor
     if _executor is None:
-        _executor = AnimaExecutor(config=AnimaToolConfig())
+        with _executor_lock:
+            if _executor is None:
+                from executor import AnimaExecutor, AnimaToolConfig
+
+                config = AnimaToolConfig()
+                if config.thumbnail_size is None:
+                    # MCP 客户端默认只接收缩略图，原图保留在磁盘上并以链接给出
+                    config.thumbnail_size = 768
+                _executor = AnimaExecutor(config=config)
     return _executor
 
 
+def _warmup() -> None:
+    """后台预热：构建执行器，并从历史记录加载耗时模型（否则推迟到首次生成）。"""
+    try:
+        get_executor().warmup()
+    except Exception as e:
+        # 预热失败不影响服务；首次调用工具时会重试并把错误返回给客户端
+        print(f"[ComfyUI-AnimaTool] MCP warmup failed: {e}", file=sys.stderr)
+
+
+def _start_warmup() -> None:
+    # 不在进程启动时就开始：预热线程与握手争用 GIL / 导入锁，反而推迟 initialize 的响应
+    global _warmup_started
+    if not _warmup_started:
+        _warmup_started = True
+        threading.Thread(target=_warmup, name="anima-mcp-warmup", daemon=True).start()
+
+
+async def _get_executor_async() -> "AnimaExecutor":
+    """在事件循环中取执行器：尚未构建完成时在工作线程中等待，不阻塞其他请求。"""
+    if _executor is not None:
+        return _executor
+    return await asyncio.to_thread(get_executor)
+
+
 # Tool Schema（从 tool_schema_universal.json 简化）
 TOOL_SCHEMA = {
     "type": "object",
@@ -104,6 +145,15 @@ TOOL_SCHEMA = {
             "description": "可选：单任务内的 batch size。默认 1。",
             "default": 1, "minimum": 1, "maximum": 4,
         },
+        "contact_sheet": {
+            "type": "boolean",
+            "description": "可选：把本次所有结果拼成一张带标签（历史 ID / seed）的拼图返回，原图仍保存在磁盘。适合 repeat 较大的探索性批量。默认 false。",
+            "default": False,
+        },
+        "idempotency_key": {
+            "type": "string",
+            "description": "可选：幂等键。因超时重试同一请求时传相同的值，不会重复生成（执行中则等待原任务，已完成则直接返回结果）。",
+        },
         "loras": {
             "type": "array",
             "description": "可选：LoRA 列表。name 须匹配 list_anima_models(model_type=loras) 返回值。",
@@ -154,6 +204,17 @@ LIST_HISTORY_SCHEMA = {
             "description": "返回最近几条历史记录（默认 5）",
             "default": 5, "minimum": 1, "maximum": 50,
         },
+        "query": {
+            "type": "string",
+            "description": (
+                "可选：按 tag / 画师 / 角色检索。逗号分隔表示同时满足（AND），| 分隔表示任一满足（OR），"
+                "如 \"@fkey, rain | snow\"。不填则返回最近记录。"
+            ),
+        },
+        "width": {"type": "integer", "description": "可选：只返回该宽度的记录"},
+        "height": {"type": "integer", "description": "可选：只返回该高度的记录"},
+        "since": {"type": "string", "description": "可选：起始日期 / 时间（ISO 前缀，如 2026-10-01，包含）"},
+        "until": {"type": "string", "description": "可选：截止日期 / 时间（ISO 前缀，包含）"},
     },
 }
 
@@ -162,33 +223,53 @@ LIST_HISTORY_SCHEMA = {
 # 关键：需要把原 generate 中"必选"的描述改为"可选覆盖"，否则 AI 会自动填入
 def _build_reroll_override_props() -> dict:
     """复制 generate schema 的属性，但将描述中的'必选'改为'可选覆盖'。"""
-    import copy
-    props = copy.deepcopy(TOOL_SCHEMA["properties"])
-    for _k, _v in props.items():
+    props = {}
+    for _k, _v in TOOL_SCHEMA["properties"].items():
         desc = _v.get("description", "")
         if desc.startswith("必选："):
-            _v["description"] = "可选覆盖（不提供则沿用历史记录）：" + desc[3:]
+            # 只有描述不同：浅拷贝这一项即可（schema 只读，不会被修改）
+            _v = dict(_v, description="可选覆盖（不提供则沿用历史记录）：" + desc[3:])
+        props[_k] = _v
     return props
 
 
-_REROLL_OVERRIDE_PROPS = _build_reroll_override_props()
-REROLL_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "source": {
-            "type": "string",
-            "description": "必选：要 reroll 的基础记录。'last' 表示最近一条，或使用历史 ID（如 '12'）。",
+@functools.lru_cache(maxsize=None)
+def _reroll_schema() -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "source": {
+                "type": "string",
+                "description": "必选：要 reroll 的基础记录。'last' 表示最近一条，或使用历史 ID（如 '12'）。",
+            },
+            "variation": {
+                "type": "boolean",
+                "description": (
+                    "可选：变体模式。以历史记录的图片为起点做小幅变化（img2img，低 denoise、更少步数），"
+                    "比完整重新生成快得多。适合“保持构图，换点细节”。默认 false。"
+                ),
+                "default": False,
+            },
+            "variation_strength": {
+                "type": "number",
+                "description": "可选：变体强度（即 denoise，0~1，越小越接近原图），默认 0.45。",
+                "minimum": 0.05, "maximum": 1.0,
+            },
+            "variation_image": {
+                "type": "integer",
+                "description": "可选：以历史记录中的第几张图为起点（从 0 开始，默认 0）。",
+                "default": 0, "minimum": 0,
+            },
+            **_build_reroll_override_props(),
         },
-        **_REROLL_OVERRIDE_PROPS,
-    },
-    "required": ["source"],
-}
+        "required": ["source"],
+    }
 
 
-@server.list_tools()
-async def list_tools() -> list[Tool]:
-    """列出可用工具"""
-    return [
+@functools.lru_cache(maxsize=None)
+def _tools() -> tuple:
+    """工具列表（首次 list_tools 时构建一次）"""
+    return (
         Tool(
             name="generate_anima_image",
             description=(
@@ -210,7 +291,7 @@ async def list_tools() -> list[Tool]:
         Tool(
             name="list_anima_history",
             description=(
-                "查看最近的图片生成历史记录。"
+                "查看最近的图片生成历史记录，或按 tag / 画师 / 角色、尺寸、日期检索历史。"
                 "返回每条记录的 ID、时间、画师、标签、种子等摘要信息。"
                 "用于在 reroll 之前确认要引用哪条历史。"
             ),
@@ -223,24 +304,91 @@ async def list_tools() -> list[Tool]:
                 "如果不提供覆盖参数，则完全沿用历史记录（seed 默认除外）。"
                 "seed 默认自动随机（出不同画面），也可手动指定保持一致。"
                 "支持 repeat 参数一次提交多个独立任务。"
+                "variation=true 时以历史图片为起点做小幅变化（img2img），速度更快。"
             ),
-            inputSchema=REROLL_SCHEMA,
+            inputSchema=_reroll_schema(),
         ),
+    )
+
+
+@server.list_tools()
+async def list_tools() -> list[Tool]:
+    """列出可用工具（客户端握手后的第一个请求：响应发出后开始预热执行器）"""
+    asyncio.get_running_loop().call_soon(_start_warmup)
+    return list(_tools())
+
+
+def _image_source(img: Dict[str, Any]) -> Any:
+    """拼图的 tile 来源：优先原图路径，其次内嵌的缩略图 / 原图 bytes。"""
+    if img.get("file_path"):
+        return img["file_path"]
+    thumb = img.get("thumbnail") or {}
+    b64 = thumb.get("base64") or img.get("base64")
+    return base64.b64decode(b64) if b64 else None
+
+
+async def _build_contact_sheet(
+    executor: "AnimaExecutor",
+    entries: list[tuple[Dict[str, Any], Dict[str, Any]]],
+) -> list[TextContent | ImageContent]:
+    """把 (result, image) 列表拼成一张带标签的拼图（在进程池中计算，不阻塞事件循环）。"""
+    from datetime import datetime
+
+    from executor import imaging
+
+    tiles = []
+    lines = []
+    for result, img in entries:
+        source = _image_source(img)
+        if source is None:
+            continue
+        label = f"#{result.get('history_id')} seed:{result.get('seed')}"
+        tiles.append((source, label))
+        lines.append(f"- {label} → {img.get('file_path') or img.get('view_url') or img['filename']}")
+    if not tiles:
+        return []
+
+    out_dir = Path(executor.config.output_dir) / "contact_sheets"
+    dst = out_dir / f"sheet_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.webp"
+    loop = asyncio.get_running_loop()
+    sheet = await loop.run_in_executor(
+        imaging.get_pool(int(executor.config.postprocess_workers)),
+        imaging.make_contact_sheet,
+        tiles,
+        str(dst) if executor.config.download_images else None,
+        int(executor.config.contact_sheet_size),
+        "webp",
+        int(executor.config.output_quality),
+    )
+    text = f"拼图共 {len(tiles)} 张（{sheet.get('file_path') or '未保存'}），原图：\n" + "\n".join(lines)
+    return [
+        ImageContent(type="image", data=base64.b64encode(sheet["content"]).decode("ascii"), mimeType=sheet["mime_type"]),
+        TextContent(type="text", text=text),
     ]
 
 
 async def _generate_with_repeat(
     executor: "AnimaExecutor",
     prompt_json: Dict[str, Any],
+    client: str = "mcp",
 ) -> list[TextContent | ImageContent]:
     """执行生成（支持 repeat 多次独立 queue 提交），返回 MCP 内容列表。"""
     from copy import deepcopy
 
+    from executor import imaging, run_cancellable
+
     repeat = max(1, int(prompt_json.pop("repeat", 1) or 1))
+    contact_sheet = bool(prompt_json.pop("contact_sheet", False)) and imaging.pillow_available()
     # batch_size 留在 prompt_json 中，由 executor._inject() 处理
 
     all_contents: list[TextContent | ImageContent] = []
     history_ids: list[int] = []
+    full_links: list[str] = []
+    sheet_entries: list[tuple[Dict[str, Any], Dict[str, Any]]] = []
+    # 有缩略图（或拼图可直接读原图文件）时不再内嵌原图 base64；否则总是内嵌：
+    # MCP 只能内联显示图片，不能跟随 config.embed_base64（那是给 HTTP 客户端的默认值）
+    use_thumbnails = executor.thumbnails_enabled()
+    include_base64 = not (use_thumbnails or (contact_sheet and executor.config.download_images))
 
     for i in range(repeat):
         run_params = deepcopy(prompt_json)
@@ -248,7 +396,13 @@ async def _generate_with_repeat(
         if "seed" not in prompt_json or prompt_json.get("seed") is None:
             run_params.pop("seed", None)
 
-        result = await asyncio.to_thread(executor.generate, run_params)
+        # 客户端取消请求（notifications/cancelled）时撤销 ComfyUI 中排队 / 执行中的任务；
+        # MCP 调用来自在线用户，按 interactive 优先级排在批量任务之前
+        result = await run_cancellable(
+            lambda token: executor.generate(
+                run_params, include_base64=include_base64, cancel_token=token, priority="interactive", client=client
+            )
+        )
 
         if not result.get("success"):
             all_contents.append(TextContent(type="text", text=f"第 {i+1}/{repeat} 次生成失败: {result}"))
@@ -258,7 +412,20 @@ async def _generate_with_repeat(
             history_ids.append(result["history_id"])
 
         for img in result.get("images", []):
-            if img.get("base64") and img.get("mime_type"):
+            if contact_sheet:
+                sheet_entries.append((result, img))
+                continue
+            thumb = img.get("thumbnail") or {}
+            if thumb.get("base64"):
+                all_contents.append(
+                    ImageContent(
+                        type="image",
+                        data=thumb["base64"],
+                        mimeType=thumb["mime_type"],
+                    )
+                )
+                full_links.append(img.get("file_path") or img.get("view_url") or img["filename"])
+            elif img.get("base64") and img.get("mime_type"):
                 all_contents.append(
                     ImageContent(
                         type="image",
@@ -266,10 +433,20 @@ async def _generate_with_repeat(
                         mimeType=img["mime_type"],
                     )
                 )
+            elif use_thumbnails:
+                # 缩略图生成失败：至少给出原图位置
+                full_links.append(img.get("file_path") or img.get("view_url") or img["filename"])
+
+    if sheet_entries:
+        all_contents.extend(await _build_contact_sheet(executor, sheet_entries))
 
     if not all_contents:
         all_contents.append(TextContent(type="text", text="生成完成，但没有产出图片。"))
 
+    if full_links:
+        links = "\n".join(f"- {link}" for link in full_links)
+        all_contents.append(TextContent(type="text", text=f"以上为缩略图，原图：\n{links}"))
+
     # 追加历史 ID 提示，让 AI 自然知道可以 reroll
     if history_ids:
         ids_str = ", ".join(f"#{hid}" for hid in history_ids)
@@ -279,11 +456,63 @@ async def _generate_with_repeat(
     return all_contents
 
 
+async def _reroll(
+    executor: "AnimaExecutor", args: Dict[str, Any], client: str = "mcp"
+) -> list[TextContent | ImageContent]:
+    """reroll：取历史记录参数，用覆盖项更新后重新生成。"""
+    source = str(args.pop("source", "")).strip()
+    variation = bool(args.pop("variation", False))
+    variation_strength = args.pop("variation_strength", None)
+    variation_image = int(args.pop("variation_image", None) or 0)
+    if not source:
+        return [TextContent(type="text", text="参数错误：source 不能为空（使用 'last' 或历史 ID）")]
+
+    record = executor.history.get(source)
+    if record is None:
+        return [TextContent(type="text", text=f"未找到历史记录：{source}。请先使用 list_anima_history 查看可用记录。")]
+
+    # 深拷贝原始参数，用覆盖项更新
+    from copy import deepcopy
+    merged = deepcopy(record.params)
+    overrides = {k: v for k, v in args.items() if v is not None}
+    merged.update(overrides)
+
+    # seed 默认行为：未显式指定则自动随机（删掉原 seed）
+    if "seed" not in args or args.get("seed") is None:
+        merged.pop("seed", None)
+
+    if variation:
+        merged = await asyncio.to_thread(
+            executor.prepare_variation, merged, record,
+            strength=variation_strength, image_index=variation_image,
+        )
+
+    return await _generate_with_repeat(executor, merged, client)
+
+
+def _session_client() -> str:
+    """当前 MCP 会话的客户端标识（取不到请求上下文时退回 "mcp"）。"""
+    try:
+        return f"mcp:{id(server.request_context.session):x}"
+    except Exception:
+        return "mcp"
+
+
+def _request_id() -> str | None:
+    """当前 MCP 请求的 JSON-RPC id（取不到时由 request_scope 生成）。"""
+    try:
+        return f"mcp-{server.request_context.request_id}"
+    except Exception:
+        return None
+
+
 @server.call_tool()
 async def call_tool(name: str, arguments: Dict[str, Any]) -> Sequence[TextContent | ImageContent]:
     """调用工具"""
+    from executor import request_fingerprint, request_scope
+
     try:
-        executor = get_executor()
+        executor = await _get_executor_async()
         args = dict(arguments or {})
 
         # ---- list_anima_models ----
@@ -297,37 +526,35 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> Sequence[TextConten
         # ---- list_anima_history ----
         if name == "list_anima_history":
             limit = int(args.get("limit") or 5)
-            records = executor.history.list_recent(limit)
+            filters = {k: args.get(k) for k in ("width", "height", "since", "until") if args.get(k)}
+            query = str(args.get("query") or "").strip()
+            if query or filters:
+                records = await asyncio.to_thread(executor.history.search, query, limit=limit, **filters)
+                if not records:
+                    return [TextContent(type="text", text=f"没有符合条件的历史记录：{query or filters}")]
+            else:
+                records = executor.history.list_recent(limit)
             if not records:
                 return [TextContent(type="text", text="暂无生成历史。")]
             lines = [r.summary() for r in records]
             return [TextContent(type="text", text="\n".join(lines))]
 
-        # ---- reroll_anima_image ----
-        if name == "reroll_anima_image":
-            source = str(args.pop("source", "")).strip()
-            if not source:
-                return [TextContent(type="text", text="参数错误：source 不能为空（使用 'last' 或历史 ID）")]
-
-            record = executor.history.get(source)
-            if record is None:
-                return [TextContent(type="text", text=f"未找到历史记录：{source}。请先使用 list_anima_history 查看可用记录。")]
-
-            # 深拷贝原始参数，用覆盖项更新
-            from copy import deepcopy
-            merged = deepcopy(record.params)
-            overrides = {k: v for k, v in args.items() if v is not None}
-            merged.update(overrides)
-
-            # seed 默认行为：未显式指定则自动随机（删掉原 seed）
-            if "seed" not in args or args.get("seed") is None:
-                merged.pop("seed", None)
-
-            return await _generate_with_repeat(executor, merged)
-
-        # ---- generate_anima_image ----
-        if name == "generate_anima_image":
-            return await _generate_with_repeat(executor, args)
+        # ---- generate_anima_image / reroll_anima_image ----
+        if name in ("generate_anima_image", "reroll_anima_image"):
+            # 重试时传同一个 idempotency_key：挂到执行中的任务，或直接返回上次的结果
+            idempotency_key = str(args.pop("idempotency_key", None) or "").strip() or None
+            run = _reroll if name == "reroll_anima_image" else _generate_with_repeat
+            # 按 MCP 会话限制并发 / 速率，并参与公平排队
+            client = _session_client()
+            try:
+                cost = max(1, int(args.get("repeat") or 1))
+            except (TypeError, ValueError):
+                cost = 1
+            # JSON-RPC 请求 id 作为 request_id，剖析钩子 / trace 据此关联 prompt_id
+            with executor.admission.admit(client, cost), request_scope(_request_id()):
+                return await executor.idempotency.run_async(
+                    idempotency_key, request_fingerprint(name, args), lambda: run(executor, args, client)
+                )
 
         return [TextContent(type="text", text=f"未知工具: {name}")]
 
@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def executor(tmp_path):
+    """不连接 ComfyUI 的 AnimaExecutor，历史写到临时目录"""
+    from executor import AnimaExecutor, AnimaToolConfig
+
+    instance = AnimaExecutor(
+        config=AnimaToolConfig(
+            comfyui_url="http://127.0.0.1:1",
+            output_dir=tmp_path / "outputs",
+            history_dir=tmp_path,
+            poll_interval_s=0.02,
+        )
+    )
+    yield instance
+    instance.history.close()
+
+
+@pytest.fixture
+def fake_backend(executor, monkeypatch):
+    """让 executor.generate() 不经 ComfyUI 完成：提交返回固定 prompt_id，history 带执行起止时间、无图片"""
+    history_item = {
+        "outputs": {},
+        "status": {
+            "completed": True,
+            "messages": [
+                ["execution_start", {"prompt_id": "p1", "timestamp": 1_000_000}],
+                ["execution_success", {"prompt_id": "p1", "timestamp": 1_002_000}],
+            ],
+        },
+    }
+    monkeypatch.setattr(executor, "check_models", lambda: (True, ""))
+    monkeypatch.setattr(executor, "validate_prompt", lambda prompt: None)
+    monkeypatch.setattr(executor.health, "ensure_started", lambda: None)
+    monkeypatch.setattr(executor, "queue_prompt", lambda prompt, front=False: "p1")
+    monkeypatch.setattr(executor, "wait_history", lambda prompt_id, cancel_token=None, **kwargs: history_item)
+    return executor
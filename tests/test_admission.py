@@ -0,0 +1,15 @@
+import pytest
+
+from executor.admission import client_identity, hash_api_key
+
+
+def test_client_identity_prefers_api_key():
+    assert client_identity({"X-API-Key": " secret "}, "10.0.0.5") == hash_api_key("secret")
+    assert client_identity({"Authorization": "Bearer secret"}, "10.0.0.5") == hash_api_key("secret")
+    assert client_identity({"Authorization": "Basic abc"}, "10.0.0.5") == "ip:10.0.0.5"
+    assert client_identity(None, None) == "ip:unknown"
+
+
+def test_client_identity_case_insensitive_headers():
+    headers = pytest.importorskip("starlette.datastructures").Headers({"x-api-key": "secret"})
+    assert client_identity(headers, "10.0.0.5") == hash_api_key("secret")
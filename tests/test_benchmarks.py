@@ -0,0 +1,39 @@
+import json
+
+from benchmarks import micro
+from benchmarks.gen_history import generate_history
+from executor import anima_executor
+from executor.history import HistoryManager
+
+
+def test_generate_history_is_loadable_and_deterministic(tmp_path):
+    path = generate_history(tmp_path / "a" / "history.jsonl", 300, seed=1)
+    again = generate_history(tmp_path / "b" / "history.jsonl", 300, seed=1)
+    assert path.read_bytes() == again.read_bytes()
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == list(range(1, 301))
+    history = HistoryManager(path, maxlen=10)
+    try:
+        assert [r.id for r in history.list_recent(3)] == [300, 299, 298]
+        assert history.get("5").id == 5
+    finally:
+        history.close()
+
+
+def test_micro_smoke_run_and_compare(tmp_path, monkeypatch, capsys):
+    # isolate_history() 替换模块级工厂函数：测试结束后恢复
+    monkeypatch.setattr(anima_executor, "create_history_manager", anima_executor.create_history_manager)
+    output = tmp_path / "micro.json"
+    argv = [
+        "--min-time", "0", "--alloc-runs", "1", "--history-sizes", "200", "--image-sizes", "64x64",
+        "--filter", "inject loras=1,_extract_images images=4,base64 64x64 x1,history n=200",
+        "--output", str(output),
+    ]
+    micro.main(argv)
+    report = json.loads(output.read_text(encoding="utf-8"))
+    names = {r["name"] for r in report["results"]}
+    assert {"_inject loras=1", "_extract_images images=4", "history n=200 load", "history n=200 add"} <= names
+    assert all(r["calls"] >= 5 and r["median_us"] > 0 for r in report["results"])
+
+    micro.main(argv[:-1] + [str(tmp_path / "micro2.json"), "--compare", str(output)])
+    assert "history n=200 get last" in capsys.readouterr().out.split("对比", 1)[1]
@@ -0,0 +1,56 @@
+import pytest
+
+
+class FakeQueue:
+    """ComfyUI /queue 与 /interrupt：记录收到的请求"""
+
+    def __init__(self, running=(), pending=(), version="0.3.60"):
+        self.running = list(running)
+        self.pending = list(pending)
+        self.version = version
+        self.interrupted = []
+
+    def get_json(self, url, timeout=None):
+        if url.endswith("/system_stats"):
+            return {"system": {"comfyui_version": self.version}}
+        assert url.endswith("/queue")
+        return {
+            "queue_running": [[0, pid, {}, {}, []] for pid in self.running],
+            "queue_pending": [[1, pid, {}, {}, []] for pid in self.pending],
+        }
+
+    def post_json(self, url, payload, timeout=None, expect_json=True):
+        if url.endswith("/queue"):
+            self.pending = [pid for pid in self.pending if pid not in payload["delete"]]
+        elif url.endswith("/interrupt"):
+            self.interrupted.append(payload["prompt_id"])
+        return None
+
+
+@pytest.fixture
+def queue(executor, monkeypatch):
+    fake = FakeQueue(running=["running"], pending=["pending"])
+    monkeypatch.setattr(executor, "_http_get_json", fake.get_json)
+    monkeypatch.setattr(executor, "_http_post_json", fake.post_json)
+    return fake
+
+
+def test_cancel_job_outcomes(executor, queue):
+    assert executor.cancel_job("pending") == "deleted"
+    assert queue.pending == []
+    assert executor.cancel_job("running") == "interrupted"
+    assert queue.interrupted == ["running"]
+    assert executor.cancel_job("finished") == "not_found"
+
+
+def test_cancel_active_jobs_counts_deleted(executor, queue):
+    executor._active_prompts.update({"pending": 0.0, "running": 0.0, "finished": 0.0})
+    assert executor.cancel_active_jobs() == 2
+
+
+@pytest.mark.parametrize("version", ["0.3.10", "", "unknown"])
+def test_cancel_job_skips_untargeted_interrupt(executor, queue, version):
+    # 旧版（或版本未知）的 /interrupt 会中断当前任务，可能已是别人的任务：不发中断
+    queue.version = version
+    assert executor.cancel_job("running") == "running"
+    assert queue.interrupted == []
@@ -0,0 +1,81 @@
+import os
+import re
+import socket
+import threading
+import time
+
+import pytest
+
+from servers import cli_daemon
+from servers.cli_daemon import CliDaemon, ConfigMismatch
+
+
+def test_generate_refuses_different_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANIMATOOL_TIMEOUT", "600")
+    daemon = CliDaemon(tmp_path / "cli.sock")
+    env = dict(cli_daemon.animatool_env(), ANIMATOOL_TIMEOUT="30")
+    with pytest.raises(ConfigMismatch, match="ANIMATOOL_TIMEOUT"):
+        daemon.dispatch({"op": "generate", "payload": {}, "env": env}, None)
+
+
+
+def test_forwarded_env_covers_every_config_variable(monkeypatch):
+    import executor.config
+
+    with open(executor.config.__file__, encoding="utf-8") as f:
+        names = set(re.findall(r"\b(?:ANIMATOOL|COMFYUI)_[A-Z_]+\b", f.read()))
+    for name in names:
+        monkeypatch.setenv(name, "x")
+    assert names <= set(cli_daemon.animatool_env())
+
+
+def test_generate_refuses_different_comfyui_url(tmp_path, monkeypatch):
+    monkeypatch.setenv("COMFYUI_URL", "http://127.0.0.1:8188")
+    daemon = CliDaemon(tmp_path / "cli.sock")
+    env = dict(cli_daemon.animatool_env(), COMFYUI_URL="http://10.0.0.2:8188")
+    with pytest.raises(ConfigMismatch, match="COMFYUI_URL"):
+        daemon.dispatch({"op": "generate", "payload": {}, "env": env}, None)
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="需要 POSIX uid")
+def test_request_refuses_foreign_socket(tmp_path, monkeypatch):
+    path = tmp_path / "cli.sock"
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(1)
+    try:
+        monkeypatch.setattr(os, "getuid", lambda: os.stat(path).st_uid + 1)
+        with pytest.raises(PermissionError):
+            cli_daemon.request({"op": "status"}, path)
+        assert not cli_daemon.daemon_running(path)
+    finally:
+        server.close()
+
+
+@pytest.mark.skipif(not cli_daemon.unix_sockets_supported(), reason="需要 Unix socket")
+def test_shutdown_closes_sqlite_history(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANIMATOOL_HISTORY_BACKEND", "sqlite")
+    monkeypatch.setenv("ANIMATOOL_HISTORY_DIR", str(tmp_path / "history"))
+    monkeypatch.setenv("ANIMATOOL_HEALTH_INTERVAL", "0")
+    path = tmp_path / "cli.sock"
+    daemon = CliDaemon(path, comfyui_url="http://127.0.0.1:1")
+    errors = []
+
+    def serve():
+        try:
+            daemon.serve_forever()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not cli_daemon.daemon_running(path):
+        assert time.time() < deadline and thread.is_alive(), errors
+        time.sleep(0.05)
+    assert cli_daemon.request({"op": "stop"}, path)["ok"]
+    thread.join(10)
+    assert not thread.is_alive()
+    assert errors == []
+    assert not path.exists()
+    assert (tmp_path / "history" / "history.sqlite3").exists()
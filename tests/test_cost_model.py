@@ -0,0 +1,53 @@
+import pytest
+
+from executor.cost_model import CostModel, execution_seconds, job_features
+
+
+def test_prior_used_without_samples():
+    model = CostModel()
+    seconds, confident = model.predict("http://comfy|anima.safetensors", {"units": 4.0, "loras": 1})
+    assert seconds == pytest.approx(1.0 + 0.25 * 4.0 + 0.0125 * 4.0)
+    assert confident is False
+    assert model.predict("any", {"units": 0.0})[0] == pytest.approx(1.0)
+
+
+def test_converges_to_observed_seconds():
+    model = CostModel()
+    key = "http://comfy|anima.safetensors"
+    for i in range(60):
+        units = (2.0, 4.0, 8.0, 16.0)[i % 4]
+        model.observe(key, {"units": units, "loras": 0}, 3.0 + 0.5 * units)
+    seconds, confident = model.predict(key, {"units": 10.0, "loras": 0})
+    assert seconds == pytest.approx(8.0, rel=0.05)
+    assert confident is True
+    # 其他 (后端, 模型) 仍使用先验
+    assert model.predict("other|model", {"units": 10.0})[1] is False
+    assert model.stats()[key]["samples"] > 5
+
+
+def test_ignores_invalid_samples():
+    model = CostModel()
+    model.observe("k", {"units": 1.0}, 0)
+    model.observe("k", {"units": 1.0}, None)
+    assert model.stats() == {}
+
+
+def test_features_from_injected_workflow(executor):
+    prompt = executor._inject({"tags": "1girl", "width": 1024, "height": 1024, "steps": 20, "batch_size": 2})
+    features = job_features(prompt)
+    assert (features["width"], features["height"], features["steps"], features["batch"]) == (1024, 1024, 20, 2)
+    assert features["units"] == pytest.approx(1024 * 1024 / 1e6 * 20 * 2, abs=1e-3)
+
+
+def test_execution_seconds_from_status_messages():
+    item = {
+        "status": {
+            "messages": [
+                ["execution_start", {"prompt_id": "p", "timestamp": 1_000_000}],
+                ["execution_cached", {"nodes": [], "timestamp": 1_000_100}],
+                ["execution_success", {"prompt_id": "p", "timestamp": 1_012_500}],
+            ]
+        }
+    }
+    assert execution_seconds(item) == pytest.approx(12.5)
+    assert execution_seconds({"status": {"messages": []}}) is None
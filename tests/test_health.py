@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from executor.health import CLOSED, HALF_OPEN, OPEN, BackendUnavailableError, CircuitBreaker, HealthMonitor
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout_s=30.0)
+    for _ in range(2):
+        breaker.record_failure("connection refused")
+    breaker.before_request()
+    breaker.record_failure("connection refused")
+    assert breaker.state == OPEN
+    with pytest.raises(BackendUnavailableError) as e:
+        breaker.before_request()
+    assert 0 < e.value.retry_after_s <= 30.0
+    assert "connection refused" in str(e.value)
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.last_error == ""
+
+
+def test_half_open_probe_backs_off_then_recovers():
+    results = [(False, "still down"), (True, "ok")]
+    seen = []
+
+    def probe():
+        seen.append(breaker.state)
+        # 探测期间其他请求继续快速失败
+        with pytest.raises(BackendUnavailableError):
+            breaker.before_request()
+        return results.pop(0)
+
+    breaker = CircuitBreaker(probe, failure_threshold=1, reset_timeout_s=0.2, max_reset_timeout_s=1.0)
+    breaker.record_failure("timeout")
+    time.sleep(0.21)
+    with pytest.raises(BackendUnavailableError):
+        breaker.before_request()
+    assert breaker.state == OPEN and breaker.last_error == "still down"
+    assert 0.2 < breaker.retry_after() <= 0.4  # 冷却时间加倍
+    time.sleep(0.41)
+    breaker.before_request()
+    assert seen == [HALF_OPEN, HALF_OPEN]
+    assert breaker.state == CLOSED
+
+
+def test_raising_probe_reopens_breaker():
+    def probe():
+        raise RuntimeError("boom")
+
+    breaker = CircuitBreaker(probe, failure_threshold=1, reset_timeout_s=0.05)
+    breaker.record_failure("timeout")
+    time.sleep(0.06)
+    with pytest.raises(BackendUnavailableError):
+        breaker.before_request()
+    # 不会卡在 half-open：重新熔断并记录探测异常
+    assert breaker.state == OPEN and "boom" in breaker.last_error
+
+
+def test_monitor_trips_breaker_and_caches_status():
+    healthy = [False]
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout_s=30.0)
+    monitor = HealthMonitor(lambda: (healthy[0], "ok" if healthy[0] else "down"), breaker, interval_s=0.01)
+    monitor.ensure_started()
+    try:
+        deadline = time.time() + 2.0
+        while breaker.state != OPEN and time.time() < deadline:
+            time.sleep(0.01)
+        status = monitor.status()
+        assert status["healthy"] is False and status["breaker"] == OPEN
+        assert status["message"] == "down" and status["retry_after_s"] > 0
+        healthy[0] = True
+        deadline = time.time() + 2.0
+        while breaker.state != CLOSED and time.time() < deadline:
+            time.sleep(0.01)
+        status = monitor.status()
+        assert status["healthy"] is True and status["breaker"] == CLOSED
+        assert status["latency_ms"] is not None
+    finally:
+        monitor.stop()
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from executor.history import (
+    GenerationRecord,
+    HistoryManager,
+    _GroupCommitWriter,
+    _OffsetIndex,
+    iter_history_records,
+)
+
+
+def test_add_does_not_wait_for_batch_fsync(tmp_path, monkeypatch):
+    """写入线程 fsync 期间持有文件锁，add() 分配 id 不应等待它"""
+    history = HistoryManager(tmp_path / "history.jsonl", flush_interval_s=0.0, fsync="batch")
+    in_fsync = threading.Event()
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        in_fsync.set()
+        time.sleep(0.5)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    try:
+        first = history.add({"tags": "a"})
+        assert in_fsync.wait(2.0)
+        started = time.perf_counter()
+        second = history.add({"tags": "b"})
+        elapsed = time.perf_counter() - started
+        assert elapsed < 0.2
+        assert second.id == first.id + 1
+    finally:
+        history.close()
+    reopened = HistoryManager(tmp_path / "history.jsonl")
+    try:
+        assert [r.id for r in reopened.list_recent(10)] == [second.id, first.id]
+    finally:
+        reopened.close()
+
+
+def _record(record_id):
+    return GenerationRecord(id=record_id, timestamp="2026-10-01T00:00:00", params={"tags": f"t{record_id}"})
+
+
+def test_group_commit_batches_by_size_and_flush():
+    batches = []
+    writer = _GroupCommitWriter(lambda batch, fsync: batches.append(([r.id for r in batch], fsync)), 10.0, 4, "batch")
+    try:
+        for i in range(1, 11):
+            writer.submit(_record(i))
+        assert writer.flush(2.0)
+    finally:
+        writer.close()
+    # 满 max_batch 的批次立即写；flush() 不等 flush_interval_s 写完剩余的
+    assert [ids for ids, _fsync in batches] == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+    assert all(fsync for _ids, fsync in batches)
+
+
+def test_group_commit_close_writes_pending(tmp_path):
+    history = HistoryManager(tmp_path / "history.jsonl", flush_interval_s=10.0)
+    ids = [history.add({"tags": f"a{i}"}).id for i in range(3)]
+    assert not (tmp_path / "history.jsonl").exists()
+    history.close()
+    lines = (tmp_path / "history.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ids
+    with pytest.raises(ValueError):
+        HistoryManager(tmp_path / "other.jsonl", fsync="sometimes")
+
+
+def _write_lines(path, ids):
+    """追加记录行，返回 [(id, offset), ...]"""
+    entries = []
+    with path.open("ab") as f:
+        for record_id in ids:
+            entries.append((record_id, f.tell()))
+            f.write(json.dumps({"id": record_id, "timestamp": "2025-01-01T00:00:00", "params": {}}).encode() + b"\n")
+    return entries
+
+
+def test_offset_index_out_of_order_and_appends(tmp_path):
+    path = tmp_path / "history.jsonl"
+    offsets = dict(_write_lines(path, [1, 2, 5, 3, 4]))
+    index = _OffsetIndex(path)
+    assert {i: index.lookup(i) for i in range(1, 6)} == offsets
+    assert index.id_range() == (1, 5)
+    assert index.lookup(6) is None
+
+    # 其他进程追加后先 sync 再写索引条目
+    writer = _OffsetIndex(path)
+    writer.sync()
+    appended = _write_lines(path, [7, 6])
+    writer.append(appended)
+    offsets.update(appended)
+    assert index.id_range() == (1, 7)
+    assert {i: index.lookup(i) for i in range(1, 8)} == offsets
+
+
+def test_get_sees_records_from_other_instances(tmp_path):
+    ours = HistoryManager(tmp_path / "history.jsonl", maxlen=2)
+    other = HistoryManager(tmp_path / "history.jsonl", maxlen=2)
+    try:
+        first = [ours.add({"tags": f"a{i}"}).id for i in range(5)]
+        ours.flush()
+        assert other.get(str(first[0])).params == {"tags": "a0"}
+        later = [other.add({"tags": f"b{i}"}).id for i in range(5)]
+        other.flush()
+        assert ours.get(str(later[0])).params == {"tags": "b0"}
+        assert ours.get("999") is None
+    finally:
+        ours.close()
+        other.close()
+
+
+def test_search_index_is_maintained_incrementally(tmp_path, monkeypatch):
+    """首次检索后新增 / 其他实例写入 / 轮转的记录都能检索到，且不重建索引、不回退全文件查找"""
+    history = HistoryManager(tmp_path / "history.jsonl", maxlen=2, flush_interval_s=0.0)
+    other = HistoryManager(tmp_path / "history.jsonl", maxlen=2, flush_interval_s=0.0)
+    try:
+        old = [history.add({"tags": f"rain, a{i}"}).id for i in range(4)]
+        assert [r.id for r in history.search("rain", limit=10)] == old[::-1]
+        index = history._search_index
+
+        def no_fallback(record_id):
+            raise AssertionError(f"#{record_id} 应按登记的偏移直接读取")
+
+        monkeypatch.setattr(history, "_search_in_file", no_fallback)
+        monkeypatch.setattr(history, "iter_records", lambda: iter(()))
+
+        added = history.add({"tags": "snow"})
+        assert [r.id for r in history.search("snow")] == [added.id]
+
+        theirs = other.add({"tags": "snow, other"})
+        other.flush()
+        assert [r.id for r in history.search("other")] == [theirs.id]
+
+        history.rotate()
+        newer = [history.add({"tags": f"rain, b{i}"}).id for i in range(3)]
+        history.flush()
+        got = [r.id for r in history.search("rain", limit=10)]
+        assert got == newer[::-1] + old[::-1]
+        assert history.search("a0")[0].params == {"tags": "rain, a0"}
+        assert history._search_index is index
+    finally:
+        history.close()
+        other.close()
+
+
+def test_segments_rotate_by_size_and_compact(tmp_path):
+    history_file = tmp_path / "history.jsonl"
+    long_text = "masterpiece, best quality, " * 20
+    history = HistoryManager(
+        history_file, maxlen=2, flush_interval_s=0.0, segment_max_bytes=2048, compact_on_rotate=True
+    )
+    try:
+        ids = []
+        for i in range(12):
+            ids.append(history.add({"tags": f"a{i}"}, positive_text=long_text).id)
+            history.flush()
+        sealed = sorted(p for p in tmp_path.glob("history.*-*.jsonl"))
+        assert sealed
+        # 压缩段首行为字符串 / 参数表，重复的提示词只存一份
+        assert all(p.read_text(encoding="utf-8").startswith('{"__table__"') for p in sealed)
+        assert sum(p.read_text(encoding="utf-8").count(long_text) for p in sealed) == len(sealed)
+        assert [r.id for r in history.iter_records()] == ids
+        first = history.get(str(ids[0]))
+        assert first.params == {"tags": "a0"} and first.positive_text == long_text
+    finally:
+        history.close()
+    assert [r.id for r in iter_history_records(history_file)] == ids
+
+
+def test_segments_rotate_daily(tmp_path):
+    history_file = tmp_path / "history.jsonl"
+    history_file.write_text(json.dumps(_record(1).to_dict()) + "\n", encoding="utf-8")
+    history = HistoryManager(history_file, flush_interval_s=0.0, segment_period="daily")
+    try:
+        added = history.add({"tags": "today"})
+        history.flush()
+        assert (tmp_path / "history.00000001-00000001.jsonl").exists()
+        assert [r.id for r in history.iter_records()] == [1, added.id]
+        assert history.rotate() is not None
+        assert history.rotate() is None  # 活动段为空
+    finally:
+        history.close()
+    with pytest.raises(ValueError):
+        HistoryManager(tmp_path / "other.jsonl", segment_period="weekly")
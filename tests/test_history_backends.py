@@ -0,0 +1,38 @@
+import pytest
+
+from executor.history import create_history_manager
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_backends_share_api(backend, tmp_path):
+    history = create_history_manager(backend, maxlen=3, history_dir=tmp_path)
+    records = [
+        history.add({"artist": "@fkey", "tags": f"smile, tag{i}"}, prompt_id=f"p{i}", seed=i, width=832, height=1216)
+        for i in range(5)
+    ]
+    assert history.flush(5.0)
+    assert [r.id for r in records] == [1, 2, 3, 4, 5]
+    assert history.get("last").id == 5
+    assert history.get("#1").seed == 0
+    assert history.get("999") is None
+    assert [r.id for r in history.list_recent(2)] == [5, 4]
+    assert [r.id for r in history.search("tag1")] == [2]
+    assert [r.id for r in history.search("smile", limit=10)] == [5, 4, 3, 2, 1]
+    assert [r.id for r in history.iter_records()] == [1, 2, 3, 4, 5]
+
+    history.close()
+    history.close()  # 可重复调用
+    reopened = create_history_manager(backend, history_dir=tmp_path)
+    try:
+        assert reopened.get("last").id == 5
+    finally:
+        reopened.close()
+
+
+def test_sqlite_uses_history_dir(tmp_path):
+    manager = create_history_manager("sqlite", history_dir=tmp_path / "custom")
+    try:
+        manager.add({"tags": "a"})
+    finally:
+        manager.close()
+    assert (tmp_path / "custom" / "history.sqlite3").exists()
@@ -0,0 +1,44 @@
+from executor.history_search import HistoryIndex, extract_terms, normalize_term, parse_query
+
+
+def _index():
+    index = HistoryIndex()
+    index.add(1, {"tags": "1girl, (rain:1.2), umbrella", "artist": "@fkey"}, "2026-09-30T10:00:00", 832, 1216)
+    index.add(2, {"tags": "1girl, snow", "artist": "@fkey"}, "2026-10-01T09:00:00", 1024, 1024)
+    index.add(3, {"tags": "1boy, snow", "character": "Hatsune_Miku"}, "2026-10-02T08:00:00", 832, 1216)
+    index.add(4, {"tags": "1girl, rain", "artist": "@other"}, "2026-10-03T07:00:00", 832, 1216)
+    return index
+
+
+def test_terms_are_normalized():
+    assert normalize_term(" (Hatsune_Miku:1.2) ") == "hatsune miku"
+    assert extract_terms({"tags": "rain, Rain, [snow]", "artist": "@fkey", "seed": 1}) == ["rain", "snow", "@fkey"]
+    assert parse_query("@fkey, rain | snow,") == [["@fkey"], ["rain", "snow"]]
+    assert parse_query([["@FKEY"], ["rain", ""]]) == [["@fkey"], ["rain"]]
+
+
+def test_search_and_of_or_newest_first():
+    index = _index()
+    assert index.search("@fkey, rain | snow") == [2, 1]
+    assert index.search("1girl") == [4, 2, 1]
+    assert index.search("hatsune_miku") == [3]
+    assert index.search("1girl, missing") == []
+    assert index.search("") == [4, 3, 2, 1]
+    assert index.search("1girl", limit=2) == [4, 2]
+
+
+def test_search_filters():
+    index = _index()
+    assert index.search("snow", width=832, height=1216) == [3]
+    assert index.search("", since="2026-10-01", until="2026-10-02") == [3, 2]
+    assert index.search("rain", since="2026-10") == [4]
+
+
+def test_out_of_order_and_duplicate_ids():
+    index = HistoryIndex()
+    for record_id in (5, 3, 4, 3):
+        index.add(record_id, {"tags": "rain"})
+    assert len(index) == 3 and 4 in index and 6 not in index
+    assert index.search("rain") == [5, 4, 3]
+    assert index.terms() == [("rain", 3)]
+    assert index.terms("sn") == []
@@ -0,0 +1,13 @@
+from executor.history_sqlite import SQLiteHistoryManager
+
+
+def test_search_sees_rows_from_other_processes(tmp_path):
+    db = tmp_path / "history.sqlite3"
+    ours = SQLiteHistoryManager(db)
+    other = SQLiteHistoryManager(db)  # 另一个进程：独立的连接与检索索引
+    ours.add({"artist": "@fkey", "tags": "smile"})
+    assert [r.id for r in ours.search("smile")] == [1]
+
+    record = other.add({"artist": "@jima", "tags": "smile, white dress"})
+    assert [r.id for r in ours.search("smile")] == [record.id, 1]
+    assert [r.id for r in ours.search("white dress")] == [record.id]
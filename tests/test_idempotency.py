@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import pytest
+
+from executor.idempotency import IdempotencyConflictError, IdempotencyStore, request_fingerprint
+
+
+def test_retry_joins_running_job():
+    store = IdempotencyStore(ttl_s=60)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def job():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"images": ["a.png"]}
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(store.run("k", "fp", job)))
+    first.start()
+    assert started.wait(5)
+    retry = threading.Thread(target=lambda: results.append(store.run("k", "fp", job)))
+    retry.start()
+    release.set()
+    first.join()
+    retry.join()
+    assert calls == [1]
+    assert results == [{"images": ["a.png"]}] * 2
+    assert results[0] is not results[1]
+
+
+def test_completed_result_is_replayed_as_copy():
+    store = IdempotencyStore(ttl_s=60)
+    first = store.run("k", "fp", lambda: {"images": ["a.png"]})
+    first["images"].append("mutated")
+    assert store.run("k", "fp", lambda: pytest.fail("不应重新执行")) == {"images": ["a.png"]}
+    with pytest.raises(IdempotencyConflictError):
+        store.run("k", "other", lambda: None)
+
+
+def test_failures_are_not_cached_and_disabled_store_always_runs():
+    store = IdempotencyStore(ttl_s=60)
+    with pytest.raises(RuntimeError):
+        store.run("k", "fp", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert store.run("k", "fp", lambda: "retried") == "retried"
+
+    disabled = IdempotencyStore(ttl_s=0)
+    calls = []
+    for _ in range(2):
+        disabled.run("k", "fp", lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_run_async_replays():
+    store = IdempotencyStore(ttl_s=60)
+    calls = []
+
+    async def job():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"ok": True}
+
+    async def main():
+        return await asyncio.gather(store.run_async("k", "fp", job), store.run_async("k", "fp", job))
+
+    assert asyncio.run(main()) == [{"ok": True}, {"ok": True}]
+    assert calls == [1]
+
+
+def test_generate_deduplicates_by_key(executor, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        executor, "_generate", lambda prompt_json, **kwargs: calls.append(prompt_json) or {"success": True}
+    )
+    assert executor.generate({"tags": "smile"}, idempotency_key="req-1") == {"success": True}
+    assert executor.generate({"tags": "smile"}, idempotency_key="req-1") == {"success": True}
+    with pytest.raises(IdempotencyConflictError):
+        executor.generate({"tags": "frown"}, idempotency_key="req-1")
+    executor.generate({"tags": "smile"})
+    assert len(calls) == 2
+    assert request_fingerprint({"a": 1, "b": 2}) == request_fingerprint({"b": 2, "a": 1})
@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+from executor import imaging
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _write_png(path):
+    Image.new("RGB", (64, 32), (200, 40, 40)).save(path, format="PNG")
+    return path.read_bytes()
+
+
+def test_same_format_does_not_overwrite_source(tmp_path):
+    source = tmp_path / "AnimaTool_00001_.png"
+    original = _write_png(source)
+    result = imaging.process_image(str(source), source.name, str(tmp_path), "png", 90, 16, False)
+    assert "transcoded" not in result
+    assert source.read_bytes() == original
+    assert (tmp_path / "thumbs" / "AnimaTool_00001_.webp").exists()
+
+
+def test_transcode_writes_next_to_source(tmp_path):
+    source = tmp_path / "AnimaTool_00002_.png"
+    original = _write_png(source)
+    result = imaging.process_image(str(source), source.name, str(tmp_path), "webp", 90, 0, False)
+    assert result["transcoded"]["file_path"] == str(tmp_path / "AnimaTool_00002_.webp")
+    assert source.read_bytes() == original
+
+
+def test_contact_sheet_grid_and_labels(tmp_path):
+    source = tmp_path / "AnimaTool_00003_.png"
+    _write_png(source)
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 64), (40, 40, 200)).save(buf, format="PNG")
+    tiles = [(str(source), "#1 seed:1"), (buf.getvalue(), "#2 seed:2"), (b"not an image", "#3 seed:3")]
+    sheet = imaging.make_contact_sheet(tiles, str(tmp_path / "sheets" / "sheet.webp"), max_size=256)
+    assert sheet["mime_type"] == "image/webp"
+    assert (tmp_path / "sheets" / "sheet.webp").read_bytes() == sheet["content"]
+    assert max(sheet["width"], sheet["height"]) <= 256
+    # 3 张排成 2×2：第一行依次是红图、蓝图，读取失败的第三张留空
+    img = Image.open(io.BytesIO(sheet["content"])).convert("RGB")
+    assert img.size == (sheet["width"], sheet["height"])
+    cell = sheet["width"] // 2
+    red = img.getpixel((cell // 2, cell // 2))
+    blue = img.getpixel((cell + cell // 2, cell // 2))
+    blank = img.getpixel((cell // 2, sheet["height"] - cell // 2 - 20))
+    assert red[0] > 150 and red[2] < 100
+    assert blue[2] > 150 and blue[0] < 100
+    assert max(blank) < 60
+
+
+def test_contact_sheet_requires_tiles():
+    with pytest.raises(ValueError):
+        imaging.make_contact_sheet([], None)
@@ -0,0 +1,221 @@
+import asyncio
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from executor.cancellation import CancelToken, JobCancelledError
+from executor.inprocess import InProcessBackend
+
+
+class FakeQueue:
+    """PromptQueue 的最小实现：put / get_current_queue / delete_queue_item / get_history"""
+
+    def __init__(self):
+        self.pending = []
+        self.running = []
+        self.history = {}
+        self.history_calls = 0
+
+    def put(self, item):
+        self.pending.append(item)
+
+    def get_current_queue(self):
+        return list(self.running), list(self.pending)
+
+    def delete_queue_item(self, function):
+        for i, item in enumerate(self.pending):
+            if function(item):
+                del self.pending[i]
+                return True
+        return False
+
+    def get_history(self, prompt_id=None):
+        self.history_calls += 1
+        return {prompt_id: self.history[prompt_id]} if prompt_id in self.history else {}
+
+    def start(self, prompt_id):
+        item = next(item for item in self.pending if item[1] == prompt_id)
+        self.pending.remove(item)
+        self.running.append(item)
+
+    def finish(self, prompt_id):
+        self.running = [item for item in self.running if item[1] != prompt_id]
+        self.history[prompt_id] = {"outputs": {"9": {"images": []}}, "status": {"completed": True}}
+
+
+class FakePromptServer:
+    def __init__(self):
+        self.number = 5
+        self.prompt_queue = FakeQueue()
+        self.loop = None
+        self.sent = []
+
+    def send_sync(self, event, data, sid=None):
+        self.sent.append((event, data, sid))
+
+
+def _execution(valid=True, sensitive=False):
+    module = types.SimpleNamespace(
+        validate_prompt=lambda prompt_id, prompt, partial: (valid, None if valid else "bad prompt", ["9"], {})
+    )
+    if sensitive:
+        module.SENSITIVE_EXTRA_DATA_KEYS = ("auth_token_comfy_org",)
+    return module
+
+
+@pytest.fixture
+def server():
+    return FakePromptServer()
+
+
+@pytest.fixture
+def interrupts(monkeypatch):
+    calls = []
+    comfy = types.ModuleType("comfy")
+    comfy.model_management = types.SimpleNamespace(interrupt_current_processing=lambda value=True: calls.append(value))
+    monkeypatch.setitem(sys.modules, "comfy", comfy)
+    monkeypatch.setitem(sys.modules, "comfy.model_management", comfy.model_management)
+    return calls
+
+
+def test_send_sync_is_wrapped_and_forwarded(server):
+    backend = InProcessBackend(server, _execution())
+    prompt_id = backend.queue_prompt({"9": {}}, "client-1")
+    server.send_sync("executing", {"node": "9", "prompt_id": prompt_id}, "sid-1")
+    server.send_sync("progress", "not a dict")
+    assert server.sent == [
+        ("executing", {"node": "9", "prompt_id": prompt_id}, "sid-1"),
+        ("progress", "not a dict", None),
+    ]
+
+    def run():
+        server.prompt_queue.start(prompt_id)
+        server.prompt_queue.finish(prompt_id)
+        server.send_sync("executing", {"node": None, "prompt_id": prompt_id})
+
+    threading.Timer(0.05, run).start()
+    item = backend.wait_history(prompt_id, timeout_s=5.0)
+    assert item["status"]["completed"]
+    assert not backend.owns(prompt_id)
+
+
+@pytest.mark.parametrize("sensitive", [False, True])
+def test_queue_prompt_item(server, sensitive):
+    backend = InProcessBackend(server, _execution(sensitive=sensitive))
+    prompt = {"9": {"class_type": "SaveImage"}}
+    prompt_id = backend.queue_prompt(prompt, "client-1")
+    front_id = backend.queue_prompt(prompt, "client-1", front=True)
+    extra = ({},) if sensitive else ()
+    assert server.prompt_queue.pending == [
+        (5, prompt_id, prompt, {"client_id": "client-1"}, ["9"]) + extra,
+        (-6, front_id, prompt, {"client_id": "client-1"}, ["9"]) + extra,
+    ]
+    assert server.number == 7
+    assert backend.owns(prompt_id) and backend.owns(front_id)
+
+
+def test_queue_prompt_validation_error(server):
+    backend = InProcessBackend(server, _execution(valid=False))
+    with pytest.raises(RuntimeError, match="bad prompt"):
+        backend.queue_prompt({"9": {}}, "client-1")
+    assert server.prompt_queue.pending == []
+
+
+def test_cancel_paths(server, interrupts):
+    backend = InProcessBackend(server, _execution())
+    pending = backend.queue_prompt({"9": {}}, "client-1")
+    running = backend.queue_prompt({"9": {}}, "client-1")
+    server.prompt_queue.start(running)
+
+    assert backend.cancel(pending) == "deleted"
+    assert server.prompt_queue.pending == []
+    assert backend.cancel(running) == "interrupted"
+    assert interrupts == [True]
+    assert backend.cancel("unknown") == "not_found"
+
+
+def test_wait_history_timeout_deletes_pending(server, interrupts):
+    backend = InProcessBackend(server, _execution())
+    prompt_id = backend.queue_prompt({"9": {}}, "client-1")
+    with pytest.raises(TimeoutError):
+        backend.wait_history(prompt_id, timeout_s=0.1)
+    assert server.prompt_queue.pending == []
+    assert interrupts == []
+    assert not backend.owns(prompt_id)
+
+
+def test_wait_history_cancel_interrupts_running(server, interrupts):
+    backend = InProcessBackend(server, _execution())
+    prompt_id = backend.queue_prompt({"9": {}}, "client-1")
+    server.prompt_queue.start(prompt_id)
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("client disconnected",)).start()
+    with pytest.raises(JobCancelledError):
+        backend.wait_history(prompt_id, timeout_s=5.0, cancel_token=token)
+    assert interrupts == [True]
+
+
+def test_exec_timeout_starts_when_running(server, interrupts):
+    backend = InProcessBackend(server, _execution())
+    prompt_id = backend.queue_prompt({"9": {}}, "client-1")
+
+    def start():
+        server.prompt_queue.start(prompt_id)
+        server.send_sync("execution_start", {"prompt_id": prompt_id})
+
+    threading.Timer(0.3, start).start()
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        backend.wait_history(prompt_id, timeout_s=5.0, exec_timeout_s=0.2)
+    assert time.perf_counter() - started >= 0.5
+    assert interrupts == [True]
+
+
+def test_wait_history_reads_history_only_after_done_event(server):
+    backend = InProcessBackend(server, _execution())
+    prompt_id = backend.queue_prompt({"9": {}}, "client-1")
+
+    def run():
+        server.prompt_queue.start(prompt_id)
+        server.send_sync("execution_start", {"prompt_id": prompt_id})
+        server.prompt_queue.finish(prompt_id)
+        server.send_sync("executing", {"node": None, "prompt_id": prompt_id})
+
+    threading.Timer(0.6, run).start()
+    assert backend.wait_history(prompt_id, timeout_s=5.0)["status"]["completed"]
+    assert server.prompt_queue.history_calls == 1
+
+
+def test_queue_prompt_numbers_on_server_loop(server):
+    """编号分配与入队在 ComfyUI 的事件循环上进行，与 /prompt 处理器串行"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server.loop = loop
+    put = server.prompt_queue.put
+    threads = []
+
+    def put_on_loop(item):
+        threads.append(threading.current_thread())
+        put(item)
+
+    server.prompt_queue.put = put_on_loop
+    try:
+        backend = InProcessBackend(server, _execution())
+        workers = [
+            threading.Thread(target=backend.queue_prompt, args=({"9": {}}, f"client-{i}")) for i in range(8)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    assert set(threads) == {thread}
+    assert sorted(item[0] for item in server.prompt_queue.pending) == list(range(5, 13))
+    assert server.number == 13
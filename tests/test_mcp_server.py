@@ -0,0 +1,58 @@
+import asyncio
+import base64
+import io
+
+import pytest
+
+mcp_server = pytest.importorskip("servers.mcp_server")
+from mcp.types import ImageContent  # noqa: E402
+
+
+def test_images_inline_without_embed_base64_or_thumbnails(executor, monkeypatch):
+    executor.config.embed_base64 = False
+    executor.config.thumbnail_size = 0
+    data = base64.b64encode(b"\x89PNG fake").decode("ascii")
+    calls = []
+
+    def generate(params, include_base64=None, **kwargs):
+        calls.append(include_base64)
+        image = {"filename": "AnimaTool_00001_.png", "mime_type": "image/png"}
+        if include_base64:
+            image["base64"] = data
+        return {"success": True, "history_id": 1, "seed": 1, "images": [image]}
+
+    monkeypatch.setattr(executor, "generate", generate)
+    contents = asyncio.run(mcp_server._generate_with_repeat(executor, {"tags": "smile"}))
+    assert calls == [True]
+    images = [c for c in contents if isinstance(c, ImageContent)]
+    assert [c.data for c in images] == [data]
+
+
+def test_contact_sheet_combines_repeats(executor, monkeypatch):
+    from executor import imaging
+
+    Image = pytest.importorskip("PIL.Image")
+    executor.config.thumbnail_size = 0
+    executor.config.download_images = False
+    executor.config.postprocess_workers = 0
+    monkeypatch.setattr(imaging, "_pool", None)
+    seeds = iter(range(1, 10))
+
+    def generate(params, include_base64=None, **kwargs):
+        buf = io.BytesIO()
+        Image.new("RGB", (48, 48), (200, 40, 40)).save(buf, format="PNG")
+        seed = next(seeds)
+        image = {"filename": f"AnimaTool_{seed:05d}_.png", "mime_type": "image/png"}
+        if include_base64:
+            image["base64"] = base64.b64encode(buf.getvalue()).decode("ascii")
+        return {"success": True, "history_id": seed, "seed": seed, "images": [image]}
+
+    monkeypatch.setattr(executor, "generate", generate)
+    contents = asyncio.run(
+        mcp_server._generate_with_repeat(executor, {"tags": "smile", "repeat": 3, "contact_sheet": True})
+    )
+    images = [c for c in contents if isinstance(c, ImageContent)]
+    assert len(images) == 1 and images[0].mimeType == "image/webp"
+    text = "\n".join(c.text for c in contents if not isinstance(c, ImageContent))
+    assert "拼图共 3 张" in text
+    assert all(f"#{i} seed:{i}" in text for i in (1, 2, 3))
@@ -0,0 +1,49 @@
+import pytest
+
+from executor.metrics import Metrics
+
+
+def test_render_prometheus_text():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.describe("anima_stage_seconds", "histogram", "stage seconds")
+    for value in (0.05, 0.5, 2.0):
+        metrics.observe("anima_stage_seconds", value, stage="submit")
+    metrics.inc("anima_jobs_total", outcome="ok", model='a"b')
+    metrics.gauge("anima_up", "backend up", lambda: [({"backend": "local"}, 1)])
+    metrics.gauge("anima_broken", "raises", lambda: 1 / 0)
+    text = metrics.render()
+    assert 'anima_jobs_total{model="a\\"b",outcome="ok"} 1' in text
+    assert "# HELP anima_stage_seconds stage seconds\n# TYPE anima_stage_seconds histogram" in text
+    assert 'anima_stage_seconds_bucket{stage="submit",le="0.1"} 1' in text
+    assert 'anima_stage_seconds_bucket{stage="submit",le="1"} 2' in text
+    assert 'anima_stage_seconds_bucket{stage="submit",le="+Inf"} 3' in text
+    assert 'anima_stage_seconds_sum{stage="submit"} 2.55' in text
+    assert 'anima_stage_seconds_count{stage="submit"} 3' in text
+    assert 'anima_up{backend="local"} 1' in text
+    assert "anima_broken" not in text
+
+
+def test_generate_records_stage_metrics(fake_backend):
+    result = fake_backend.generate({"tags": "smile"})
+    assert result["timings"]["execute_s"] == 2.0
+    snapshot = fake_backend.metrics.snapshot("anima_stage_seconds")
+    stages = {dict(key)["stage"]: count for key, (count, _sum) in snapshot.items()}
+    for stage in ("model_check", "inject", "validate", "queue_wait", "submit", "comfy_queue", "execute", "encode", "total"):
+        assert stages[stage] == 1
+    text = fake_backend.metrics_text()
+    assert 'anima_jobs_total{backend="http://127.0.0.1:1"' in text
+    assert 'anima_scheduler_jobs{priority="interactive",state="outstanding"} 0' in text
+
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    testclient = pytest.importorskip("fastapi.testclient")
+    monkeypatch.setenv("COMFYUI_URL", "http://127.0.0.1:1")
+    monkeypatch.setenv("ANIMATOOL_OUTPUT_DIR", str(tmp_path / "outputs"))
+    monkeypatch.setenv("ANIMATOOL_HISTORY_DIR", str(tmp_path))
+    monkeypatch.setenv("ANIMATOOL_HEALTH_INTERVAL", "0")
+    from servers.http_server import create_app
+
+    response = testclient.TestClient(create_app()).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE anima_backend_up gauge" in response.text
@@ -0,0 +1,48 @@
+import pytest
+
+from executor.object_info import ObjectInfoCache, PromptValidationError
+
+OBJECT_INFO = {
+    "KSampler": {"input": {"required": {
+        "sampler_name": [["euler", "er_sde"], {}],
+        "steps": ["INT", {"min": 1, "max": 100}],
+    }}},
+    "CLIPTextEncode": {"input": {"required": {"text": ["STRING", {}]}}},
+}
+
+PROMPT = {
+    "1": {"class_type": "KSampler", "inputs": {"sampler_name": "euler", "steps": 20}},
+    "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "1girl"}},
+}
+
+
+def test_single_fetch_for_all_node_types():
+    calls = []
+    cache = ObjectInfoCache(lambda: calls.append(1) or OBJECT_INFO, ttl_s=300.0)
+    cache.validate(PROMPT)
+    cache.validate(PROMPT)
+    assert len(calls) == 1
+
+
+def test_reports_errors_and_unknown_nodes():
+    cache = ObjectInfoCache(lambda: OBJECT_INFO, ttl_s=300.0, min_refresh_s=0.0)
+    prompt = dict(PROMPT)
+    prompt["1"] = {"class_type": "KSampler", "inputs": {"sampler_name": "eular", "steps": 500}}
+    prompt["3"] = {"class_type": "MissingNode", "inputs": {}}
+    with pytest.raises(PromptValidationError) as exc:
+        cache.validate(prompt)
+    assert len(exc.value.errors) == 3
+
+
+def test_fetch_failure_skips_validation():
+    def fetch():
+        raise OSError("connection refused")
+
+    cache = ObjectInfoCache(fetch, ttl_s=300.0)
+    cache.validate({"1": {"class_type": "KSampler", "inputs": {"sampler_name": "nope"}}})
+
+
+def test_executor_skips_validation_while_backend_down(executor, monkeypatch):
+    monkeypatch.setattr(executor.object_info, "_fetch", lambda: pytest.fail("不应请求 /object_info"))
+    executor.breaker.trip("connection refused")
+    executor.validate_prompt({"1": {"class_type": "KSampler", "inputs": {"sampler_name": "nope"}}})
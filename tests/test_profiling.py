@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from executor.profiling import ChromeTracer, Hooks, request_scope
+
+
+def _read_trace(path):
+    text = path.read_text(encoding="utf-8")
+    # 文件省略结尾的 "]"，每个事件后都有逗号
+    return json.loads(text.rstrip().rstrip(",") + "]")
+
+
+def test_hooks_subscribe_emit_unsubscribe(capsys):
+    hooks = Hooks()
+    seen = []
+    unsubscribe = hooks.subscribe("*", lambda event, payload: seen.append((event, payload["n"])))
+
+    def broken(event, payload):
+        raise RuntimeError("boom")
+
+    hooks.subscribe("job_start", broken)
+    assert hooks.active("job_start") and hooks.active("http_call")
+    hooks.emit("job_start", {"n": 1})
+    unsubscribe()
+    hooks.emit("http_call", {"n": 2})
+    assert seen == [("job_start", 1)]
+    assert not hooks.active("http_call")
+    captured = capsys.readouterr()
+    assert captured.out == "" and "boom" in captured.err
+    with pytest.raises(ValueError):
+        hooks.subscribe("job_started", broken)
+
+
+def test_generate_emits_hooks_with_request_id(fake_backend):
+    events = []
+    fake_backend.hooks.subscribe("*", lambda event, payload: events.append((event, dict(payload))))
+    with request_scope("req-42"):
+        result = fake_backend.generate({"tags": "smile"})
+    names = [event for event, _payload in events]
+    assert names[0] == "job_start" and names[-1] == "job_end"
+    assert "history_write" in names
+    stages = [payload["stage"] for event, payload in events if event == "stage_end"]
+    assert stages[:5] == ["model_check", "inject", "validate", "queue_wait", "submit"]
+    assert {payload["request_id"] for _event, payload in events} == {"req-42"}
+    assert len({payload["job"] for _event, payload in events}) == 1
+    end = events[-1][1]
+    assert end["outcome"] == "ok" and end["prompt_id"] == "p1"
+    assert end["comfy_window"] == (1000.0, 1002.0)
+    assert result["request_id"] == "req-42"
+
+
+def test_chrome_trace_export(fake_backend, tmp_path):
+    tracer = ChromeTracer(tmp_path / "traces", sample_rate=1.0).attach(fake_backend.hooks)
+    try:
+        fake_backend.generate({"tags": "smile"})
+    finally:
+        tracer.close()
+    events = _read_trace(tracer.path)
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert {"inject", "submit", "history_write"} <= set(spans)
+    comfy = spans["ComfyUI execute p1"]
+    assert comfy["tid"] == 0 and comfy["dur"] == 2_000_000
+    assert any(e["ph"] == "M" and e["args"]["name"] == "ComfyUI (execution)" for e in events)
+    assert any(e["name"] == "history_record" for e in events)
+
+
+def test_chrome_trace_sampling_off(fake_backend, tmp_path):
+    tracer = ChromeTracer(tmp_path / "traces", sample_rate=0.0).attach(fake_backend.hooks)
+    try:
+        fake_backend.generate({"tags": "smile"})
+    finally:
+        tracer.close()
+    assert not tracer.path.exists()
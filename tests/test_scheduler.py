@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from executor.cancellation import CancelToken, JobCancelledError
+from executor.scheduler import BATCH, INTERACTIVE, NORMAL, JobScheduler, normalize_priority
+
+
+class Runner:
+    """在线程中依次提交任务，记录各任务取得名额的顺序"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.order = []
+        self.threads = []
+
+    def submit(self, name, hold=None, **kwargs):
+        granted = threading.Event()
+
+        def run():
+            with self.scheduler.slot(**kwargs) as slot:
+                self.order.append((name, slot.front))
+                granted.set()
+                if hold is not None:
+                    hold.wait(5)
+
+        waiting = sum(self.scheduler.stats()["waiting"].values())
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        # 等到本任务已放行或已排进本地队列，保证提交顺序确定
+        deadline = time.time() + 5
+        while not granted.is_set() and sum(self.scheduler.stats()["waiting"].values()) <= waiting:
+            assert time.time() < deadline
+            time.sleep(0.005)
+        return granted
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(5)
+        return [name for name, _front in self.order]
+
+
+def test_normalize_priority():
+    assert normalize_priority(None) == NORMAL
+    assert normalize_priority(" Interactive ") == INTERACTIVE
+    assert normalize_priority(2) == BATCH
+    with pytest.raises(ValueError):
+        normalize_priority("urgent")
+
+
+def test_interactive_admitted_ahead_of_batch():
+    scheduler = JobScheduler(max_outstanding=1)
+    runner = Runner(scheduler)
+    release = threading.Event()
+    assert runner.submit("normal", hold=release, priority=NORMAL).is_set()
+    runner.submit("batch-1", priority=BATCH)
+    runner.submit("batch-2", priority=BATCH)
+    # 低优先级任务占满名额时，交互式任务不必等待，并插到 ComfyUI 队首
+    assert runner.submit("interactive", priority=INTERACTIVE).wait(1)
+    assert scheduler.stats()["waiting"][BATCH] == 2
+    release.set()
+    assert runner.join() == ["normal", "interactive", "batch-1", "batch-2"]
+    assert dict(runner.order)["interactive"] is True
+    assert dict(runner.order)["batch-1"] is False
+
+
+def test_unlimited_scheduler_does_not_queue():
+    scheduler = JobScheduler(max_outstanding=0)
+    with scheduler.slot(BATCH) as first, scheduler.slot(BATCH), scheduler.slot(INTERACTIVE) as interactive:
+        assert not first.front and not interactive.front
+        assert scheduler.stats()["outstanding"] == {INTERACTIVE: 1, NORMAL: 0, BATCH: 2}
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    scheduler = JobScheduler(max_outstanding=1)
+    token = CancelToken()
+    with scheduler.slot(NORMAL):
+        threading.Timer(0.05, token.cancel, args=("client disconnected",)).start()
+        with pytest.raises(JobCancelledError):
+            with scheduler.slot(BATCH, token):
+                pytest.fail("已取消的任务不应取得名额")
+    assert scheduler.stats()["waiting"] == {INTERACTIVE: 0, NORMAL: 0, BATCH: 0}
+    with scheduler.slot(BATCH) as slot:
+        assert slot.queue_wait_s < 0.1
+
+
+def test_fair_queuing_interleaves_clients():
+    scheduler = JobScheduler(max_outstanding=1, policy="fair")
+    runner = Runner(scheduler)
+    release = threading.Event()
+    runner.submit("blocker", hold=release, client="other")
+    for i in range(3):
+        runner.submit(f"a{i}", client="a")
+    runner.submit("b0", client="b")
+    release.set()
+    # 一次提交多个任务的客户端 a 不会挡住之后到达的客户端 b
+    assert runner.join() == ["blocker", "a0", "b0", "a1", "a2"]
+
+
+def test_fair_queuing_honours_weights_and_cost():
+    scheduler = JobScheduler(max_outstanding=1, policy="fair")
+    runner = Runner(scheduler)
+    release = threading.Event()
+    runner.submit("blocker", hold=release, client="other")
+    for i in range(3):
+        runner.submit(f"heavy{i}", client="heavy", weight=2.0)
+    runner.submit("light0", client="light")
+    runner.submit("light1", client="light")
+    runner.submit("big", client="big", cost=10.0)
+    release.set()
+    assert runner.join() == ["blocker", "heavy0", "heavy1", "light0", "heavy2", "light1", "big"]
+
+
+def test_sjf_dispatches_shortest_first():
+    scheduler = JobScheduler(max_outstanding=1, policy="sjf", max_wait_s=0)
+    runner = Runner(scheduler)
+    release = threading.Event()
+    runner.submit("blocker", hold=release, cost=5.0)
+    runner.submit("big", cost=30.0)
+    runner.submit("small", cost=2.0)
+    jobs = scheduler.jobs()
+    assert [(j["state"], j["predicted_s"]) for j in jobs] == [("running", 5.0), ("queued", 2.0), ("queued", 30.0)]
+    assert jobs[1]["queue_wait_s"] <= 5.0 and jobs[2]["eta_s"] <= 37.0
+    release.set()
+    assert runner.join() == ["blocker", "small", "big"]
+
+
+def test_sjf_aged_job_is_dispatched_first():
+    scheduler = JobScheduler(max_outstanding=1, policy="sjf", max_wait_s=0.2)
+    runner = Runner(scheduler)
+    release = threading.Event()
+    runner.submit("blocker", hold=release, cost=5.0)
+    runner.submit("big", cost=30.0)
+    runner.submit("small", cost=2.0)
+    time.sleep(0.3)
+    release.set()
+    # 等待超过 max_wait_s 的任务按到达顺序优先，大任务不会饿死
+    assert runner.join() == ["blocker", "big", "small"]
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+
+class FakeComfyUI:
+    """/queue 与 /history：本任务排在其他客户端的任务后面，pending_s 秒后开始执行，再过 execute_s 秒完成"""
+
+    def __init__(self, prompt_id, pending_s, execute_s, queue_error=False):
+        self.prompt_id = prompt_id
+        self.started = time.time()
+        self.pending_s = pending_s
+        self.execute_s = execute_s
+        self.queue_error = queue_error
+        self.calls = {"queue": 0, "history": 0}
+
+    def get_json(self, url, timeout=None):
+        elapsed = time.time() - self.started
+        if url.endswith("/queue"):
+            self.calls["queue"] += 1
+            if self.queue_error:
+                raise ConnectionError("transient /queue failure")
+            foreign = [[1, "foreign-1", {}, {}, []]]
+            if elapsed < self.pending_s:
+                return {"queue_running": foreign, "queue_pending": [[2, "foreign-2", {}, {}, []], [3, self.prompt_id, {}, {}, []]]}
+            return {"queue_running": [[3, self.prompt_id, {}, {}, []]], "queue_pending": []}
+        self.calls["history"] += 1
+        if elapsed >= self.pending_s + self.execute_s:
+            return {self.prompt_id: {"outputs": {}, "status": {"completed": True}}}
+        return {}
+
+
+@pytest.fixture
+def cancelled(executor, monkeypatch):
+    calls = []
+    monkeypatch.setattr(executor, "cancel_job", lambda prompt_id: calls.append(prompt_id) or "interrupted")
+    return calls
+
+
+def test_exec_timeout_excludes_foreign_backlog(executor, monkeypatch, cancelled):
+    comfy = FakeComfyUI("p1", pending_s=0.6, execute_s=0.1)
+    monkeypatch.setattr(executor, "_http_get_json", comfy.get_json)
+    item = executor.wait_history("p1", timeout_s=5.0, exec_timeout_s=0.3)
+    assert item["status"]["completed"]
+    assert cancelled == []
+
+
+def test_exec_timeout_counts_from_execution_start(executor, monkeypatch, cancelled):
+    comfy = FakeComfyUI("p2", pending_s=0.3, execute_s=10.0)
+    monkeypatch.setattr(executor, "_http_get_json", comfy.get_json)
+    started = time.time()
+    with pytest.raises(TimeoutError):
+        executor.wait_history("p2", timeout_s=5.0, exec_timeout_s=0.3)
+    assert 0.55 <= time.time() - started < 2.0
+    assert cancelled == ["p2"]
+
+
+def test_queue_errors_keep_job_pending(executor, monkeypatch, cancelled):
+    comfy = FakeComfyUI("p3", pending_s=0.0, execute_s=0.6, queue_error=True)
+    monkeypatch.setattr(executor, "_http_get_json", comfy.get_json)
+    item = executor.wait_history("p3", timeout_s=5.0, exec_timeout_s=0.2)
+    assert item["status"]["completed"]
+    assert cancelled == []
+
+
+def test_queue_checked_every_few_polls(executor, monkeypatch, cancelled):
+    comfy = FakeComfyUI("p4", pending_s=10.0, execute_s=0.0)
+    monkeypatch.setattr(executor, "_http_get_json", comfy.get_json)
+    with pytest.raises(TimeoutError):
+        executor.wait_history("p4", timeout_s=0.5, exec_timeout_s=0.2)
+    assert comfy.calls["history"] >= 10
+    assert comfy.calls["queue"] <= comfy.calls["history"] // 5 + 1
+
+
+def test_job_timeout_ignores_backlog(executor):
+    executor.config.timeout_factor = 4.0
+    assert executor._job_timeout(10.0, confident=False) is None
+    assert executor._job_timeout(10.0, confident=True) == 120.0
+    assert executor._job_timeout(100.0, confident=True) == min(float(executor.config.timeout_s), 400.0)
@@ -0,0 +1,83 @@
+import pytest
+
+from executor import GenerationRecord
+
+
+def _record(tmp_path, steps=None, init_image=None):
+    image = tmp_path / "AnimaTool_00001_.png"
+    image.write_bytes(b"\x89PNG fake")
+    params = {"tags": "1girl"}
+    if steps is not None:
+        params["steps"] = steps
+    if init_image:
+        params["init_image"] = init_image
+    return GenerationRecord(
+        id=7, timestamp="2026-10-01T00:00:00", params=params, width=832, height=1216, images=[str(image)]
+    )
+
+
+def test_inject_init_image_replaces_empty_latent(executor):
+    wf = executor._inject(
+        {"tags": "1girl", "width": 832, "height": 1216, "batch_size": 2, "init_image": "anima_abc.png", "denoise": 0.4}
+    )
+    assert wf["28"]["class_type"] == "VAEEncode"
+    assert wf["28"]["inputs"]["vae"] == ["15", 0]
+    scale = wf[wf["28"]["inputs"]["pixels"][0]]
+    assert scale["class_type"] == "ImageScale"
+    assert (scale["inputs"]["width"], scale["inputs"]["height"]) == (832, 1216)
+    assert wf[scale["inputs"]["image"][0]] == {"class_type": "LoadImage", "inputs": {"image": "anima_abc.png"}}
+    repeat = wf[wf["19"]["inputs"]["latent_image"][0]]
+    assert repeat == {"class_type": "RepeatLatentBatch", "inputs": {"samples": ["28", 0], "amount": 2}}
+    assert wf["19"]["inputs"]["denoise"] == 0.4
+    assert executor._latent_size(wf) == (832, 1216)
+
+
+def test_inject_without_init_image_keeps_empty_latent(executor):
+    wf = executor._inject({"tags": "1girl", "width": 832, "height": 1216})
+    assert wf["28"]["class_type"] == "EmptyLatentImage"
+    assert wf["19"]["inputs"]["latent_image"] == ["28", 0]
+    assert not any(node["class_type"] in ("LoadImage", "VAEEncode") for node in wf.values())
+
+
+def test_prepare_variation_references_output_dir(executor, tmp_path):
+    executor.config.comfyui_output_dir = str(tmp_path)
+    record = _record(tmp_path)
+    merged = executor.prepare_variation(dict(record.params), record, strength=0.4)
+    assert merged["init_image"] == "AnimaTool_00001_.png [output]"
+    assert merged["denoise"] == 0.4
+    assert merged["steps"] == 10  # 模板 25 步 × 0.4
+    assert (merged["width"], merged["height"]) == (832, 1216)
+
+    # 显式覆盖 steps / 源记录已是变体时不再缩减
+    assert executor.prepare_variation({"tags": "1girl", "steps": 30}, record, strength=0.4)["steps"] == 30
+    variant = _record(tmp_path, steps=10, init_image="x.png [output]")
+    assert executor.prepare_variation(dict(variant.params), variant, strength=0.4)["steps"] == 10
+
+
+def test_prepare_variation_uploads_once(executor, tmp_path, monkeypatch):
+    executor.config.comfyui_output_dir = None
+    uploads = []
+
+    def post_multipart(url, fields, files):
+        uploads.append((url, fields, files["image"][0]))
+        return {"name": files["image"][0], "subfolder": "anima"}
+
+    monkeypatch.setattr(executor, "_http_post_multipart", post_multipart)
+    record = _record(tmp_path)
+    first = executor.prepare_variation(dict(record.params), record)
+    second = executor.prepare_variation(dict(record.params), record)
+    assert first["init_image"] == second["init_image"]
+    assert first["init_image"].startswith("anima/anima_") and first["init_image"].endswith(".png")
+    assert first["denoise"] == executor.config.variation_denoise
+    assert len(uploads) == 1 and uploads[0][0].endswith("/upload/image")
+
+
+def test_prepare_variation_rejects_bad_input(executor, tmp_path):
+    record = _record(tmp_path)
+    with pytest.raises(ValueError):
+        executor.prepare_variation({}, record, strength=1.5)
+    with pytest.raises(ValueError):
+        executor.prepare_variation({}, record, image_index=3)
+    (tmp_path / "AnimaTool_00001_.png").unlink()
+    with pytest.raises(ValueError):
+        executor.prepare_variation({}, record)